@@ -45,6 +45,9 @@ def run_health_check():
 		# 7. Vérification de la base de données
 		check_database_health(health_report)
 		
+		# 8. Vérification du disjoncteur OVH
+		check_circuit_breaker(health_report)
+		
 	except Exception as e:
 		health_report["errors"].append(f"Erreur générale lors de la vérification: {str(e)}")
 		health_report["overall_status"] = "error"
@@ -343,6 +346,37 @@ def check_database_health(health_report):
 		health_report["errors"].append(error_msg)
 		print(f"  {error_msg}")
 
+def check_circuit_breaker(health_report):
+	"""Vérifie l'état du disjoncteur de l'API OVH et ses dernières transitions"""
+	print("\n🔌 Vérification du disjoncteur OVH...")
+	
+	try:
+		from ovh_sms_integration.utils.circuit_breaker import STATE_CLOSED, STATE_OPEN
+		
+		settings = frappe.get_single('OVH SMS Settings')
+		status = settings.get_circuit_breaker().get_status()
+		health_report["circuit_breaker"] = status
+		
+		if status["state"] == STATE_CLOSED:
+			health_report["checks"].append(f"✅ Disjoncteur OVH fermé ({status['failures']} échecs récents)")
+			print(f"  ✅ Disjoncteur fermé ({status['failures']} échecs récents)")
+		elif status["state"] == STATE_OPEN:
+			error_msg = "❌ Disjoncteur OVH ouvert: envois suspendus"
+			health_report["errors"].append(error_msg)
+			print(f"  {error_msg}")
+		else:
+			warning_msg = "⚠️ Disjoncteur OVH semi-ouvert: sonde en cours"
+			health_report["warnings"].append(warning_msg)
+			print(f"  {warning_msg}")
+		
+		for transition in status["transitions"][:5]:
+			print(f"    {transition['at']}: {transition['from']} -> {transition['to']} ({transition['reason']})")
+		
+	except Exception as e:
+		warning_msg = f"⚠️ Erreur vérification disjoncteur: {str(e)}"
+		health_report["warnings"].append(warning_msg)
+		print(f"  {warning_msg}")
+
 def get_eligible_events_count(event_filter):
 	"""Compte les événements éligibles aux rappels"""
 	try:
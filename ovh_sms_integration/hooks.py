@@ -140,6 +140,8 @@ after_install = "ovh_sms_integration.install.after_install"
 # ---------------
 # Hook on document methods and events
 
+# Les SMS de soumission sont rendus dans la transaction puis mis en file (SMS Outbox):
+# l'appel OVH part en arrière-plan après le commit et ne retient jamais la soumission
 doc_events = {
 	"Sales Order": {
 		"on_submit": "ovh_sms_integration.utils.sms_utils.send_sales_order_sms"
@@ -164,10 +166,13 @@ doc_events = {
 
 scheduler_events = {
 	"all": [
-		"ovh_sms_integration.ovh_sms_integration.doctype.sms_event_reminder.sms_event_reminder.process_event_reminders"
+		"ovh_sms_integration.ovh_sms_integration.doctype.sms_event_reminder.sms_event_reminder.process_event_reminders",
+		"ovh_sms_integration.tasks.probe_ovh_circuit",
+		"ovh_sms_integration.ovh_sms_integration.doctype.sms_outbox.sms_outbox.dispatch_pending"
 	],
 	"hourly": [
-		"ovh_sms_integration.tasks.check_event_reminders_hourly"
+		"ovh_sms_integration.tasks.check_event_reminders_hourly",
+		"ovh_sms_integration.ovh_sms_integration.doctype.sms_dead_letter.sms_dead_letter.replay_due_dead_letters"
 	],
 	"daily": [
 		"ovh_sms_integration.tasks.reset_daily_counters",
@@ -257,11 +262,19 @@ scheduler_events = {
 # Event Reminder Hooks
 # ---------------------
 
+# Mise à jour des documents d'origine quand un SMS de l'outbox atteint son statut final
+# Signature: handler(reference_name, status, result)
+sms_outbox_status_handlers = {
+	"SMS Pricing Item": [
+		"ovh_sms_integration.ovh_sms_integration.doctype.sms_pricing_campaign.sms_pricing_campaign.on_outbox_status"
+	]
+}
+
 # SMS Event Reminder settings
 event_reminder_settings = {
 	"check_interval_minutes": 30,  # Vérifier toutes les 30 minutes
 	"max_reminders_per_run": 100,  # Limite de rappels par exécution
-	"retry_failed_after_hours": 2,  # Réessayer les échecs après 2h
+	"retry_failed_after_hours": 2,  # Réessayer les échecs après 2h (rejeu des SMS Dead Letter)
 	"cleanup_logs_after_days": 30   # Nettoyer les logs après 30 jours
 }
 
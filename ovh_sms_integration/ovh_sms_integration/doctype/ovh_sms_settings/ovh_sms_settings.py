@@ -2,10 +2,40 @@
 
 import frappe
 import requests
-import hashlib
 import datetime
+import os
+import re
 from frappe.model.document import Document
 from frappe import _
+from frappe.utils import cint, flt
+from urllib.parse import urlparse
+from ovh_sms_integration.utils.ovh_client import (
+	OVHCredentials, RetryPolicy, classify_error, get_ovh_client, get_cached_credentials, clear_cached_credentials,
+	OVH_API_ENDPOINT, DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT, DEFAULT_MAX_RETRIES
+)
+from ovh_sms_integration.utils import ovh_cache
+from ovh_sms_integration.utils.ovh_async import AsyncOVHSender, DEFAULT_CONCURRENCY, run_sync
+from ovh_sms_integration.utils.circuit_breaker import CircuitOpenError, get_circuit_breaker
+from ovh_sms_integration.utils.priority_lanes import get_lane, DEFAULT_LANE, LANE_MARKETING, LANES
+from ovh_sms_integration.utils.rate_limiter import (
+	get_rate_limiter, get_rate_limit_stats, RateLimitExceeded
+)
+from ovh_sms_integration.utils.sms_templates import invalidate_changed_templates, validate_template_fields
+
+# Nombre max de destinataires par job /sms/{service}/jobs
+MAX_RECEIVERS_PER_JOB = 500
+# Variable d'environnement prioritaire sur l'endpoint configuré (ex: faux serveur OVH local)
+ENDPOINT_ENV_VAR = "OVH_SMS_API_ENDPOINT"
+# Part minimale du débit conservée par chaque voie de priorité (la part marketing reste
+# dans [5 %, 95 %]: les deux voies se partagent exactement rate_limit_per_minute).
+# Les parts sont garanties, pas plafonnées: une voie emprunte les jetons inutilisés de l'autre
+MIN_LANE_RATE_SHARE = 0.05
+# Templates des notifications de documents (cache de templates compilés)
+TEMPLATE_FIELDS = ("sales_order_template", "payment_template", "delivery_template", "purchase_order_template")
+
+def clamp_rate_share(percent):
+	"""Part marketing (%) bornée: aucune voie n'est privée de débit, aucune ne prend tout"""
+	return min(100 - MIN_LANE_RATE_SHARE * 100, max(MIN_LANE_RATE_SHARE * 100, flt(percent)))
 
 class OVHSMSSettings(Document):
 	def validate(self):
@@ -18,38 +48,99 @@ class OVHSMSSettings(Document):
 				frappe.throw(_("Consumer Key est requis"))
 			if not self.auto_detect_service and not self.service_name:
 				frappe.throw(_("Service Name est requis si la détection automatique est désactivée"))
+		
+		if self.marketing_rate_share is not None:
+			self.marketing_rate_share = clamp_rate_share(self.marketing_rate_share)
+		
+		validate_template_fields(self, TEMPLATE_FIELDS)
+
+	def on_update(self):
+		"""Invalide les données OVH mises en cache après modification des paramètres"""
+		ovh_cache.invalidate()
+		clear_cached_credentials()
+		invalidate_changed_templates(self, TEMPLATE_FIELDS)
+
+	def get_cache_ttl(self):
+		"""Durée de vie (secondes) du cache service/expéditeurs"""
+		if self.api_cache_ttl is None:
+			return ovh_cache.DEFAULT_TTL
+		return cint(self.api_cache_ttl)
+
+	def get_api_endpoint(self):
+		"""Endpoint de l'API OVH: variable d'environnement, puis paramètres, puis OVH Europe"""
+		return (os.environ.get(ENDPOINT_ENV_VAR) or self.api_endpoint or OVH_API_ENDPOINT).rstrip('/')
+
+	def get_ovh_client(self):
+		"""Retourne le client OVH partagé (session HTTP poolée) du worker"""
+		return get_ovh_client(
+			self.get_api_endpoint(),
+			pool_size=cint(self.http_pool_size) or DEFAULT_POOL_SIZE,
+			keep_alive=bool(self.http_keep_alive)
+		)
+
+	def get_ovh_credentials(self):
+		"""Retourne les identifiants OVH déchiffrés (une fois par version des paramètres)"""
+		version = (frappe.local.site, str(self.modified), self.application_key)
+		return get_cached_credentials(version, self._load_ovh_credentials)
+
+	def _load_ovh_credentials(self):
+		"""Lit et déchiffre les identifiants OVH"""
+		return OVHCredentials(
+			self.application_key,
+			self.get_password("application_secret") or self.application_secret,
+			self.get_password("consumer_key") or self.consumer_key
+		)
+
+	def get_retry_policy(self):
+		"""Politique de rejeu issue des paramètres (max_retries, api_deadline)"""
+		max_retries = DEFAULT_MAX_RETRIES if self.max_retries is None else cint(self.max_retries)
+		return RetryPolicy(max_retries=max_retries, deadline=cint(self.api_deadline) or None)
+
+	def get_circuit_breaker(self):
+		"""Disjoncteur partagé de l'endpoint OVH"""
+		return get_circuit_breaker(
+			urlparse(self.get_api_endpoint()).netloc,
+			cint(self.circuit_failure_threshold),
+			cint(self.circuit_reset_timeout)
+		)
+
+	def _ovh_request(self, method, path, data=None):
+		"""Exécute une requête signée via le client OVH partagé"""
+		return self.get_ovh_client().request(
+			method, path, self.get_ovh_credentials(), data=data,
+			timeout=cint(self.api_timeout) or DEFAULT_TIMEOUT,
+			retry_policy=self.get_retry_policy(),
+			circuit_breaker=self.get_circuit_breaker()
+		)
+
+	def probe_ovh_api(self):
+		"""Sonde légère de l'API (GET /auth/time) pour refermer un disjoncteur ouvert"""
+		return self._ovh_request("GET", "/auth/time")
 
 	def get_service_name(self):
 		"""Récupère le nom du service SMS"""
 		if not self.auto_detect_service and self.service_name:
 			return self.service_name
 		
-		# Auto-détection
+		# Auto-détection (résultat partagé entre workers via le cache)
 		try:
-			services = self.get_sms_services()
-			if services:
-				return services[0]
+			service_name = ovh_cache.get_or_load("service_name", self._detect_service_name, self.get_cache_ttl())
+			if service_name:
+				return service_name
 			else:
 				frappe.throw(_("Aucun service SMS trouvé sur votre compte OVH"))
 		except Exception as e:
 			frappe.throw(_("Erreur lors de la récupération des services SMS: {0}").format(str(e)))
 
+	def _detect_service_name(self):
+		"""Retourne le premier service SMS du compte, ou None"""
+		services = self.get_sms_services()
+		return services[0] if services else None
+
 	def get_sms_services(self):
 		"""Récupère la liste des services SMS disponibles"""
 		try:
-			signature_data = self._create_signature("GET", "https://eu.api.ovh.com/1.0/sms", "")
-			
-			headers = {
-				"X-Ovh-Application": self.application_key,
-				"X-Ovh-Consumer": self.get_password("consumer_key"),  # CORRECTION ICI
-				"X-Ovh-Signature": signature_data["signature"],
-				"X-Ovh-Timestamp": signature_data["timestamp"]
-			}
-			
-			response = requests.get("https://eu.api.ovh.com/1.0/sms", headers=headers, timeout=30)
-			response.raise_for_status()
-			
-			return response.json()
+			return self._ovh_request("GET", "/sms")
 		except Exception as e:
 			frappe.log_error(f"Erreur récupération services SMS: {e}")
 			raise
@@ -57,20 +148,7 @@ class OVHSMSSettings(Document):
 	def get_service_details(self, service_name):
 		"""Récupère les détails d'un service SMS"""
 		try:
-			url = f"https://eu.api.ovh.com/1.0/sms/{service_name}"
-			signature_data = self._create_signature("GET", url, "")
-			
-			headers = {
-				"X-Ovh-Application": self.application_key,
-				"X-Ovh-Consumer": self.get_password("consumer_key"),  # CORRECTION ICI
-				"X-Ovh-Signature": signature_data["signature"],
-				"X-Ovh-Timestamp": signature_data["timestamp"]
-			}
-			
-			response = requests.get(url, headers=headers, timeout=30)
-			response.raise_for_status()
-			
-			return response.json()
+			return self._ovh_request("GET", f"/sms/{service_name}")
 		except Exception as e:
 			frappe.log_error(f"Erreur récupération détails service {service_name}: {e}")
 			raise
@@ -79,20 +157,11 @@ class OVHSMSSettings(Document):
 		"""Récupère la liste des expéditeurs disponibles"""
 		try:
 			service_name = self.get_service_name()
-			url = f"https://eu.api.ovh.com/1.0/sms/{service_name}/senders"
-			signature_data = self._create_signature("GET", url, "")
-			
-			headers = {
-				"X-Ovh-Application": self.application_key,
-				"X-Ovh-Consumer": self.get_password("consumer_key"),  # CORRECTION ICI
-				"X-Ovh-Signature": signature_data["signature"],
-				"X-Ovh-Timestamp": signature_data["timestamp"]
-			}
-			
-			response = requests.get(url, headers=headers, timeout=30)
-			response.raise_for_status()
-			
-			return response.json()
+			return ovh_cache.get_or_load(
+				f"senders:{service_name}",
+				lambda: self._ovh_request("GET", f"/sms/{service_name}/senders"),
+				self.get_cache_ttl()
+			)
 		except Exception as e:
 			frappe.log_error(f"Erreur récupération expéditeurs: {e}")
 			return []
@@ -101,7 +170,6 @@ class OVHSMSSettings(Document):
 		"""Crée un nouvel expéditeur SMS"""
 		try:
 			service_name = self.get_service_name()
-			url = f"https://eu.api.ovh.com/1.0/sms/{service_name}/senders"
 			
 			# Validation du nom de l'expéditeur
 			if not re.match(r'^[a-zA-Z0-9]{1,11}$', sender_name):
@@ -112,23 +180,10 @@ class OVHSMSSettings(Document):
 				"description": description
 			}
 			
-			import json
-			body = json.dumps(body_data, separators=(',', ':'))
+			result = self._ovh_request("POST", f"/sms/{service_name}/senders", body_data)
 			
-			signature_data = self._create_signature("POST", url, body)
-			
-			headers = {
-				"X-Ovh-Application": self.application_key,
-				"X-Ovh-Consumer": self.get_password("consumer_key"),  # CORRECTION ICI
-				"X-Ovh-Signature": signature_data["signature"],
-				"X-Ovh-Timestamp": signature_data["timestamp"],
-				"Content-Type": "application/json"
-			}
-			
-			response = requests.post(url, data=body, headers=headers, timeout=30)
-			response.raise_for_status()
-			
-			result = response.json()
+			# La liste des expéditeurs en cache n'est plus à jour
+			ovh_cache.invalidate(f"senders:{service_name}")
 			
 			# Log de succès en INFO, pas ERROR
 			frappe.logger().info(f"Expéditeur SMS créé: {sender_name}")
@@ -221,64 +276,197 @@ class OVHSMSSettings(Document):
 
 	def _create_signature(self, method, url, body=""):
 		"""Crée la signature OVH - VERSION ORIGINALE AVEC RÉCUPÉRATION PASSWORD CORRECTE"""
-		timestamp = str(int(datetime.datetime.now().timestamp()))
+		# Horodatage aligné sur l'horloge OVH (écart mis en cache par le client)
+		timestamp = self.get_ovh_client().get_timestamp()
 		
-		# CORRECTION PRINCIPALE: Utiliser get_password() pour les champs Password
-		app_secret = self.get_password("application_secret") or self.application_secret
-		consumer_key = self.get_password("consumer_key") or self.consumer_key
+		return {
+			"signature": self.get_ovh_credentials().sign(method, url, body, timestamp),
+			"timestamp": timestamp
+		}
+
+	def resolve_sender(self, sender=None):
+		"""Détermine l'expéditeur à utiliser (validé, créé ou fallback automatique)"""
+		if not sender:
+			return self.get_best_sender()
 		
-		# Construction du pre-hash selon la documentation OVH
-		pre_hash = f"{app_secret}+{consumer_key}+{method}+{url}+{body}+{timestamp}"
+		# Valider l'expéditeur fourni
+		result = self.validate_and_create_sender(sender)
+		if not result["success"]:
+			frappe.logger().warning(f"Impossible d'utiliser l'expéditeur {sender}, fallback automatique")
+			return self.get_best_sender()
 		
-		# Calcul SHA1 et ajout du préfixe
-		signature = "$1$" + hashlib.sha1(pre_hash.encode('utf-8')).hexdigest()
+		return sender
+
+	def get_lane_rate_share(self, lane=None):
+		"""Part du débit OVH réservée à une voie (la voie marketing est paramétrable)"""
+		if self.marketing_rate_share is None:
+			return get_lane(lane)["rate_share"]
 		
+		marketing_share = clamp_rate_share(self.marketing_rate_share) / 100.0
+		return marketing_share if (lane or DEFAULT_LANE) == LANE_MARKETING else 1 - marketing_share
+
+	def get_rate_limiter(self, service_name, lane=None):
+		"""Retourne le seau à jetons de la voie pour ce service (None si débit illimité)
+		
+		Le seau d'une voie vide emprunte les jetons inutilisés des autres voies: une campagne
+		profite de tout le débit quand aucun SMS transactionnel n'est envoyé, et inversement.
+		"""
+		rate = cint(self.rate_limit_per_minute)
+		if rate <= 0:
+			return None
+		
+		lane = lane if lane in LANES else DEFAULT_LANE
+		lenders = [self._lane_bucket(service_name, other, rate) for other in LANES if other != lane]
+		
+		return self._lane_bucket(service_name, lane, rate, lenders)
+	
+	def _lane_bucket(self, service_name, lane, rate, lenders=None):
+		"""Seau propre à une voie: sa part du débit et de la rafale"""
+		# Les parts des deux voies somment à 1: leur débit cumulé reste égal à la limite globale
+		share = self.get_lane_rate_share(lane)
+		
+		return get_rate_limiter(
+			f"{service_name}:{get_lane(lane)['key']}",
+			rate * share,
+			max(1, int(round((cint(self.rate_limit_burst) or rate) * share))),
+			lenders
+		)
+
+	def acquire_send_slot(self, service_name, lane=None, wait=False):
+		"""Attend un jeton du limiteur de débit de la voie avant un envoi
+		
+		Avec `wait` (jobs d'arrière-plan), l'attente n'est pas bornée: un envoi freiné par le débit
+		est retardé, jamais mis en échec. Sinon l'attente est bornée par rate_limit_timeout.
+		"""
+		limiter = self.get_rate_limiter(service_name, lane)
+		if not limiter:
+			return
+		
+		if wait:
+			limiter.acquire(blocking=True, timeout=None)
+			return
+		
+		timeout = cint(self.rate_limit_timeout)
+		if not limiter.acquire(blocking=timeout > 0, timeout=timeout):
+			raise RateLimitExceeded(
+				f"Limite d'envois/minute atteinte pour {service_name} (voie {lane or DEFAULT_LANE})"
+			)
+
+	def _job_body(self, message, receivers, sender, lane=None):
+		"""Corps d'un job d'envoi OVH"""
 		return {
-			"signature": signature,
-			"timestamp": timestamp
+			"message": message,
+			"receivers": receivers,
+			"sender": sender,
+			"noStopClause": False,  # Ajouter la clause STOP pour la conformité
+			"priority": get_lane(lane)["ovh_priority"]
 		}
 
-	def send_sms(self, message, phone_number, sender=None):
-		"""Envoie un SMS via l'API OVH - VERSION ORIGINALE AVEC LOGS CORRIGÉS"""
+	def _post_job(self, service_name, message, receivers, sender, lane=None, wait=False):
+		"""Crée un job d'envoi OVH pour une liste de destinataires"""
+		self.acquire_send_slot(service_name, lane, wait)
+		
+		return self._ovh_request(
+			"POST", f"/sms/{service_name}/jobs", self._job_body(message, receivers, sender, lane)
+		)
+
+	def get_async_sender(self, service_name, lane=None, wait=False):
+		"""Émetteur concurrent configuré comme les appels synchrones (rejeux, disjoncteur, débit)"""
+		pool_size = cint(self.http_pool_size) or DEFAULT_POOL_SIZE
+		return AsyncOVHSender(
+			self.get_ovh_client(),
+			self.get_ovh_credentials(),
+			# Au-delà de la taille du pool, les connexions ne seraient pas réutilisées
+			concurrency=min(cint(self.send_concurrency) or DEFAULT_CONCURRENCY, pool_size),
+			timeout=cint(self.api_timeout) or DEFAULT_TIMEOUT,
+			retry_policy=self.get_retry_policy(),
+			circuit_breaker=self.get_circuit_breaker(),
+			rate_limiter=self.get_rate_limiter(service_name, lane),
+			rate_limit_timeout=cint(self.rate_limit_timeout),
+			rate_limit_wait=wait
+		)
+
+	def _post_jobs(self, service_name, jobs, sender, lane=None, wait=False):
+		"""Crée plusieurs jobs OVH avec plusieurs requêtes en vol
+		
+		jobs: liste de (message, destinataires). Retourne, dans le même ordre,
+		la réponse OVH ou l'exception levée pour chaque job.
+		"""
+		if len(jobs) == 1:
+			message, receivers = jobs[0]
+			try:
+				return [self._post_job(service_name, message, receivers, sender, lane, wait)]
+			except Exception as e:
+				return [e]
+		
+		path = f"/sms/{service_name}/jobs"
+		calls = [("POST", path, self._job_body(message, receivers, sender, lane)) for message, receivers in jobs]
+		
+		return run_sync(self.get_async_sender(service_name, lane, wait).send_many(calls))
+
+	def _send_groups(self, groups, sender=None, lane=None, wait=False):
+		"""Envoie chaque texte à ses destinataires (jobs OVH envoyés en parallèle)
+		
+		groups: {texte: [destinataires dédoublonnés]}; `wait`: voir acquire_send_slot.
+		Retourne (expéditeur utilisé, {texte: {destinataire: résultat}}); un résultat en échec
+		indique dans "retryable" si l'envoi peut être retenté sans risque de doublon, ainsi que
+		sa classe d'erreur ("error_class") et le statut HTTP OVH ("http_status").
+		"""
+		results = {text: {} for text in groups}
+		
 		try:
 			service_name = self.get_service_name()
-			url = f"https://eu.api.ovh.com/1.0/sms/{service_name}/jobs"
-			
-			# Déterminer l'expéditeur à utiliser
-			if not sender:
-				sender = self.get_best_sender()
+			sender = self.resolve_sender(sender)
+		except Exception as e:
+			error_msg = f"Erreur préparation envoi groupé: {str(e)}"
+			frappe.log_error(error_msg)
+			for text, receivers in groups.items():
+				for receiver in receivers:
+					results[text][receiver] = {
+						"success": False, "message": error_msg, "retryable": True,
+						"error_class": "preparation_error", "http_status": None
+					}
+			return sender, results
+		
+		jobs = []
+		for text, receivers in groups.items():
+			for start in range(0, len(receivers), MAX_RECEIVERS_PER_JOB):
+				jobs.append((text, receivers[start:start + MAX_RECEIVERS_PER_JOB]))
+		
+		for (text, chunk), outcome in zip(jobs, self._post_jobs(service_name, jobs, sender, lane, wait)):
+			if not isinstance(outcome, Exception):
+				results[text].update(map_job_ids(chunk, outcome))
+				continue
+			
+			if isinstance(outcome, requests.exceptions.RequestException):
+				error_msg = format_request_error("Erreur envoi SMS groupé", outcome)
+				error_class, http_status, retryable = classify_error(outcome, "POST")
 			else:
-				# Valider l'expéditeur fourni
-				result = self.validate_and_create_sender(sender)
-				if not result["success"]:
-					frappe.logger().warning(f"Impossible d'utiliser l'expéditeur {sender}, fallback automatique")
-					sender = self.get_best_sender()
-			
-			# Préparation du corps de la requête
-			body_data = {
-				"message": message,
-				"receivers": [phone_number],
-				"sender": sender,
-				"noStopClause": False,  # Ajouter la clause STOP pour la conformité
-				"priority": "high"
-			}
-			
-			import json
-			body = json.dumps(body_data, separators=(',', ':'))
-			signature_data = self._create_signature("POST", url, body)
-			
-			headers = {
-				"X-Ovh-Application": self.application_key,
-				"X-Ovh-Consumer": self.get_password("consumer_key"),  # CORRECTION ICI
-				"X-Ovh-Signature": signature_data["signature"],
-				"X-Ovh-Timestamp": signature_data["timestamp"],
-				"Content-Type": "application/json"
-			}
-			
-			response = requests.post(url, data=body, headers=headers, timeout=30)
-			response.raise_for_status()
+				error_msg = f"Erreur inattendue envoi SMS groupé: {str(outcome)}"
+				# Disjoncteur ouvert ou débit dépassé: rien n'a été transmis à OVH
+				http_status = None
+				if isinstance(outcome, CircuitOpenError):
+					error_class, retryable = "circuit_open", True
+				elif isinstance(outcome, RateLimitExceeded):
+					error_class, retryable = "rate_limit_exceeded", True
+				else:
+					error_class, retryable = "unexpected_error", False
+			frappe.log_error(error_msg)
+			for receiver in chunk:
+				results[text][receiver] = {
+					"success": False, "message": error_msg, "retryable": retryable,
+					"error_class": error_class, "http_status": http_status
+				}
+		
+		return sender, results
+
+	def send_sms(self, message, phone_number, sender=None, lane=None):
+		"""Envoie un SMS via l'API OVH - VERSION ORIGINALE AVEC LOGS CORRIGÉS"""
+		try:
+			service_name = self.get_service_name()
+			sender = self.resolve_sender(sender)
 			
-			result = response.json()
+			result = self._post_job(service_name, message, [phone_number], sender, lane)
 			
 			# CORRECTION: Log du succès en INFO, pas ERROR
 			success_msg = f"SMS envoyé: {phone_number} via {sender}"
@@ -315,23 +503,73 @@ class OVHSMSSettings(Document):
 				"message": error_msg
 			}
 
+	def send_bulk(self, message, receivers, sender=None, lane=None):
+		"""Envoie un même message à plusieurs destinataires en un minimum de jobs OVH
+		
+		Retourne un résultat global et, dans "results", le détail par destinataire
+		(succès, identifiant OVH du SMS, message d'erreur éventuel).
+		"""
+		# Dédoublonnage en conservant l'ordre: un numéro ne reçoit le texte qu'une fois
+		unique_receivers = list(dict.fromkeys(r for r in receivers if r))
+		results = {}
+		
+		if not unique_receivers:
+			return {"success": False, "message": "Aucun destinataire", "sent": 0, "failed": 0, "results": results}
+		
+		sender, grouped = self._send_groups({message: unique_receivers}, sender, lane)
+		results = grouped[message]
+		
+		sent = sum(1 for r in results.values() if r["success"])
+		failed = len(results) - sent
+		
+		frappe.logger().info(f"Envoi groupé: {sent} SMS envoyés, {failed} échecs via {sender}")
+		
+		return {
+			"success": sent > 0,
+			"message": f"{sent} SMS envoyés, {failed} échecs",
+			"sender_used": sender,
+			"sent": sent,
+			"failed": failed,
+			"results": results
+		}
+
+	def send_grouped(self, messages, sender=None, lane=None, wait=False):
+		"""Envoie une liste de (destinataire, texte) en regroupant les textes identiques
+		
+		Les jobs OVH partent en parallèle (send_concurrency requêtes en vol), sur le débit
+		et avec la priorité OVH de la voie `lane` (transactionnelle par défaut).
+		Les jobs d'arrière-plan passent `wait`: ils attendent le débit au lieu d'échouer.
+		Retourne la liste des résultats par message, dans l'ordre d'entrée.
+		"""
+		groups = {}
+		for receiver, text in messages:
+			if receiver:
+				# Dédoublonnage en conservant l'ordre: un numéro ne reçoit un texte qu'une fois
+				groups.setdefault(text, {})[receiver] = True
+		
+		results = {}
+		if groups:
+			sender, results = self._send_groups(
+				{text: list(receivers) for text, receivers in groups.items()}, sender, lane, wait
+			)
+			sent = sum(1 for by_receiver in results.values() for r in by_receiver.values() if r["success"])
+			total = sum(len(by_receiver) for by_receiver in results.values())
+			frappe.logger().info(f"Envoi groupé: {sent} SMS envoyés, {total - sent} échecs via {sender}")
+		
+		outcomes = []
+		for receiver, text in messages:
+			if not receiver:
+				outcomes.append({"success": False, "message": "Numéro mobile manquant"})
+			else:
+				outcomes.append(results[text][receiver])
+		
+		return outcomes
+
 	def test_connection(self):
 		"""Teste la connexion à l'API OVH - VERSION ORIGINALE AVEC RÉCUPÉRATION PASSWORD"""
 		try:
 			# Test de base avec /me
-			signature_data = self._create_signature("GET", "https://eu.api.ovh.com/1.0/me", "")
-			
-			headers = {
-				"X-Ovh-Application": self.application_key,
-				"X-Ovh-Consumer": self.get_password("consumer_key"),  # CORRECTION ICI
-				"X-Ovh-Signature": signature_data["signature"],
-				"X-Ovh-Timestamp": signature_data["timestamp"]
-			}
-			
-			response = requests.get("https://eu.api.ovh.com/1.0/me", headers=headers, timeout=30)
-			response.raise_for_status()
-			
-			account_info = response.json()
+			account_info = self._ovh_request("GET", "/me")
 			
 			# Test des services SMS
 			services = self.get_sms_services()
@@ -509,6 +747,110 @@ def create_new_sender(sender_name, description="ERPNext Sender"):
 			"message": f"Erreur: {str(e)}"
 		}
 
+def _receiver_key(receiver):
+	"""Clé de comparaison d'un numéro (OVH peut renvoyer +33... ou 0033...)"""
+	digits = "".join(c for c in str(receiver) if c.isdigit())
+	return digits[2:] if digits.startswith("00") else digits
+
+def map_job_ids(receivers, job):
+	"""Associe les identifiants retournés par OVH à chaque destinataire d'un job"""
+	ids = job.get("ids") or []
+	invalid = {_receiver_key(r) for r in job.get("invalidReceivers") or []}
+	valid = job.get("validReceivers")
+	
+	if valid is None:
+		# Réponse sans détail: les ids suivent l'ordre des destinataires acceptés
+		valid = [r for r in receivers if _receiver_key(r) not in invalid]
+	
+	ids_by_key = {}
+	for index, receiver in enumerate(valid):
+		ids_by_key[_receiver_key(receiver)] = ids[index] if index < len(ids) else None
+	
+	results = {}
+	for receiver in receivers:
+		key = _receiver_key(receiver)
+		if key in ids_by_key:
+			results[receiver] = {
+				"success": True,
+				"message": f"SMS envoyé avec succès vers {receiver}",
+				"id": ids_by_key[key]
+			}
+		else:
+			results[receiver] = {
+				"success": False,
+				"message": f"Numéro refusé par OVH: {receiver}"
+			}
+	
+	return results
+
+def format_request_error(prefix, e):
+	"""Construit un message d'erreur lisible à partir d'une exception requests"""
+	error_msg = f"{prefix}: {e}"
+	if hasattr(e, 'response') and e.response is not None:
+		try:
+			error_detail = e.response.json()
+			error_msg += f" - {error_detail.get('message', '')}"
+		except Exception:
+			error_msg += f" - {e.response.text}"
+	return error_msg
+
+@frappe.whitelist()
+def get_cache_statistics():
+	"""Retourne les compteurs hit/miss du cache service/expéditeurs"""
+	try:
+		return {
+			"success": True,
+			"stats": ovh_cache.get_cache_stats()
+		}
+	except Exception as e:
+		frappe.log_error(f"Erreur statistiques cache OVH: {e}")
+		return {
+			"success": False,
+			"message": f"Erreur: {str(e)}"
+		}
+
+@frappe.whitelist()
+def get_rate_limit_statistics():
+	"""Retourne les métriques du limiteur de débit (jetons accordés/refusés, attentes)"""
+	try:
+		settings = frappe.get_single('OVH SMS Settings')
+		service_name = settings.get_service_name()
+		
+		return {
+			"success": True,
+			"service_name": service_name,
+			"rate_limit_per_minute": settings.rate_limit_per_minute,
+			"lanes": {
+				lane: {
+					"rate_share": settings.get_lane_rate_share(lane),
+					"stats": get_rate_limit_stats(f"{service_name}:{config['key']}")
+				}
+				for lane, config in LANES.items()
+			}
+		}
+	except Exception as e:
+		frappe.log_error(f"Erreur statistiques limiteur OVH: {e}")
+		return {
+			"success": False,
+			"message": f"Erreur: {str(e)}"
+		}
+
+@frappe.whitelist()
+def get_circuit_breaker_status():
+	"""Retourne l'état du disjoncteur OVH et ses dernières transitions"""
+	try:
+		settings = frappe.get_single('OVH SMS Settings')
+		return {
+			"success": True,
+			"status": settings.get_circuit_breaker().get_status()
+		}
+	except Exception as e:
+		frappe.log_error(f"Erreur état disjoncteur OVH: {e}")
+		return {
+			"success": False,
+			"message": f"Erreur: {str(e)}"
+		}
+
 def get_ovh_settings():
 	"""Récupère les paramètres OVH SMS pour les autres modules"""
 	settings = frappe.get_single('OVH SMS Settings')
@@ -516,10 +858,12 @@ def get_ovh_settings():
 	if not settings.enabled:
 		frappe.throw(_("L'intégration OVH SMS n'est pas activée"))
 	
+	credentials = settings.get_ovh_credentials()
+	
 	return {
-		"application_key": settings.application_key,
-		"application_secret": settings.get_password("application_secret") or settings.application_secret,
-		"consumer_key": settings.get_password("consumer_key") or settings.consumer_key,
+		"application_key": credentials.application_key,
+		"application_secret": credentials.application_secret,
+		"consumer_key": credentials.consumer_key,
 		"service_name": settings.get_service_name(),
 		"enabled": settings.enabled
 	}
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+File des SMS en échec définitif (SMS Dead Letter)
+Chaque SMS abandonné par l'outbox ou par un envoi de campagne y est conservé avec sa
+classe d'erreur, son statut HTTP, l'historique de ses tentatives et son contenu.
+Un rejeu planifié remet en file les échecs transitoires (hooks event_reminder_settings);
+les rejeux passent par l'outbox et ses envois groupés.
+"""
+
+from __future__ import unicode_literals
+import json
+import frappe
+from frappe.model.document import Document
+from frappe.utils import add_to_date, cint, flt, now_datetime
+
+STATUS_PENDING = "En attente"
+STATUS_REPLAYED = "Rejoué"
+STATUS_ABANDONED = "Abandonné"
+
+DEFAULT_REPLAY_AFTER_HOURS = 2
+MAX_REPLAYS = 3  # Au-delà, l'échec est abandonné
+REPLAY_BATCH_SIZE = 500
+
+# Classes d'erreur (classify_error, _send_groups) rejouées automatiquement
+REPLAYABLE_ERROR_CLASSES = (
+	"connect_timeout", "rate_limited", "server_error", "circuit_open", "rate_limit_exceeded", "preparation_error"
+)
+
+
+class SMSDeadLetter(Document):
+	pass
+
+
+def on_doctype_update():
+	"""Index utilisés par le rejeu planifié et le suivi des rejeux par l'outbox"""
+	frappe.db.add_index("SMS Dead Letter", ["status", "retryable", "failed_at"])
+	frappe.db.add_index("SMS Dead Letter", ["outbox"])
+	frappe.db.add_index("SMS Dead Letter", ["reference_doctype", "reference_name"])
+
+
+def _history_entry(result, attempts, now):
+	return {
+		"at": str(now),
+		"attempts": attempts,
+		"error_class": result.get("error_class"),
+		"http_status": result.get("http_status"),
+		"message": result.get("message")
+	}
+
+
+def record_dead_letters(entries):
+	"""Enregistre des SMS en échec définitif
+
+	entries: dicts (receiver, message, sender, lane, reference_doctype, reference_name,
+	outbox, attempts, result). L'échec d'un rejeu (même ligne d'outbox) complète
+	l'historique de la lettre existante au lieu d'en créer une nouvelle.
+	"""
+	if not entries:
+		return
+
+	now = now_datetime()
+	outboxes = tuple({entry["outbox"] for entry in entries if entry.get("outbox")})
+	existing = {}
+	if outboxes:
+		for row in frappe.get_all(
+			"SMS Dead Letter", filters={"outbox": ["in", outboxes]},
+			fields=["name", "outbox", "attempts", "replay_count", "attempt_history"]
+		):
+			existing[row.outbox] = row
+
+	user = frappe.session.user
+	values = []
+
+	for entry in entries:
+		result = entry.get("result") or {}
+		attempts = cint(entry.get("attempts")) or 1
+		history_entry = _history_entry(result, attempts, now)
+		retryable = 1 if result.get("retryable") else 0
+		previous = existing.get(entry.get("outbox"))
+
+		if previous:
+			history = json.loads(previous.attempt_history or "[]") + [history_entry]
+			status = STATUS_ABANDONED if cint(previous.replay_count) >= MAX_REPLAYS else STATUS_PENDING
+			frappe.db.set_value("SMS Dead Letter", previous.name, {
+				"status": status,
+				"error_class": result.get("error_class"),
+				"http_status": result.get("http_status"),
+				"retryable": retryable,
+				"attempts": cint(previous.attempts) + attempts,
+				"failed_at": now,
+				"last_error": result.get("message"),
+				"attempt_history": json.dumps(history, ensure_ascii=False)
+			}, update_modified=False)
+			continue
+
+		values.append((
+			frappe.generate_hash(length=10), now, now, user, user, 0, STATUS_PENDING, entry["receiver"],
+			entry.get("sender"), entry.get("lane"), entry["message"], result.get("error_class"),
+			result.get("http_status"), retryable, attempts, now, 0, entry.get("outbox"),
+			entry.get("reference_doctype"), entry.get("reference_name"), result.get("message"),
+			json.dumps([history_entry], ensure_ascii=False)
+		))
+
+	if values:
+		frappe.db.bulk_insert("SMS Dead Letter", [
+			"name", "creation", "modified", "owner", "modified_by", "docstatus", "status", "receiver",
+			"sender", "lane", "message", "error_class", "http_status", "retryable", "attempts", "failed_at",
+			"replay_count", "outbox", "reference_doctype", "reference_name", "last_error", "attempt_history"
+		], values)
+
+
+def get_dead_lettered(reference_doctype, names):
+	"""Documents (parmi `names`) dont un SMS est en attente de rejeu ou déjà rejoué
+
+	Leur renvoi doublerait le SMS: le rejeu se charge de ces destinataires.
+	"""
+	if not names:
+		return set()
+
+	return set(frappe.get_all(
+		"SMS Dead Letter",
+		filters={
+			"reference_doctype": reference_doctype,
+			"reference_name": ["in", list(names)],
+			"status": ["in", (STATUS_PENDING, STATUS_REPLAYED)]
+		},
+		pluck="reference_name"
+	))
+
+
+def get_replay_after_hours():
+	"""Délai avant rejeu (hooks event_reminder_settings.retry_failed_after_hours)"""
+	# Les hooks de type dict sont fusionnés par application: chaque clé contient une liste
+	values = frappe.get_hooks("event_reminder_settings", {}).get("retry_failed_after_hours") or []
+	if not isinstance(values, (list, tuple)):
+		values = [values]
+
+	return flt(values[-1]) if values else DEFAULT_REPLAY_AFTER_HOURS
+
+
+def replay(names):
+	"""Remet des lettres en file d'attente (une insertion groupée dans l'outbox)
+
+	Retourne le nombre de SMS remis en file.
+	"""
+	from ovh_sms_integration.ovh_sms_integration.doctype.sms_outbox.sms_outbox import enqueue_many
+
+	if not names:
+		return 0
+
+	letters = frappe.get_all(
+		"SMS Dead Letter",
+		filters={"name": ["in", list(names)], "status": ["!=", STATUS_REPLAYED]},
+		fields=["name", "receiver", "sender", "lane", "message", "reference_doctype", "reference_name"]
+	)
+	if not letters:
+		return 0
+
+	outboxes = enqueue_many([
+		{
+			"receiver": letter.receiver,
+			"message": letter.message,
+			"sender": letter.sender,
+			"lane": letter.lane,
+			"reference_doctype": letter.reference_doctype,
+			"reference_name": letter.reference_name
+		}
+		for letter in letters
+	])
+
+	# Une seule requête: chaque lettre pointe vers sa nouvelle ligne d'outbox
+	cases = " ".join(["WHEN %s THEN %s"] * len(letters))
+	params = [value for letter, outbox in zip(letters, outboxes) for value in (letter.name, outbox)]
+	now = now_datetime()
+	frappe.db.sql(f"""
+		UPDATE `tabSMS Dead Letter`
+		SET outbox = CASE name {cases} END,
+			status = %s, replay_count = replay_count + 1, replayed_at = %s, modified = %s
+		WHERE name IN %s
+	""", tuple(params) + (STATUS_REPLAYED, now, now, tuple(letter.name for letter in letters)))
+
+	frappe.logger().info(f"SMS Dead Letter: {len(letters)} SMS remis en file")
+
+	return len(letters)
+
+
+def replay_due_dead_letters():
+	"""Tâche planifiée: rejoue les échecs transitoires plus anciens que le délai configuré"""
+	cutoff = add_to_date(now_datetime(), hours=-get_replay_after_hours())
+	names = frappe.get_all(
+		"SMS Dead Letter",
+		filters={
+			"status": STATUS_PENDING,
+			"retryable": 1,
+			"error_class": ["in", REPLAYABLE_ERROR_CLASSES],
+			"failed_at": ["<=", cutoff],
+			"replay_count": ["<", MAX_REPLAYS]
+		},
+		order_by="failed_at asc",
+		limit_page_length=REPLAY_BATCH_SIZE,
+		pluck="name"
+	)
+
+	if names:
+		replay(names)
+		frappe.db.commit()
+
+
+@frappe.whitelist()
+def replay_dead_letters(names):
+	"""API: rejoue manuellement des lettres, quelle que soit leur classe d'erreur"""
+	frappe.only_for(["System Manager", "SMS Manager"])
+
+	if isinstance(names, str):
+		names = json.loads(names)
+
+	count = replay(names)
+
+	return {"success": True, "message": f"{count} SMS remis en file d'attente"}
+
+
+@frappe.whitelist()
+def get_dead_letter_statistics():
+	"""Nombre de lettres par statut et par classe d'erreur"""
+	counts = frappe.db.sql("""
+		SELECT status, error_class, COUNT(*) AS count
+		FROM `tabSMS Dead Letter`
+		GROUP BY status, error_class
+	""", as_dict=True)
+
+	return {"success": True, "stats": counts}
@@ -4,11 +4,43 @@ import frappe
 import requests
 import hashlib
 import datetime
+import functools
 import re
 from frappe.model.document import Document
 from frappe import _
 from datetime import datetime, timedelta
-from jinja2 import Template
+from ovh_sms_integration.utils.sms_templates import (
+	build_context, get_variables, invalidate_changed_templates, render as render_template, render_many,
+	segment_count, select_builders, validate_template_fields
+)
+from ovh_sms_integration.utils.sms_utils import send_sms, enqueue_bulk_sms, make_safe_context
+from ovh_sms_integration.ovh_sms_integration.doctype.sms_send_ledger.sms_send_ledger import (
+	claim_reminders, match_reminder_offset, release_reminders, reminder_key
+)
+
+# Variables de template d'un événement: fonction(event_doc, données structurées mémoïsées)
+EVENT_CONTEXT_BUILDERS = {
+	'subject': lambda event_doc, event_data: event_doc.subject or '',
+	'description': lambda event_doc, event_data: event_doc.description or '',
+	'event_name': lambda event_doc, event_data: event_doc.name,
+	'start_date': lambda event_doc, event_data: event_doc.starts_on.strftime('%d/%m/%Y') if event_doc.starts_on else '',
+	'start_time': lambda event_doc, event_data: event_doc.starts_on.strftime('%H:%M') if event_doc.starts_on else '',
+	'location': lambda event_doc, event_data: getattr(event_doc, 'location', '') or '',
+	# Calcul de la durée (minutes) si disponible
+	'duration': lambda event_doc, event_data: (
+		int((event_doc.ends_on - event_doc.starts_on).total_seconds() / 60)
+		if event_doc.starts_on and event_doc.ends_on else ''
+	)
+}
+# Données parsées depuis la description
+EVENT_CONTEXT_BUILDERS.update({
+	key: (lambda event_doc, event_data, key=key: event_data().get(key, ''))
+	for key in (
+		'client', 'reference', 'type', 'article', 'tel_client', 'email_client', 'appareil', 'camion_requis'
+	)
+})
+
+TEMPLATE_FIELDS = ("customer_template", "employee_template", "default_template", "reminder_message_template")
 
 class SMSEventReminder(Document):
 	def validate(self):
@@ -30,6 +62,12 @@ class SMSEventReminder(Document):
 						frappe.throw(_("Toutes les heures de rappel doivent être positives"))
 				except ValueError:
 					frappe.throw(_("Format invalide pour les heures de rappel (ex: 24,2,0.5)"))
+		
+		validate_template_fields(self, TEMPLATE_FIELDS)
+
+	def on_update(self):
+		"""Libère du cache les anciennes versions des templates modifiés"""
+		invalidate_changed_templates(self, TEMPLATE_FIELDS)
 
 	def get_reminder_times(self):
 		"""Retourne la liste des heures de rappel"""
@@ -124,48 +162,53 @@ class SMSEventReminder(Document):
 	def format_message(self, template, event_doc, customer_name=None, employee_name=None):
 		"""Formate le message avec les données de l'événement - VERSION MISE À JOUR"""
 		try:
-			# Parse des données structurées
-			event_data = self.parse_event_data(event_doc.description)
-			
-			# Préparation du contexte de base
-			context = {
-				'subject': event_doc.subject or '',
-				'description': event_doc.description or '',
-				'event_name': event_doc.name,
-				'start_date': event_doc.starts_on.strftime('%d/%m/%Y') if event_doc.starts_on else '',
-				'start_time': event_doc.starts_on.strftime('%H:%M') if event_doc.starts_on else '',
-				'location': getattr(event_doc, 'location', '') or '',
+			context = self.get_event_context(event_doc, get_variables(template))
+			context.update({
 				'customer_name': customer_name or '',
 				'employee_name': employee_name or ''
-			}
-			
-			# Ajout des données parsées
-			context.update({
-				'client': event_data.get('client', ''),
-				'reference': event_data.get('reference', ''),
-				'type': event_data.get('type', ''),
-				'article': event_data.get('article', ''),
-				'tel_client': event_data.get('tel_client', ''),
-				'email_client': event_data.get('email_client', ''),
-				'appareil': event_data.get('appareil', ''),
-				'camion_requis': event_data.get('camion_requis', '')
 			})
 			
-			# Calcul de la durée si disponible
-			if event_doc.starts_on and event_doc.ends_on:
-				duration = (event_doc.ends_on - event_doc.starts_on).total_seconds() / 60
-				context['duration'] = int(duration)
-			else:
-				context['duration'] = ''
-			
-			# Formatage avec Jinja2
-			template_obj = Template(template)
-			return template_obj.render(**context)
+			# Formatage avec Jinja2 (template compilé mis en cache)
+			return render_template(template, make_safe_context(context))
 			
 		except Exception as e:
 			frappe.log_error(f"Erreur formatage message rappel: {e}")
 			return template  # Retourne le template original en cas d'erreur
 
+	def format_messages(self, template, event_doc, recipients, recipient_type="customer"):
+		"""Rend le template pour tous les destinataires d'un événement: [(destinataire, texte, segments)]
+		
+		Le contexte de l'événement est construit une fois; seul le nom varie par destinataire.
+		Rendu unique des rappels: le planificateur (SMSEventReminder) et sms_utils l'utilisent.
+		"""
+		name_field, other_field = (
+			("employee_name", "customer_name") if recipient_type == "employee" else ("customer_name", "employee_name")
+		)
+		shared = self.get_event_context(event_doc, get_variables(template))
+		# Le nom du destinataire n'est pas partagé: un template qui l'utilise est rendu par destinataire
+		shared[other_field] = ''
+		
+		try:
+			return render_many(
+				template,
+				[(recipient, {name_field: recipient['name'] or ''}) for recipient in recipients],
+				shared=make_safe_context(shared)
+			)
+		except Exception as e:
+			frappe.log_error(f"Erreur formatage message rappel: {e}")
+			return [(recipient, template, segment_count(template)) for recipient in recipients]
+
+	def get_event_context(self, event_doc, variables=None):
+		"""Variables de template communes à tous les destinataires d'un événement
+		
+		Seules `variables` (get_variables du template) sont calculées: la description
+		n'est analysée que si le template utilise l'une des données structurées.
+		"""
+		# Parse des données structurées, au plus une fois et seulement si nécessaire
+		event_data = functools.cache(lambda: self.parse_event_data(event_doc.description))
+		
+		return build_context(select_builders(EVENT_CONTEXT_BUILDERS, variables), event_doc, event_data)
+
 	def extract_event_type_from_description(self, description):
 		"""Extrait le type d'événement depuis la description structurée"""
 		if not description:
@@ -348,58 +391,69 @@ class SMSEventReminder(Document):
 		
 		try:
 			events = self.get_events_for_reminder()
+			reminder_times = self.get_reminder_times()
+			now = datetime.now()
 			sent_count = 0
 			failed_count = 0
 			
+			# Préparation de tous les messages, envoyés ensuite en jobs groupés
+			batch = []
+			
 			for event in events:
-				# Vérifier si le rappel a déjà été envoyé
-				if self.is_reminder_already_sent(event.name):
+				offset = match_reminder_offset(event.starts_on, reminder_times, now)
+				if offset is None:
+					# Hors de toute fenêtre de rappel: rien à réserver ni à envoyer
 					continue
 				
 				contacts = self.get_event_contacts(event)
 				event_doc = frappe.get_doc("Event", event.name)
 				
-				# Envoi aux clients
+				recipient_groups = []
+				
+				# Messages pour les clients
 				if self.send_to_customer_only or not self.send_to_employee:
-					for customer in contacts['customers']:
-						try:
-							template = self.get_message_template("customer")
-							message = self.format_message(
-								template, event_doc, 
-								customer_name=customer['name']
-							)
-							
-							result = self.send_sms_reminder(message, customer['mobile'])
-							if result and result.get('success'):
-								sent_count += 1
-								self.log_reminder_sent(event.name, customer['name'], "customer")
-							else:
-								failed_count += 1
-								
-						except Exception as e:
-							frappe.log_error(f"Erreur envoi rappel client {customer['name']}: {e}")
-							failed_count += 1
+					recipient_groups.append(("customer", contacts['customers']))
 				
-				# Envoi aux employés
+				# Messages pour les employés
 				if self.send_to_employee:
-					for employee in contacts['employees']:
-						try:
-							template = self.get_message_template("employee")
-							message = self.format_message(
-								template, event_doc, 
-								employee_name=employee['name']
-							)
-							
-							result = self.send_sms_reminder(message, employee['mobile'])
-							if result and result.get('success'):
-								sent_count += 1
-								self.log_reminder_sent(event.name, employee['name'], "employee")
-							else:
-								failed_count += 1
-								
-						except Exception as e:
-							frappe.log_error(f"Erreur envoi rappel employé {employee['name']}: {e}")
-							failed_count += 1
+					recipient_groups.append(("employee", contacts['employees']))
+				
+				# Un rendu groupé par type de destinataire
+				for recipient_type, recipients in recipient_groups:
+					try:
+						rendered = self.format_messages(
+							self.get_message_template(recipient_type), event_doc, recipients, recipient_type
+						)
+						batch.extend(
+							(event.name, recipient, recipient_type, message, offset)
+							for recipient, message, segments in rendered
+						)
+					
+					except Exception as e:
+						frappe.log_error(f"Erreur préparation rappels {recipient_type} {event.name}: {e}")
+						failed_count += len(recipients)
+			
+			# Idempotence: un rappel déjà enregistré par un passage précédent n'est pas renvoyé
+			keys = [reminder_key(entry[0], entry[1]['mobile'], entry[4]) for entry in batch]
+			claimed = claim_reminders(keys)
+			batch = [(entry, key) for entry, key in zip(batch, keys) if key in claimed]
+			
+			results = self.send_sms_reminders([
+				(recipient['mobile'], message, event_name)
+				for (event_name, recipient, recipient_type, message, offset), key in batch
+			])
+			
+			unqueued = []
+			for ((event_name, recipient, recipient_type, message, offset), key), result in zip(batch, results):
+				if result and result.get('success'):
+					sent_count += 1
+					self.log_reminder_sent(event_name, recipient['name'], recipient_type)
+				else:
+					failed_count += 1
+					unqueued.append(key)
+			
+			# Les rappels non mis en file restent à envoyer au prochain passage
+			release_reminders(unqueued)
 			
 			# Mise à jour des statistiques
 			self.update_statistics(sent_count, failed_count)
@@ -423,21 +477,40 @@ class SMSEventReminder(Document):
 			return "ERPNext"  # Fallback
 
 	def send_sms_reminder(self, message, mobile):
-		"""Envoie un SMS de rappel via l'intégration OVH"""
+		"""Met en file un SMS de rappel (envoyé par les workers SMS Outbox)"""
 		try:
-			sms_settings = frappe.get_single('OVH SMS Settings')
-			if not sms_settings.enabled:
-				return {"success": False, "message": "OVH SMS non activé"}
-			
-			return sms_settings.send_sms(message, mobile)
+			result = send_sms(message, mobile)
+			return result or {"success": False, "message": "OVH SMS non activé ou numéro invalide"}
 		except Exception as e:
 			frappe.log_error(f"Erreur envoi SMS rappel: {e}")
 			return {"success": False, "message": str(e)}
 
-	def is_reminder_already_sent(self, event_name):
-		"""Vérifie si un rappel a déjà été envoyé pour cet événement"""
-		# Vérification dans les logs (optionnel - peut être implémenté selon les besoins)
-		return False
+	def send_sms_reminders(self, messages):
+		"""Met en file une liste de rappels (mobile, message, événement)
+		
+		Retourne les résultats dans l'ordre de la liste.
+		"""
+		if not messages:
+			return []
+		
+		try:
+			results = enqueue_bulk_sms([
+				(mobile, message, "Event", event_name) for mobile, message, event_name in messages
+			])
+			return [result or {"success": False, "message": "Numéro invalide"} for result in results]
+		except Exception as e:
+			frappe.log_error(f"Erreur envoi groupé rappels: {e}")
+			return [{"success": False, "message": str(e)}] * len(messages)
+
+	def is_reminder_already_sent(self, event_name, mobile=None, hours_before=None):
+		"""Vérifie dans le registre SMS Send Ledger si un rappel a déjà été envoyé pour cet événement"""
+		if mobile is None:
+			return bool(frappe.db.exists("SMS Send Ledger", {"event": event_name}))
+		
+		event, recipient, offset = reminder_key(event_name, mobile, hours_before)
+		return bool(frappe.db.exists("SMS Send Ledger", {
+			"event": event, "recipient": recipient, "reminder_offset": offset
+		}))
 
 	def log_reminder_sent(self, event_name, recipient_name, recipient_type):
 		"""Log l'envoi d'un rappel"""
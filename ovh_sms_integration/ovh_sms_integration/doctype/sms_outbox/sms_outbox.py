@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+"""
+File d'attente persistante des SMS (SMS Outbox)
+Les appelants ne font qu'insérer une ligne; des workers frappe.enqueue réclament
+les lignes par lots (SELECT ... FOR UPDATE SKIP LOCKED) et les envoient à OVH.
+"""
+
+from __future__ import unicode_literals
+import time
+import frappe
+from frappe.model.document import Document
+from frappe.utils import add_to_date, cint, now_datetime
+from ovh_sms_integration.utils.circuit_breaker import STATE_OPEN
+from ovh_sms_integration.ovh_sms_integration.doctype.sms_dead_letter.sms_dead_letter import record_dead_letters
+from ovh_sms_integration.utils.priority_lanes import DEFAULT_LANE, allocate_quotas, lanes_by_weight
+
+STATUS_QUEUED = "En attente"
+STATUS_SENDING = "En cours"
+STATUS_SENT = "Envoyé"
+STATUS_FAILED = "Échoué"
+
+DEFAULT_WORKERS = 2
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_MAX_ATTEMPTS = 5
+MAX_RUNTIME = 240  # Secondes de travail par job avant de rendre la main à la file RQ
+STALE_CLAIM_MINUTES = 10  # Une ligne "En cours" plus ancienne vient d'un worker interrompu
+RETRY_BASE_DELAY = 60
+MAX_RETRY_DELAY = 3600
+DEFAULT_COALESCE_WINDOW = 2  # Secondes d'attente pour regrouper les textes identiques d'autres appelants
+MAX_COALESCED_ROWS = 1000  # Lignes supplémentaires réclamées au plus par regroupement
+
+RATE_LIMITED = "rate_limit_exceeded"  # Classe d'erreur d'un envoi refusé par le limiteur de débit
+
+DISPATCH_METHOD = "ovh_sms_integration.ovh_sms_integration.doctype.sms_outbox.sms_outbox.dispatch_outbox"
+ROW_FIELDS = [
+	"name", "receiver", "sender", "message", "lane", "attempts", "max_attempts", "reference_doctype", "reference_name",
+	"creation"
+]
+
+
+class SMSOutbox(Document):
+	def before_insert(self):
+		self.status = STATUS_QUEUED
+		self.lane = self.lane or DEFAULT_LANE
+		if not self.next_attempt_at:
+			self.next_attempt_at = now_datetime()
+
+
+def on_doctype_update():
+	"""Index utilisés par la réclamation des lots et la recherche par document d'origine"""
+	frappe.db.add_index("SMS Outbox", ["status", "next_attempt_at"])
+	frappe.db.add_index("SMS Outbox", ["status", "lane", "next_attempt_at"])
+	frappe.db.add_index("SMS Outbox", ["reference_doctype", "reference_name"])
+
+
+def enqueue_sms(receiver, message, sender=None, reference_doctype=None, reference_name=None, lane=None):
+	"""Met un SMS en file d'attente et réveille les workers; retourne le nom de la ligne"""
+	doc = frappe.get_doc({
+		"doctype": "SMS Outbox",
+		"receiver": receiver,
+		"message": message,
+		"sender": sender,
+		"lane": lane or DEFAULT_LANE,
+		"reference_doctype": reference_doctype,
+		"reference_name": reference_name
+	}).insert(ignore_permissions=True)
+
+	start_dispatchers()
+
+	return doc.name
+
+
+def enqueue_many(messages, sender=None, lane=None):
+	"""Met en file une liste de dicts (receiver, message, reference_doctype, reference_name, lane)
+
+	Insertion en une requête par lot; retourne les noms des lignes dans l'ordre.
+	"""
+	if not messages:
+		return []
+
+	now = now_datetime()
+	user = frappe.session.user
+	fields = [
+		"name", "creation", "modified", "owner", "modified_by", "docstatus", "status", "receiver",
+		"sender", "message", "lane", "attempts", "max_attempts", "next_attempt_at", "reference_doctype",
+		"reference_name"
+	]
+	names = []
+	values = []
+
+	for entry in messages:
+		name = frappe.generate_hash(length=10)
+		names.append(name)
+		values.append((
+			name, now, now, user, user, 0, STATUS_QUEUED, entry["receiver"],
+			entry.get("sender") or sender, entry["message"], entry.get("lane") or lane or DEFAULT_LANE,
+			0, DEFAULT_MAX_ATTEMPTS, now,
+			entry.get("reference_doctype"), entry.get("reference_name")
+		))
+
+	frappe.db.bulk_insert("SMS Outbox", fields, values)
+	start_dispatchers()
+
+	return names
+
+
+def start_dispatchers():
+	"""Lance (après commit) les workers de l'outbox qui ne tournent pas déjà"""
+	settings = frappe.get_single("OVH SMS Settings")
+	workers = cint(settings.outbox_workers) or DEFAULT_WORKERS
+
+	for index in range(workers):
+		frappe.enqueue(
+			DISPATCH_METHOD,
+			queue="short",
+			job_id=f"sms_outbox_dispatcher_{index}",
+			deduplicate=True,
+			enqueue_after_commit=True
+		)
+
+
+def dispatch_pending():
+	"""Tâche planifiée: relance les workers si des SMS attendent (reprises, disjoncteur refermé)"""
+	if frappe.db.exists("SMS Outbox", {"status": STATUS_QUEUED, "next_attempt_at": ["<=", now_datetime()]}):
+		start_dispatchers()
+
+
+def dispatch_outbox(batch_size=None, max_runtime=MAX_RUNTIME):
+	"""Worker: réclame et envoie des lots jusqu'à épuisement de la file ou du temps alloué"""
+	settings = frappe.get_single("OVH SMS Settings")
+	if not settings.enabled:
+		return
+
+	batch_size = batch_size or cint(settings.outbox_batch_size) or DEFAULT_BATCH_SIZE
+	window = get_coalesce_window(settings)
+	breaker = settings.get_circuit_breaker()
+	started = time.monotonic()
+
+	release_stale_claims()
+
+	while time.monotonic() - started < max_runtime:
+		if breaker.get_state() == STATE_OPEN:
+			# Inutile de réclamer des lignes: le planificateur relancera après la sonde
+			break
+
+		rows = claim_batch(batch_size)
+		if not rows:
+			break
+
+		dispatch_rows(settings, coalesce_batch(rows, window))
+
+
+def get_coalesce_window(settings):
+	"""Fenêtre de regroupement (secondes); 0 désactive l'attente et le regroupement"""
+	if settings.coalesce_window is None:
+		return DEFAULT_COALESCE_WINDOW
+	return max(0, cint(settings.coalesce_window))
+
+
+def claim_batch(limit):
+	"""Réclame jusqu'à `limit` lignes prêtes; les autres workers sautent les lignes verrouillées
+
+	Ordonnancement équitable pondéré: chaque voie obtient sa part du lot selon son poids,
+	la place laissée libre par une voie vide revient aux autres (la plus prioritaire d'abord).
+	Un SMS transactionnel n'attend donc jamais la fin d'une campagne.
+	"""
+	now = now_datetime()
+	quotas = allocate_quotas(limit)
+	names = []
+
+	for lane in lanes_by_weight():
+		names += _claim_lane(lane, min(quotas[lane], limit - len(names)), now)
+
+	for lane in lanes_by_weight():
+		if len(names) >= limit:
+			break
+		names += _claim_lane(lane, limit - len(names), now, exclude=names)
+
+	return _mark_claimed(names, now)
+
+
+def _mark_claimed(names, now):
+	"""Passe les lignes verrouillées à "En cours", valide la transaction et les retourne"""
+	if not names:
+		frappe.db.commit()
+		return []
+
+	frappe.db.sql("""
+		UPDATE `tabSMS Outbox`
+		SET status = %s, claimed_at = %s, attempts = attempts + 1, modified = %s
+		WHERE name IN %s
+	""", (STATUS_SENDING, now, now, tuple(names)))
+	frappe.db.commit()
+
+	return frappe.get_all("SMS Outbox", filters={"name": ["in", names]}, fields=ROW_FIELDS)
+
+
+def coalesce_batch(rows, window=DEFAULT_COALESCE_WINDOW):
+	"""Ajoute au lot les SMS en attente de même (voie, expéditeur, texte), d'où qu'ils viennent
+
+	Si le lot contient des lignes créées il y a moins de `window` secondes, une rafale est
+	probablement en cours: le worker attend la fin de la fenêtre avant de réclamer les
+	lignes identiques arrivées entre-temps. send_grouped en fait un seul job OVH
+	multi-destinataires et dispatch_rows redistribue l'identifiant OVH de chaque numéro
+	à sa ligne (et donc à son document d'origine).
+	"""
+	if window <= 0 or not rows:
+		return rows
+
+	newest = max(row.creation for row in rows)
+	remaining = window - (now_datetime() - newest).total_seconds()
+	if remaining > 0:
+		time.sleep(min(remaining, window))
+
+	keys = {(row.lane or DEFAULT_LANE, row.sender or "", row.message) for row in rows}
+	now = now_datetime()
+	names = frappe.db.sql("""
+		SELECT name FROM `tabSMS Outbox`
+		WHERE status = %(status)s AND next_attempt_at <= %(now)s
+		AND (lane, IFNULL(sender, ''), message) IN %(keys)s
+		ORDER BY next_attempt_at
+		LIMIT %(limit)s
+		FOR UPDATE SKIP LOCKED
+	""", {"status": STATUS_QUEUED, "now": now, "keys": tuple(keys), "limit": MAX_COALESCED_ROWS}, pluck=True)
+
+	siblings = _mark_claimed(names, now)
+	if siblings:
+		frappe.logger().info(f"SMS Outbox: {len(siblings)} SMS identiques regroupés avec le lot")
+
+	return rows + siblings
+
+
+def _claim_lane(lane, limit, now, exclude=None):
+	"""Verrouille jusqu'à `limit` lignes prêtes d'une voie (dans la transaction courante)"""
+	if limit <= 0:
+		return []
+
+	exclude_condition = "AND name NOT IN %(exclude)s" if exclude else ""
+	return frappe.db.sql(f"""
+		SELECT name FROM `tabSMS Outbox`
+		WHERE status = %(status)s AND lane = %(lane)s AND next_attempt_at <= %(now)s
+		{exclude_condition}
+		ORDER BY next_attempt_at
+		LIMIT %(limit)s
+		FOR UPDATE SKIP LOCKED
+	""", {"status": STATUS_QUEUED, "lane": lane, "now": now, "limit": limit, "exclude": tuple(exclude or ())},
+	pluck=True)
+
+
+def dispatch_rows(settings, rows):
+	"""Envoie des lignes réclamées (par voie, puis par expéditeur) et enregistre leurs résultats
+
+	Les textes identiques d'un groupe partent en un seul job OVH; le résultat (et l'identifiant
+	OVH) de chaque destinataire est reporté sur sa propre ligne.
+	"""
+	lane_order = lanes_by_weight()
+	groups = {}
+	for row in rows:
+		groups.setdefault((row.lane or DEFAULT_LANE, row.sender or None), []).append(row)
+
+	breaker = settings.get_circuit_breaker()
+
+	# La voie la plus prioritaire part en premier
+	for (lane, sender), group in sorted(groups.items(), key=lambda entry: lane_order.index(entry[0][0])):
+		if breaker.get_state() == STATE_OPEN:
+			# Disjoncteur ouvert: rien n'est tenté, la tentative n'est pas décomptée
+			release_rows([row.name for row in group], cint(breaker.reset_timeout))
+			continue
+
+		try:
+			results = settings.send_grouped([(row.receiver, row.message) for row in group], sender, lane)
+		except Exception as e:
+			frappe.log_error(f"Erreur envoi lot SMS Outbox: {e}")
+			results = [{"success": False, "message": str(e), "retryable": True}] * len(group)
+
+		failures = []
+		throttled = []
+		for row, result in zip(group, results):
+			if (result or {}).get("error_class") == RATE_LIMITED:
+				# Débit OVH atteint: rien n'a été transmis, la ligne repart en file sans tentative décomptée
+				throttled.append(row.name)
+			elif apply_result(row, result) == STATUS_FAILED:
+				failures.append(dead_letter_entry(row, result))
+
+		release_rows(throttled)
+
+		# Échecs définitifs: conservés avec leur erreur pour un rejeu ultérieur
+		record_dead_letters(failures)
+		frappe.db.commit()
+
+
+def apply_result(row, result):
+	"""Passe une ligne à Envoyé, la reprogramme ou la marque Échoué; retourne le nouveau statut"""
+	result = result or {"success": False, "message": "Pas de réponse", "retryable": True}
+	now = now_datetime()
+
+	if result.get("success"):
+		values = {"status": STATUS_SENT, "sent_at": now, "ovh_id": result.get("id"), "last_error": None}
+	elif result.get("retryable") and row.attempts < (row.max_attempts or DEFAULT_MAX_ATTEMPTS):
+		values = {
+			"status": STATUS_QUEUED,
+			"next_attempt_at": add_to_date(now, seconds=retry_delay(row.attempts)),
+			"last_error": result.get("message")
+		}
+	else:
+		values = {"status": STATUS_FAILED, "last_error": result.get("message")}
+
+	frappe.db.set_value("SMS Outbox", row.name, values)
+
+	if values["status"] != STATUS_QUEUED:
+		notify_reference(row, values["status"], result)
+
+	return values["status"]
+
+
+def dead_letter_entry(row, result):
+	"""Contenu de la lettre morte d'une ligne en échec définitif"""
+	return {
+		"receiver": row.receiver,
+		"message": row.message,
+		"sender": row.sender,
+		"lane": row.lane,
+		"reference_doctype": row.reference_doctype,
+		"reference_name": row.reference_name,
+		"outbox": row.name,
+		"attempts": row.attempts,
+		"result": result
+	}
+
+
+def retry_delay(attempts):
+	"""Délai avant la tentative suivante: exponentiel, plafonné"""
+	return min(MAX_RETRY_DELAY, RETRY_BASE_DELAY * (2 ** max(0, attempts - 1)))
+
+
+def release_rows(names, delay=0):
+	"""Remet des lignes réclamées en file sans décompter la tentative"""
+	if not names:
+		return
+
+	now = now_datetime()
+	frappe.db.sql("""
+		UPDATE `tabSMS Outbox`
+		SET status = %s, attempts = GREATEST(attempts - 1, 0), next_attempt_at = %s, modified = %s
+		WHERE name IN %s
+	""", (STATUS_QUEUED, add_to_date(now, seconds=delay), now, tuple(names)))
+
+
+def release_stale_claims():
+	"""Remet en file les lignes restées "En cours" après l'arrêt brutal d'un worker"""
+	now = now_datetime()
+	frappe.db.sql("""
+		UPDATE `tabSMS Outbox`
+		SET status = %s, next_attempt_at = %s, modified = %s
+		WHERE status = %s AND claimed_at < %s
+	""", (STATUS_QUEUED, now, now, STATUS_SENDING, add_to_date(now, minutes=-STALE_CLAIM_MINUTES)))
+	frappe.db.commit()
+
+
+def notify_reference(row, status, result):
+	"""Prévient le document d'origine (hook sms_outbox_status_handlers) du statut final"""
+	if not row.reference_doctype:
+		return
+
+	handlers = frappe.get_hooks("sms_outbox_status_handlers", {}).get(row.reference_doctype) or []
+	for method in handlers:
+		try:
+			frappe.get_attr(method)(row.reference_name, status, result)
+		except Exception as e:
+			frappe.log_error(f"Erreur mise à jour {row.reference_doctype} {row.reference_name}: {e}")
+
+
+@frappe.whitelist()
+def get_outbox_statistics():
+	"""Nombre de SMS par statut dans l'outbox"""
+	counts = frappe.db.sql("""
+		SELECT status, COUNT(*) FROM `tabSMS Outbox` GROUP BY status
+	""")
+	stats = {status: 0 for status in (STATUS_QUEUED, STATUS_SENDING, STATUS_SENT, STATUS_FAILED)}
+	stats.update(dict(counts))
+
+	return {"success": True, "stats": stats}
@@ -53,6 +53,8 @@ frappe.ui.form.on("SMS Pricing Campaign", {
 				},
 				__("Actions SMS")
 			);
+
+			setup_send_job_controls(frm);
 		}
 
 		// Bouton test toujours disponible
@@ -79,6 +81,22 @@ frappe.ui.form.on("SMS Pricing Campaign", {
 
 		// Configuration des filtres
 		setup_filters(frm);
+
+		// Avancement de l'envoi en arrière-plan
+		frappe.realtime.off("sms_campaign_progress");
+		frappe.realtime.on("sms_campaign_progress", function (data) {
+			if (data.campaign !== frm.doc.name) {
+				return;
+			}
+			frm.dashboard.show_progress(
+				__("Envoi SMS"),
+				data.progress,
+				__(`${data.processed} / ${data.total} lignes traitées`)
+			);
+			if (data.status !== "En cours") {
+				frm.reload_doc();
+			}
+		});
 	},
 
 	validate: function (frm) {
@@ -305,7 +323,7 @@ function calculate_campaign_totals(frm) {
 	frm.set_value("total_customers", unique_customers.size);
 	frm.set_value("estimated_revenue", total_amount);
 	frm.set_value("profit_potential", total_margin);
-	frm.set_value("total_sms_cost", unique_customers.size * 0.1); // 0.10€ par SMS
+	// total_sms_cost: calculé à l'enregistrement sur les messages rendus (segments GSM-7/UCS-2)
 
 	// Calcul pourcentage de marge moyen
 	if (total_valuation > 0) {
@@ -585,6 +603,46 @@ function send_selected_sms(frm) {
 	);
 }
 
+function setup_send_job_controls(frm) {
+	const controls = {
+		"En cours": [
+			[__("Suspendre l'envoi"), "pause_campaign_send"],
+			[__("Annuler l'envoi"), "cancel_campaign_send"],
+		],
+		"En pause": [
+			[__("Reprendre l'envoi"), "resume_campaign_send"],
+			[__("Annuler l'envoi"), "cancel_campaign_send"],
+		],
+		"Échoué": [[__("Reprendre l'envoi"), "resume_campaign_send"]],
+	};
+
+	(controls[frm.doc.send_job_status] || []).forEach(([label, method]) => {
+		frm.add_custom_button(
+			label,
+			function () {
+				frappe.call({
+					method: `ovh_sms_integration.ovh_sms_integration.doctype.sms_pricing_campaign.sms_pricing_campaign.${method}`,
+					args: {
+						campaign_name: frm.doc.name,
+					},
+					callback: function (r) {
+						frappe.show_alert({
+							message: r.message.message,
+							indicator: r.message.success ? "green" : "orange",
+						});
+						frm.reload_doc();
+					},
+				});
+			},
+			__("Actions SMS")
+		);
+	});
+
+	if (frm.doc.send_job_status === "En cours" || frm.doc.send_job_status === "En pause") {
+		frm.dashboard.show_progress(__("Envoi SMS"), frm.doc.send_progress || 0);
+	}
+}
+
 function handle_sms_response(frm, r) {
 	if (r.message && r.message.success) {
 		frm.set_value("last_action_result", r.message.message);
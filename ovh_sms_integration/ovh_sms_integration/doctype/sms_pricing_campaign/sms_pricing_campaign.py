@@ -2,10 +2,66 @@
 from __future__ import unicode_literals
 import frappe
 from frappe.model.document import Document
+from frappe.utils import cint, flt
 from frappe import _
 from datetime import datetime
 import json
-from jinja2 import Template
+from ovh_sms_integration.ovh_sms_integration.doctype.sms_outbox.sms_outbox import enqueue_sms, STATUS_SENT
+from ovh_sms_integration.ovh_sms_integration.doctype.sms_dead_letter.sms_dead_letter import (
+	get_dead_lettered, record_dead_letters
+)
+from ovh_sms_integration.utils.phone_numbers import (
+	is_mobile, normalize as normalize_phone_number, normalize_many as normalize_phone_numbers
+)
+from ovh_sms_integration.utils.ovh_async import DEFAULT_CONCURRENCY
+from ovh_sms_integration.utils.priority_lanes import LANE_MARKETING
+from ovh_sms_integration.utils.sms_templates import (
+	build_context, get_variables, invalidate_changed_templates, render_many, select_builders,
+	validate_template_fields
+)
+from ovh_sms_integration.utils.sms_encoding import analyze, estimate_totals, fit_gsm7, segment_count
+
+# Envoi en arrière-plan: les lignes sélectionnées sont découpées en shards (plages d'idx contiguës)
+# traités en parallèle par lots; send_shards mémorise les plages et le point de contrôle de chaque shard
+SEND_CHUNK_SIZE = 200
+SEND_JOB_TIMEOUT = 3600  # Secondes, plus la durée des envois du shard au débit de la voie marketing
+DEFAULT_SEND_SHARDS = 4
+SEND_JOB_RUNNING = "En cours"
+SEND_JOB_PAUSED = "En pause"
+SEND_JOB_CANCELLED = "Annulé"
+SEND_JOB_DONE = "Terminé"
+SEND_JOB_FAILED = "Échoué"  # Au moins un shard interrompu par une erreur: relançable
+SEND_METHOD = "ovh_sms_integration.ovh_sms_integration.doctype.sms_pricing_campaign.sms_pricing_campaign.run_campaign_send"
+PROGRESS_EVENT = "sms_campaign_progress"
+STATUS_WRITE_BATCH = 1000  # Lignes par UPDATE ... WHERE name IN (...)
+DEFAULT_SEGMENT_COST = 0.10  # € par segment si non renseigné dans OVH SMS Settings
+DEFAULT_SMS_TEMPLATE = "Bonjour {{customer_name}}, nous vous proposons {{item_name}} au prix de {{final_price}}€."
+# Champs des lignes dont dépendent les messages rendus (et donc l'estimation du coût)
+ESTIMATE_FIELDS = (
+	"customer", "customer_name", "customer_mobile", "item_code", "item_name", "qty",
+	"valuation_rate", "margin_amount_eur", "final_price", "amount"
+)
+ITEM_FIELDS = [
+	"name", "idx", "customer", "customer_name", "customer_mobile", "item_code", "item_name", "qty",
+	"valuation_rate", "margin_amount_eur", "final_price", "amount", "sms_sent", "sms_status"
+]
+
+# Variables de template: communes à la campagne, puis propres à chaque ligne
+CAMPAIGN_CONTEXT_BUILDERS = {
+	'currency': lambda campaign: "EUR",  # Force EUR
+	'company': lambda campaign: campaign.company or frappe.defaults.get_user_default("Company") or "",
+	'campaign_title': lambda campaign: campaign.title or ""
+}
+ITEM_CONTEXT_BUILDERS = {
+	'customer_name': lambda item: item.customer_name or item.customer,
+	'item_name': lambda item: item.item_name or item.item_code,
+	'item_code': lambda item: item.item_code,
+	'final_price': lambda item: "{:.2f}".format(item.final_price or 0),
+	'amount': lambda item: "{:.2f}".format(item.amount or 0),
+	'valuation_rate': lambda item: "{:.2f}".format(item.valuation_rate or 0),
+	'margin_eur': lambda item: "{:.2f}".format(item.margin_amount_eur or 0),
+	'qty': lambda item: item.qty or 1
+}
 
 class SMSPricingCampaign(Document):
 	def validate(self):
@@ -13,10 +69,17 @@ class SMSPricingCampaign(Document):
 		if not self.pricing_items:
 			frappe.throw(_("Veuillez ajouter au moins un article et client"))
 		
+		# Numéros des lignes importées normalisés en un passage
+		self.normalize_mobiles()
+		
 		# Validation des lignes
 		for item in self.pricing_items:
 			self.validate_pricing_item(item)
 		
+		# Compilation et rendu d'exemple du template (sur la première ligne)
+		sample = dict(self.get_shared_context(), **self.get_item_context(self.pricing_items[0]))
+		validate_template_fields(self, ("sms_template",), sample)
+		
 		# Calcul des totaux
 		self.calculate_totals()
 		
@@ -27,6 +90,28 @@ class SMSPricingCampaign(Document):
 		"""Actions avant sauvegarde"""
 		self.calculate_totals()
 
+	def on_update(self):
+		"""Libère du cache l'ancienne version du template modifié"""
+		invalidate_changed_templates(self, ("sms_template",))
+
+	def normalize_mobiles(self):
+		"""Formate les numéros des lignes (E.164) et signale ceux qui ne sont pas des mobiles"""
+		numbers = normalize_phone_numbers([item.customer_mobile for item in self.pricing_items])
+		not_mobile = 0
+		
+		for item, number in zip(self.pricing_items, numbers):
+			if not number:
+				continue
+			item.customer_mobile = number
+			if not is_mobile(number):
+				not_mobile += 1
+		
+		if not_mobile:
+			frappe.msgprint(
+				_("{0} numéro(s) ne correspondent pas à un mobile connu: les SMS risquent de ne pas être reçus").format(not_mobile),
+				indicator="orange"
+			)
+
 	def validate_pricing_item(self, item):
 		"""Valide une ligne de tarification"""
 		if not item.customer:
@@ -88,21 +173,11 @@ class SMSPricingCampaign(Document):
 		return None
 
 	def format_phone_number(self, phone):
-		"""Formate un numéro de téléphone français"""
+		"""Formate un numéro de téléphone (E.164, sans rejeter les numéros invalides)"""
 		if not phone:
 			return phone
 		
-		import re
-		# Supprimer tous les caractères non numériques sauf le +
-		cleaned = re.sub(r'[^\d+]', '', str(phone))
-		
-		# Format français
-		if cleaned.startswith('0'):
-			cleaned = '+33' + cleaned[1:]
-		elif not cleaned.startswith('+'):
-			cleaned = '+33' + cleaned
-		
-		return cleaned
+		return normalize_phone_number(phone, strict=False)
 
 	def calculate_item_pricing(self, item):
 		"""Calcule le prix avec marge pour un article - NOUVELLE LOGIQUE"""
@@ -129,7 +204,6 @@ class SMSPricingCampaign(Document):
 			total_amount = 0
 			total_margin = 0
 			total_valuation = 0
-			sms_cost = 0.10  # Coût estimé par SMS
 			
 			for item in self.pricing_items:
 				if item.customer:
@@ -146,7 +220,9 @@ class SMSPricingCampaign(Document):
 			
 			self.total_items = total_items
 			self.total_customers = len(unique_customers)
-			self.total_sms_cost = self.total_customers * sms_cost
+			
+			# Coût réel: segments des messages rendus (un accent hors GSM-7 passe le message en UCS-2)
+			self.update_sms_estimate()
 			self.estimated_revenue = total_amount
 			self.profit_potential = total_margin
 			
@@ -189,66 +265,135 @@ class SMSPricingCampaign(Document):
 		
 		return True
 
-	def format_sms_message(self, item):
-		"""Formate le message SMS pour un client/article"""
+	def get_sms_template(self):
+		"""Template des messages de la campagne"""
+		return self.sms_template or DEFAULT_SMS_TEMPLATE
+
+	def get_shared_context(self, variables=None):
+		"""Variables communes à toutes les lignes de la campagne (seulement `variables` si fourni)"""
+		return build_context(select_builders(CAMPAIGN_CONTEXT_BUILDERS, variables), self)
+
+	def get_item_context(self, item, variables=None):
+		"""Variables propres à une ligne client/article (seulement `variables` si fourni)"""
+		return build_context(select_builders(ITEM_CONTEXT_BUILDERS, variables), item)
+
+	def render_sms_messages(self, items):
+		"""Rend les messages d'une liste de lignes en un appel: [(ligne, texte, segments)]
+		
+		Le template est compilé une fois; s'il n'utilise que des variables de campagne,
+		il n'est rendu qu'une fois pour toutes les lignes. Si le rendu groupé échoue, les
+		lignes sont rendues une à une: seules les lignes en erreur reçoivent le texte de repli.
+		"""
+		template = self.get_sms_template()
 		try:
-			template = self.sms_template or "Bonjour {{customer_name}}, nous vous proposons {{item_name}} au prix de {{final_price}}€."
-			
-			# Préparation du contexte
-			context = {
-				'customer_name': item.customer_name or item.customer,
-				'item_name': item.item_name or item.item_code,
-				'item_code': item.item_code,
-				'final_price': "{:.2f}".format(item.final_price or 0),
-				'amount': "{:.2f}".format(item.amount or 0),
-				'currency': "EUR",  # Force EUR
-				'valuation_rate': "{:.2f}".format(item.valuation_rate or 0),
-				'margin_eur': "{:.2f}".format(item.margin_amount_eur or 0),
-				'qty': item.qty or 1,
-				'company': self.company or frappe.defaults.get_user_default("Company") or "",
-				'campaign_title': self.title or ""
-			}
-			
-			# Formatage avec Jinja2
-			template_obj = Template(template)
-			message = template_obj.render(**context)
-			
-			return message
+			# Seules les variables utilisées par le template sont calculées
+			variables = get_variables(template)
+			item_builders = select_builders(ITEM_CONTEXT_BUILDERS, variables)
 			
+			rendered = render_many(
+				template,
+				[(item, build_context(item_builders, item)) for item in items],
+				shared=self.get_shared_context(variables)
+			)
+		except Exception:
+			rendered = [self.render_item_message(template, item) for item in items]
+		
+		if self.auto_transliterate:
+			# Translittération seulement si elle économise des segments (une fois par texte distinct)
+			fitted = {}
+			for item, text, segments in rendered:
+				if text not in fitted:
+					converted = fit_gsm7(text)
+					fitted[text] = (converted, segment_count(converted))
+			rendered = [(item,) + fitted[text] for item, text, segments in rendered]
+		
+		return rendered
+
+	def render_item_message(self, template, item):
+		"""Rend le message d'une seule ligne: (ligne, texte, segments), texte de repli en cas d'erreur"""
+		try:
+			variables = get_variables(template)
+			return render_many(
+				template, [(item, self.get_item_context(item, variables))], shared=self.get_shared_context(variables)
+			)[0]
 		except Exception as e:
-			frappe.log_error(f"Erreur formatage message SMS: {e}")
-			return f"Offre {item.item_name} à {item.final_price}€ pour {item.customer_name}"
+			frappe.log_error(f"Erreur formatage message SMS ({item.customer_name}): {e}")
+			text = f"Offre {item.item_name} à {item.final_price}€ pour {item.customer_name}"
+			return (item, text, segment_count(text))
+
+	def estimate_sms_cost(self):
+		"""Messages, segments et coût de la campagne calculés sur les messages rendus"""
+		items = [item for item in self.pricing_items if item.selected_for_sending and item.customer_mobile]
+		return estimate_totals(self.format_sms_messages(items), get_cost_per_segment())
+
+	def get_estimate_inputs(self):
+		"""Données dont dépendent les messages rendus: template, campagne et lignes sélectionnées"""
+		return (
+			self.get_sms_template(), cint(self.auto_transliterate), self.company, self.title,
+			tuple(
+				tuple(item.get(fieldname) for fieldname in ESTIMATE_FIELDS)
+				for item in self.pricing_items if item.selected_for_sending and item.customer_mobile
+			)
+		)
+
+	def update_sms_estimate(self):
+		"""Segments et coût de la campagne, recalculés seulement si les messages ont pu changer
+		
+		Le rendu de toutes les lignes n'a lieu qu'une fois par sauvegarde (validate puis
+		before_save), et pas du tout si ni le template ni les lignes sélectionnées n'ont changé.
+		"""
+		inputs = self.get_estimate_inputs()
+		previous = self.get_doc_before_save()
+		unchanged = inputs == getattr(self, "_estimate_inputs", None) or (
+			previous is not None and previous.get_estimate_inputs() == inputs
+		)
+		
+		if not unchanged:
+			estimate = self.estimate_sms_cost()
+			self.total_sms_segments = estimate["segments"]
+			self.ucs2_messages = estimate["ucs2"]
+		
+		self._estimate_inputs = inputs
+		self.total_sms_cost = cint(self.total_sms_segments) * get_cost_per_segment()
+
+	def format_sms_messages(self, items):
+		"""Textes des messages d'une liste de lignes, dans l'ordre"""
+		return [text for item, text, segments in self.render_sms_messages(items)]
+
+	def format_sms_message(self, item):
+		"""Formate le message SMS pour un client/article"""
+		return self.format_sms_messages([item])[0]
 
 	def send_sms_to_item(self, item):
-		"""Envoie un SMS pour une ligne spécifique"""
+		"""Met en file le SMS d'une ligne spécifique
+		
+		Le statut de la ligne est mis à jour par l'outbox une fois le SMS envoyé (on_outbox_status).
+		"""
 		try:
 			if item.sms_sent:
 				return {"success": False, "message": "SMS déjà envoyé"}
 			
+			if item.sms_status == "En file":
+				return {"success": False, "message": "SMS déjà en file d'attente"}
+			
 			if not item.customer_mobile:
 				return {"success": False, "message": "Numéro mobile manquant"}
 			
 			# Formatage du message
 			message = self.format_sms_message(item)
 			
-			# Envoi via OVH SMS
 			sms_settings = frappe.get_single('OVH SMS Settings')
 			if not sms_settings.enabled:
 				return {"success": False, "message": "OVH SMS non activé"}
 			
-			result = sms_settings.send_sms(message, item.customer_mobile)
+			# Mise en file: l'envoi OVH se fait hors de la requête
+			enqueue_sms(
+				item.customer_mobile, message, reference_doctype="SMS Pricing Item",
+				reference_name=item.name, lane=LANE_MARKETING
+			)
+			item.sms_status = "En file"
 			
-			# Mise à jour du statut
-			if result and result.get('success'):
-				item.sms_sent = 1
-				item.sms_status = "Envoyé"
-				
-				return {"success": True, "message": "SMS envoyé avec succès"}
-			else:
-				item.sms_status = "Échoué"
-				error_msg = result.get('message', 'Erreur inconnue') if result else 'Pas de réponse'
-				
-				return {"success": False, "message": error_msg}
+			return {"success": True, "message": "SMS mis en file d'attente"}
 		
 		except Exception as e:
 			error_msg = f"Erreur envoi SMS: {str(e)}"
@@ -257,8 +402,30 @@ class SMSPricingCampaign(Document):
 			
 			return {"success": False, "message": error_msg}
 
+	def apply_sms_result(self, item, result):
+		"""Met à jour le statut d'une ligne à partir du résultat d'envoi
+		
+		Le résultat d'envoi est conservé (error_class, http_status, retryable): SMS Dead Letter
+		en a besoin pour décider du rejeu.
+		"""
+		outcome = dict(result or {})
+		
+		if result and result.get('success'):
+			item.sms_sent = 1
+			item.sms_status = "Envoyé"
+			outcome.update({"success": True, "message": "SMS envoyé avec succès"})
+		else:
+			item.sms_status = "Échoué"
+			error_msg = result.get('message', 'Erreur inconnue') if result else 'Pas de réponse'
+			outcome.update({"success": False, "message": error_msg})
+		
+		return outcome
+
 	def send_all_sms(self):
-		"""Envoie tous les SMS de la campagne"""
+		"""Envoie tous les SMS de la campagne
+		
+		Les messages identiques sont regroupés en jobs OVH multi-destinataires.
+		"""
 		results = {
 			"sent": 0,
 			"failed": 0,
@@ -266,27 +433,28 @@ class SMSPricingCampaign(Document):
 		}
 		
 		try:
-			for item in self.pricing_items:
-				if item.selected_for_sending and not item.sms_sent:
-					result = self.send_sms_to_item(item)
-					
-					if result["success"]:
-						results["sent"] += 1
-					else:
-						results["failed"] += 1
-					
-					results["details"].append({
-						"customer": item.customer_name or item.customer,
-						"item": item.item_name or item.item_code,
-						"success": result["success"],
-						"message": result["message"]
-					})
-			
-			# Mise à jour des statistiques
-			self.update_sending_statistics(results)
-			
-			# Sauvegarde
-			self.save()
+			items = [item for item in self.pricing_items if item.selected_for_sending and not item.sms_sent]
+			outcomes = self.send_items_grouped(items)
+			
+			for item, result in zip(items, outcomes):
+				if result["success"]:
+					results["sent"] += 1
+				else:
+					results["failed"] += 1
+				
+				results["details"].append({
+					"customer": item.customer_name or item.customer,
+					"item": item.item_name or item.item_code,
+					"success": result["success"],
+					"message": result["message"]
+				})
+			
+			# Écriture ciblée: seules les lignes envoyées et les compteurs sont mis à jour,
+			# sans self.save() (pas de revalidation ni de réécriture de toute la table)
+			write_item_statuses(items)
+			self.record_failures(items, outcomes)
+			self.update_sending_statistics(results["sent"], results["failed"])
+			self.refresh_send_status()
 			
 			return results
 			
@@ -298,18 +466,294 @@ class SMSPricingCampaign(Document):
 				"error": str(e)
 			}
 
-	def update_sending_statistics(self, results):
-		"""Met à jour les statistiques d'envoi"""
-		try:
-			self.sms_sent_count = (self.sms_sent_count or 0) + results["sent"]
-			self.sms_failed_count = (self.sms_failed_count or 0) + results["failed"]
-			self.last_sent_time = datetime.now()
+	def send_items_grouped(self, items, wait=False):
+		"""Envoie les SMS d'une liste de lignes via l'envoi groupé OVH
+		
+		`wait` (envoi en arrière-plan): le débit OVH retarde les envois au lieu de les mettre en échec.
+		Retourne les résultats par ligne, dans l'ordre des lignes.
+		"""
+		outcomes = [None] * len(items)
+		pending = []
+		
+		for index, item in enumerate(items):
+			if not item.customer_mobile:
+				outcomes[index] = {"success": False, "message": "Numéro mobile manquant"}
+			else:
+				pending.append((index, item))
+		
+		# Rendu de tout le lot en un appel
+		pending = [
+			(index, item, message)
+			for (index, item), message in zip(pending, self.format_sms_messages([item for index, item in pending]))
+		]
+		
+		if pending:
+			sms_settings = frappe.get_single('OVH SMS Settings')
+			if not sms_settings.enabled:
+				for index, item, message in pending:
+					outcomes[index] = {"success": False, "message": "OVH SMS non activé"}
+				return outcomes
 			
-			# Mise à jour du statut
-			self.update_status()
+			# Voie marketing: la campagne ne consomme pas le débit des SMS transactionnels
+			send_results = sms_settings.send_grouped(
+				[(item.customer_mobile, message) for index, item, message in pending],
+				lane=LANE_MARKETING,
+				wait=wait
+			)
 			
-		except Exception as e:
-			frappe.log_error(f"Erreur mise à jour statistiques: {e}")
+			for (index, item, message), result in zip(pending, send_results):
+				outcomes[index] = self.apply_sms_result(item, result)
+		
+		return outcomes
+
+	def start_background_send(self, chunk_size=SEND_CHUNK_SIZE, shards=None):
+		"""Lance (ou relance) l'envoi de la campagne, un job d'arrière-plan par shard
+		
+		Un envoi en pause ou interrompu reprend chaque shard inachevé à son point de contrôle;
+		un nouvel envoi redécoupe les lignes (les lignes déjà envoyées sont de toute façon ignorées).
+		"""
+		resumable = (SEND_JOB_RUNNING, SEND_JOB_PAUSED, SEND_JOB_FAILED)
+		plan = self.get_shard_plan() if self.send_job_status in resumable else None
+		if plan:
+			# Reprise: les shards en échec repartent de leur point de contrôle
+			plan["failed"] = [0] * len(plan["ranges"])
+			self.db_set("send_shards", json.dumps(plan), update_modified=False)
+		else:
+			plan = self.plan_shards(shards)
+			self.db_set(
+				{"send_shards": json.dumps(plan), "send_processed": 0, "send_progress": 0}, update_modified=False
+			)
+		
+		pending = [
+			shard for shard, (low, high) in enumerate(plan["ranges"]) if plan["checkpoints"][shard] < high
+		]
+		self.db_set(
+			{"send_job_status": SEND_JOB_RUNNING, "send_shards_pending": len(pending)}, update_modified=False
+		)
+		
+		if not pending:
+			self.finish_background_send()
+			return
+		
+		for shard in pending:
+			frappe.enqueue(
+				SEND_METHOD,
+				queue="long",
+				timeout=get_shard_timeout(plan["ranges"][shard][1] - plan["checkpoints"][shard], len(pending)),
+				job_id=f"sms_campaign_send_{self.name}_{shard}",
+				deduplicate=True,
+				enqueue_after_commit=True,
+				campaign_name=self.name,
+				shard=shard,
+				chunk_size=chunk_size
+			)
+
+	def plan_shards(self, shards=None):
+		"""Découpe les lignes sélectionnées en plages d'idx contiguës de même nombre de lignes"""
+		shards = max(1, cint(shards) or cint(
+			frappe.db.get_single_value("OVH SMS Settings", "campaign_shards")
+		) or DEFAULT_SEND_SHARDS)
+		indexes = frappe.db.sql("""
+			SELECT idx FROM `tabSMS Pricing Item`
+			WHERE parent = %s AND parenttype = 'SMS Pricing Campaign' AND selected_for_sending = 1
+			ORDER BY idx
+		""", self.name, pluck=True)
+		
+		size = max(1, -(-len(indexes) // shards))
+		ranges = [
+			[indexes[start], indexes[min(start + size, len(indexes)) - 1]]
+			for start in range(0, len(indexes), size)
+		]
+		
+		return {
+			"ranges": ranges,
+			"checkpoints": [low - 1 for low, high in ranges],
+			"failed": [0] * len(ranges)
+		}
+
+	def get_shard_plan(self):
+		"""Découpage courant (plages et points de contrôle), relu en base"""
+		plan = frappe.db.get_value("SMS Pricing Campaign", self.name, "send_shards")
+		return json.loads(plan) if plan else None
+
+	def get_send_progress(self):
+		"""Lignes sélectionnées traitées / total, tous shards confondus"""
+		total = frappe.db.count(
+			"SMS Pricing Item",
+			{"parent": self.name, "parenttype": "SMS Pricing Campaign", "selected_for_sending": 1}
+		)
+		# Un lot rejoué après l'arrêt d'un worker peut être compté deux fois
+		processed = min(cint(frappe.db.get_value("SMS Pricing Campaign", self.name, "send_processed")), total)
+		
+		return {
+			"campaign": self.name,
+			"status": self.send_job_status,
+			"processed": processed,
+			"total": total,
+			"progress": (flt(processed) * 100 / total) if total else 100
+		}
+
+	def get_next_chunk(self, checkpoint, high, chunk_size):
+		"""Prochaines lignes sélectionnées d'un shard, après son point de contrôle"""
+		return frappe.get_all(
+			"SMS Pricing Item",
+			filters=[
+				["parent", "=", self.name],
+				["parenttype", "=", "SMS Pricing Campaign"],
+				["selected_for_sending", "=", 1],
+				["idx", ">", cint(checkpoint)],
+				["idx", "<=", cint(high)]
+			],
+			fields=ITEM_FIELDS,
+			order_by="idx asc",
+			limit_page_length=chunk_size
+		)
+
+	def record_chunk(self, items, outcomes, shard, checkpoint, processed):
+		"""Enregistre le résultat d'un lot et avance le point de contrôle du shard (sans self.save())"""
+		write_item_statuses(items)
+		self.record_failures(items, outcomes)
+		
+		sent = sum(1 for result in outcomes if result["success"])
+		self.update_sending_statistics(sent, len(outcomes) - sent, processed)
+		
+		# Mise à jour atomique de la seule case du shard: les autres shards écrivent en parallèle
+		frappe.db.sql("""
+			UPDATE `tabSMS Pricing Campaign`
+			SET send_shards = JSON_SET(send_shards, %s, %s)
+			WHERE name = %s
+		""", (f"$.checkpoints[{cint(shard)}]", cint(checkpoint), self.name))
+
+	def record_failures(self, items, outcomes):
+		"""Conserve les SMS en échec dans SMS Dead Letter: seuls eux seront rejoués"""
+		failed = [
+			(item, result) for item, result in zip(items, outcomes)
+			if not result["success"] and item.customer_mobile
+		]
+		if not failed:
+			return
+		
+		messages = self.format_sms_messages([item for item, result in failed])
+		record_dead_letters([
+			{
+				"receiver": item.customer_mobile,
+				"message": message,
+				"lane": LANE_MARKETING,
+				"reference_doctype": "SMS Pricing Item",
+				"reference_name": item.name,
+				"result": result
+			}
+			for (item, result), message in zip(failed, messages)
+		])
+
+	def complete_shard(self):
+		"""Barrière de fin: décompte un shard terminé, retourne True pour le dernier seulement
+		
+		Le verrou de ligne sérialise les shards: un seul voit le compteur passer de 1 à 0.
+		"""
+		pending = frappe.db.sql("""
+			SELECT send_shards_pending FROM `tabSMS Pricing Campaign`
+			WHERE name = %s
+			FOR UPDATE
+		""", self.name, pluck=True)
+		pending = cint(pending[0]) if pending else 0
+		
+		if pending <= 0:
+			return False
+		
+		frappe.db.sql("""
+			UPDATE `tabSMS Pricing Campaign`
+			SET send_shards_pending = %s
+			WHERE name = %s
+		""", (pending - 1, self.name))
+		
+		return pending == 1
+
+	def fail_shard(self, shard):
+		"""Marque un shard en échec et le décompte de la barrière (le dernier shard finalise l'envoi)"""
+		frappe.db.sql("""
+			UPDATE `tabSMS Pricing Campaign`
+			SET send_shards = JSON_SET(send_shards, %s, 1)
+			WHERE name = %s
+		""", (f"$.failed[{cint(shard)}]", self.name))
+		
+		if self.complete_shard():
+			self.finish_background_send()
+
+	def finish_background_send(self):
+		"""Fin de l'envoi: compteurs et statut de la campagne recalculés depuis les lignes, fin du job
+		
+		Les compteurs incrémentés lot par lot peuvent compter deux fois un lot rejoué après
+		l'arrêt d'un worker: la barrière les remplace par le décompte réel des lignes.
+		"""
+		self.refresh_send_status(recount=True)
+		
+		plan = self.get_shard_plan() or {}
+		status = SEND_JOB_FAILED if any(plan.get("failed") or []) else SEND_JOB_DONE
+		self.db_set(
+			{"send_job_status": status, "send_progress": 100 if status == SEND_JOB_DONE else self.send_progress},
+			update_modified=False
+		)
+		self.send_job_status = status
+
+	def refresh_send_status(self, recount=False):
+		"""Statut de la campagne d'après les lignes réellement envoyées (une requête agrégée)
+		
+		Avec `recount`, sms_sent_count et sms_failed_count sont aussi recalculés depuis les lignes.
+		"""
+		total, sent, failed = frappe.db.sql("""
+			SELECT COUNT(*), COALESCE(SUM(sms_sent), 0), COALESCE(SUM(sms_sent = 0 AND sms_status = 'Échoué'), 0)
+			FROM `tabSMS Pricing Item`
+			WHERE parent = %s AND parenttype = 'SMS Pricing Campaign'
+		""", self.name)[0]
+		
+		if cint(sent) == 0:
+			status = self.status
+		elif cint(sent) == cint(total):
+			status = "Envoyé"
+		else:
+			status = "Partiellement envoyé"
+		
+		values = {}
+		if status != self.status:
+			values["status"] = status
+		if recount:
+			values.update({"sms_sent_count": cint(sent), "sms_failed_count": cint(failed)})
+		
+		if values:
+			self.db_set(values, update_modified=False)
+
+	def publish_send_progress(self):
+		"""Publie l'avancement (événement realtime sms_campaign_progress) et le mémorise"""
+		progress = self.get_send_progress()
+		frappe.db.set_value(
+			"SMS Pricing Campaign", self.name, "send_progress", progress["progress"], update_modified=False
+		)
+		frappe.publish_realtime(
+			PROGRESS_EVENT, progress, doctype="SMS Pricing Campaign", docname=self.name, after_commit=True
+		)
+		
+		return progress
+
+	def update_sending_statistics(self, sent, failed, processed=0):
+		"""Incrémente les compteurs d'envoi en base (et les lignes traitées par l'envoi en arrière-plan)
+		
+		L'incrément est fait par la base: des envois concurrents (shards) ne s'écrasent pas.
+		"""
+		now = datetime.now()
+		
+		frappe.db.sql("""
+			UPDATE `tabSMS Pricing Campaign`
+			SET sms_sent_count = IFNULL(sms_sent_count, 0) + %(sent)s,
+				sms_failed_count = IFNULL(sms_failed_count, 0) + %(failed)s,
+				send_processed = IFNULL(send_processed, 0) + %(processed)s,
+				last_sent_time = %(now)s
+			WHERE name = %(name)s
+		""", {"sent": sent, "failed": failed, "processed": processed, "now": now, "name": self.name})
+		
+		self.sms_sent_count = (self.sms_sent_count or 0) + sent
+		self.sms_failed_count = (self.sms_failed_count or 0) + failed
+		self.last_sent_time = now
 
 	def get_preview_messages(self):
 		"""Génère un aperçu des messages pour quelques clients"""
@@ -319,8 +763,8 @@ class SMSPricingCampaign(Document):
 			# Prendre les 3 premiers éléments sélectionnés
 			selected_items = [item for item in self.pricing_items if item.selected_for_sending][:3]
 			
-			for item in selected_items:
-				message = self.format_sms_message(item)
+			for item, message, segments in self.render_sms_messages(selected_items):
+				encoding, units, segments = analyze(message)
 				previews.append({
 					"customer": item.customer_name or item.customer,
 					"mobile": item.customer_mobile,
@@ -328,7 +772,9 @@ class SMSPricingCampaign(Document):
 					"price": item.final_price,
 					"valuation": item.valuation_rate,
 					"margin": item.margin_amount_eur,
-					"message": message
+					"message": message,
+					"segments": segments,
+					"encoding": encoding
 				})
 			
 			return previews
@@ -378,11 +824,128 @@ class SMSPricingCampaign(Document):
 			return 0
 
 
+def write_item_statuses(items, batch_size=STATUS_WRITE_BATCH):
+	"""Écrit sms_sent / sms_status des lignes modifiées sans sauvegarder la campagne
+	
+	Les lignes sont regroupées par couple (sms_sent, sms_status): quelques
+	UPDATE ... WHERE name IN (...) par lot, soit un coût proportionnel aux lignes modifiées.
+	"""
+	groups = {}
+	for item in items:
+		if item.name:
+			groups.setdefault((cint(item.sms_sent), item.sms_status), []).append(item.name)
+	
+	for (sms_sent, sms_status), names in groups.items():
+		for start in range(0, len(names), batch_size):
+			frappe.db.sql("""
+				UPDATE `tabSMS Pricing Item`
+				SET sms_sent = %s, sms_status = %s
+				WHERE name IN %s
+			""", (sms_sent, sms_status, tuple(names[start:start + batch_size])))
+
+
+def get_shard_timeout(rows, shards):
+	"""Timeout RQ d'un shard: durée de ses envois au débit garanti de la voie marketing, plus une marge
+	
+	Les shards se partagent ce débit: un shard de `rows` lignes parmi `shards` ne peut pas aller plus vite.
+	"""
+	settings = frappe.get_single("OVH SMS Settings")
+	rate = cint(settings.rate_limit_per_minute) * settings.get_lane_rate_share(LANE_MARKETING)
+	if rate <= 0:
+		return SEND_JOB_TIMEOUT
+	
+	return SEND_JOB_TIMEOUT + int(max(0, rows) * 60 * max(1, shards) / rate)
+
+
+def get_send_batch_size():
+	"""Lignes envoyées entre deux commits: une vague de jobs OVH en vol (send_concurrency)"""
+	return cint(frappe.db.get_single_value("OVH SMS Settings", "send_concurrency")) or DEFAULT_CONCURRENCY
+
+
+def get_cost_per_segment():
+	"""Prix d'un segment SMS (OVH SMS Settings)"""
+	return flt(frappe.db.get_single_value("OVH SMS Settings", "cost_per_segment")) or DEFAULT_SEGMENT_COST
+
+
 # === MÉTHODES GLOBALES POUR L'API ===
 
+def run_campaign_send(campaign_name, shard=0, chunk_size=SEND_CHUNK_SIZE):
+	"""Job d'arrière-plan: envoie la plage de lignes d'un shard, lot par lot
+	
+	Chaque lot part par vagues de get_send_batch_size() lignes; les statuts de chaque vague et le
+	point de contrôle du shard sont validés (commit) dès le retour d'OVH: après un arrêt du worker,
+	seule la vague en vol peut être renvoyée. Les envois attendent le débit OVH sans échouer.
+	Les commandes pause/annulation sont lues entre deux lots.
+	Les shards partagent le limiteur de débit OVH (Redis); le dernier shard terminé finalise
+	les compteurs et le statut de la campagne.
+	"""
+	campaign = frappe.get_doc("SMS Pricing Campaign", campaign_name)
+	plan = campaign.get_shard_plan()
+	if not plan or shard >= len(plan["ranges"]):
+		return
+	
+	high = plan["ranges"][shard][1]
+	checkpoint = plan["checkpoints"][shard]
+	batch_size = get_send_batch_size()
+	
+	while True:
+		control = frappe.db.get_value("SMS Pricing Campaign", campaign_name, "send_job_status")
+		if control != SEND_JOB_RUNNING:
+			campaign.send_job_status = control
+			campaign.publish_send_progress()
+			frappe.db.commit()
+			return
+		
+		rows = campaign.get_next_chunk(checkpoint, high, chunk_size)
+		if not rows:
+			break
+		
+		# Lignes déjà envoyées, en file ou confiées au rejeu (SMS Dead Letter): seul le point de contrôle avance
+		pending = [row for row in rows if not row.sms_sent and row.sms_status != "En file"]
+		dead_lettered = get_dead_lettered("SMS Pricing Item", [row.name for row in pending])
+		sendable = {row.name for row in pending} - dead_lettered
+		
+		for start in range(0, len(rows), batch_size):
+			batch = rows[start:start + batch_size]
+			items = [row for row in batch if row.name in sendable]
+			try:
+				outcomes = campaign.send_items_grouped(items, wait=True)
+			except Exception as e:
+				frappe.log_error(f"Erreur envoi lot campagne {campaign_name}: {e}")
+				frappe.db.rollback()
+				# Le shard libère la barrière: sans cela l'envoi resterait "En cours"
+				campaign.fail_shard(shard)
+				campaign.publish_send_progress()
+				frappe.db.commit()
+				raise
+			
+			checkpoint = batch[-1].idx
+			campaign.record_chunk(items, outcomes, shard, checkpoint, len(batch))
+			frappe.db.commit()
+		
+		campaign.publish_send_progress()
+		frappe.db.commit()
+	
+	if campaign.complete_shard():
+		campaign.finish_background_send()
+		campaign.publish_send_progress()
+	
+	frappe.db.commit()
+
+def _set_send_job_status(campaign_name, status, allowed):
+	"""Change l'état de l'envoi en arrière-plan s'il est dans l'un des états `allowed`"""
+	campaign = frappe.get_doc("SMS Pricing Campaign", campaign_name)
+	campaign.check_permission("write")
+	
+	if campaign.send_job_status not in allowed:
+		return None
+	
+	campaign.db_set("send_job_status", status, update_modified=False)
+	return campaign
+
 @frappe.whitelist()
 def send_all_sms(campaign_name):
-	"""API pour envoyer tous les SMS d'une campagne"""
+	"""API pour envoyer tous les SMS d'une campagne (en arrière-plan)"""
 	try:
 		campaign = frappe.get_doc("SMS Pricing Campaign", campaign_name)
 		
@@ -392,12 +955,11 @@ def send_all_sms(campaign_name):
 				"message": "La campagne doit être soumise avant l'envoi"
 			}
 		
-		results = campaign.send_all_sms()
+		campaign.start_background_send()
 		
 		return {
 			"success": True,
-			"message": f"{results['sent']} SMS envoyés, {results['failed']} échecs",
-			"results": results
+			"message": "Envoi de la campagne lancé en arrière-plan"
 		}
 		
 	except Exception as e:
@@ -423,12 +985,11 @@ def send_selected_sms(campaign_name):
 				"message": "Aucun élément sélectionné pour l'envoi"
 			}
 		
-		results = campaign.send_all_sms()  # Envoie seulement les sélectionnés
+		campaign.start_background_send()  # Envoie seulement les sélectionnés
 		
 		return {
 			"success": True,
-			"message": f"{results['sent']} SMS envoyés sur {selected_count} sélectionnés",
-			"results": results
+			"message": f"Envoi de {selected_count} SMS sélectionnés lancé en arrière-plan"
 		}
 		
 	except Exception as e:
@@ -438,6 +999,40 @@ def send_selected_sms(campaign_name):
 			"message": f"Erreur: {str(e)}"
 		}
 
+@frappe.whitelist()
+def pause_campaign_send(campaign_name):
+	"""API pour suspendre l'envoi en cours (effectif à la fin du lot courant)"""
+	if not _set_send_job_status(campaign_name, SEND_JOB_PAUSED, (SEND_JOB_RUNNING,)):
+		return {"success": False, "message": "Aucun envoi en cours"}
+	
+	return {"success": True, "message": "Envoi suspendu après le lot en cours"}
+
+@frappe.whitelist()
+def resume_campaign_send(campaign_name):
+	"""API pour reprendre un envoi suspendu (ou interrompu par une erreur) à son point de contrôle"""
+	campaign = _set_send_job_status(campaign_name, SEND_JOB_RUNNING, (SEND_JOB_PAUSED, SEND_JOB_FAILED))
+	if not campaign:
+		return {"success": False, "message": "Aucun envoi suspendu"}
+	
+	campaign.start_background_send()
+	
+	return {"success": True, "message": "Envoi repris"}
+
+@frappe.whitelist()
+def cancel_campaign_send(campaign_name):
+	"""API pour annuler l'envoi (les SMS déjà partis restent envoyés)"""
+	if not _set_send_job_status(campaign_name, SEND_JOB_CANCELLED, (SEND_JOB_RUNNING, SEND_JOB_PAUSED)):
+		return {"success": False, "message": "Aucun envoi à annuler"}
+	
+	return {"success": True, "message": "Envoi annulé"}
+
+@frappe.whitelist()
+def get_send_progress(campaign_name):
+	"""API pour suivre l'avancement de l'envoi en arrière-plan"""
+	campaign = frappe.get_doc("SMS Pricing Campaign", campaign_name)
+	
+	return {"success": True, **campaign.get_send_progress()}
+
 @frappe.whitelist()
 def preview_messages(campaign_name):
 	"""API pour prévisualiser les messages SMS"""
@@ -623,6 +1218,22 @@ def calculate_campaign_roi(campaign_name):
 
 # Fonctions de validation pour l'installation
 
+def on_outbox_status(item_name, status, result):
+	"""Hook SMS Outbox: reporte le statut final d'un SMS sur sa ligne de campagne"""
+	item = frappe.db.get_value("SMS Pricing Item", item_name, ["parent", "sms_sent"], as_dict=True)
+	if not item or item.sms_sent:
+		return
+	
+	sent = status == STATUS_SENT
+	frappe.db.set_value("SMS Pricing Item", item_name, {"sms_sent": 1 if sent else 0, "sms_status": status})
+	
+	counter = "sms_sent_count" if sent else "sms_failed_count"
+	frappe.db.sql(f"""
+		UPDATE `tabSMS Pricing Campaign`
+		SET `{counter}` = IFNULL(`{counter}`, 0) + 1, last_sent_time = %s
+		WHERE name = %s
+	""", (datetime.now(), item.parent))
+
 def validate_campaign(doc, method):
 	"""Validation lors de la soumission d'une campagne"""
 	if not doc.pricing_items:
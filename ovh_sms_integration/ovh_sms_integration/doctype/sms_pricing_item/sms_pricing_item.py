@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 import frappe
 from frappe.model.document import Document
 from frappe import _
+from ovh_sms_integration.utils.phone_numbers import normalize as normalize_phone_number
 
 class SMSPricingItem(Document):
 	def validate(self):
@@ -20,21 +21,11 @@ class SMSPricingItem(Document):
 				self.customer_mobile = formatted_mobile
 
 	def format_phone_number(self, phone):
-		"""Formate un numéro de téléphone français"""
+		"""Formate un numéro de téléphone (E.164, sans rejeter les numéros invalides)"""
 		if not phone:
 			return phone
 		
-		import re
-		# Supprimer tous les caractères non numériques sauf le +
-		cleaned = re.sub(r'[^\d+]', '', str(phone))
-		
-		# Format français
-		if cleaned.startswith('0'):
-			cleaned = '+33' + cleaned[1:]
-		elif not cleaned.startswith('+'):
-			cleaned = '+33' + cleaned
-		
-		return cleaned
+		return normalize_phone_number(phone, strict=False)
 
 	def validate_pricing(self):
 		"""Valide la tarification"""
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Registre des rappels SMS envoyés (SMS Send Ledger)
+Un index unique sur (événement, destinataire, délai du rappel) garantit qu'un même
+rappel n'est mis en file qu'une fois, quel que soit le nombre de passages du planificateur.
+"""
+
+from __future__ import unicode_literals
+import frappe
+from frappe.model.document import Document
+from frappe.utils import add_to_date, now_datetime
+
+
+class SMSSendLedger(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_unique(
+		"SMS Send Ledger", ["event", "recipient", "reminder_offset"], constraint_name="unique_event_recipient_offset"
+	)
+	frappe.db.add_index("SMS Send Ledger", ["batch_id"])
+
+
+def reminder_key(event, mobile, hours_before):
+	"""Clé d'idempotence d'un rappel: (événement, numéro normalisé, délai en minutes)"""
+	from ovh_sms_integration.utils.sms_utils import validate_phone_number
+
+	try:
+		recipient = validate_phone_number(mobile) or str(mobile or "")
+	except ValueError:
+		recipient = str(mobile)
+
+	return (event, recipient, int(round(float(hours_before or 0) * 60)))
+
+
+def match_reminder_offset(starts_on, reminder_times, now=None):
+	"""Délai de rappel (heures) dont la fenêtre de ±30 min contient le début de l'événement"""
+	if not starts_on:
+		return None
+
+	now = now or now_datetime()
+	hours_until = (starts_on - now).total_seconds() / 3600.0
+	matches = [hours for hours in reminder_times if abs(hours_until - hours) <= 0.5]
+
+	# Fenêtres qui se chevauchent: la plus proche l'emporte
+	return min(matches, key=lambda hours: abs(hours_until - hours)) if matches else None
+
+
+def claim_reminders(keys):
+	"""Réserve des rappels de façon atomique; retourne l'ensemble des clés obtenues
+
+	Une requête indexée écarte les rappels déjà enregistrés, puis un INSERT IGNORE
+	réserve les autres sous un identifiant de lot: seules les lignes effectivement
+	insérées par ce lot (et non par un passage concurrent) sont retournées.
+	"""
+	keys = set(keys)
+	if not keys:
+		return set()
+
+	events = tuple({event for event, recipient, offset in keys})
+	existing = frappe.db.sql("""
+		SELECT event, recipient, reminder_offset
+		FROM `tabSMS Send Ledger`
+		WHERE event IN %s
+	""", (events,))
+	pending = keys - {tuple(row) for row in existing}
+
+	if not pending:
+		return set()
+
+	batch_id = frappe.generate_hash(length=12)
+	now = now_datetime()
+	user = frappe.session.user
+
+	frappe.db.bulk_insert(
+		"SMS Send Ledger",
+		["name", "creation", "modified", "owner", "modified_by", "docstatus", "event", "recipient",
+			"reminder_offset", "batch_id"],
+		[
+			(frappe.generate_hash(length=10), now, now, user, user, 0, event, recipient, offset, batch_id)
+			for event, recipient, offset in pending
+		],
+		ignore_duplicates=True
+	)
+
+	claimed = frappe.db.sql("""
+		SELECT event, recipient, reminder_offset
+		FROM `tabSMS Send Ledger`
+		WHERE batch_id = %s
+	""", batch_id)
+
+	return {tuple(row) for row in claimed}
+
+
+def release_reminders(keys):
+	"""Annule des réservations (rappels qui n'ont pas pu être mis en file)
+
+	Sans cela, la réservation validée bloquerait définitivement un rappel jamais envoyé.
+	"""
+	keys = tuple(set(keys))
+	if not keys:
+		return
+
+	frappe.db.sql("""
+		DELETE FROM `tabSMS Send Ledger`
+		WHERE (event, recipient, reminder_offset) IN %s
+	""", (keys,))
+
+
+def purge_ledger(days):
+	"""Supprime les entrées plus anciennes que `days` jours (événements passés)"""
+	frappe.db.sql("""
+		DELETE FROM `tabSMS Send Ledger`
+		WHERE creation < %s
+	""", add_to_date(now_datetime(), days=-days))
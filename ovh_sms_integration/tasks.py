@@ -4,6 +4,7 @@ import frappe
 from frappe import _
 from datetime import datetime, timedelta
 import json
+from ovh_sms_integration.ovh_sms_integration.doctype.sms_send_ledger.sms_send_ledger import purge_ledger
 
 def check_event_reminders_hourly():
 	"""Tâche horaire pour vérifier et envoyer les rappels d'événements"""
@@ -30,6 +31,30 @@ def check_event_reminders_hourly():
 	except Exception as e:
 		frappe.log_error(f"Erreur tâche horaire rappels: {e}")
 
+def probe_ovh_circuit():
+	"""Sonde périodique de l'API OVH quand le disjoncteur est ouvert"""
+	try:
+		from ovh_sms_integration.utils.circuit_breaker import STATE_HALF_OPEN, CircuitOpenError
+		
+		sms_settings = frappe.get_single('OVH SMS Settings')
+		if not sms_settings.enabled:
+			return
+		
+		# Rien à faire tant que le circuit est fermé ou en pause
+		breaker = sms_settings.get_circuit_breaker()
+		if breaker.get_state() != STATE_HALF_OPEN:
+			return
+		
+		try:
+			sms_settings.probe_ovh_api()
+			frappe.logger().info("Sonde OVH réussie: disjoncteur refermé")
+		except CircuitOpenError:
+			# Une sonde est déjà en cours dans un autre worker
+			pass
+		
+	except Exception as e:
+		frappe.logger().warning(f"Sonde OVH échouée: {e}")
+
 def reset_daily_counters():
 	"""Remet à zéro les compteurs journaliers"""
 	try:
@@ -71,6 +96,9 @@ def cleanup_old_reminder_logs():
 			AND (subject LIKE '%SMS%' OR subject LIKE '%rappel%')
 		""", thirty_days_ago)
 		
+		# Registre anti-doublons des rappels: les événements concernés sont passés
+		purge_ledger(30)
+		
 		frappe.db.commit()
 		frappe.logger().info("Nettoyage logs terminé")
 		
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import unittest
+from unittest.mock import patch
+
+from ovh_sms_integration.utils import circuit_breaker
+from ovh_sms_integration.utils.circuit_breaker import (
+	CircuitBreaker, CircuitOpenError, STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN
+)
+from ovh_sms_integration.utils.fake_cache import FakeCache
+
+
+@patch("ovh_sms_integration.utils.circuit_breaker.time")
+@patch("ovh_sms_integration.utils.circuit_breaker.frappe")
+class TestCircuitBreaker(unittest.TestCase):
+
+	def make_breaker(self, mock_frappe, mock_time):
+		mock_frappe.cache.return_value = FakeCache()
+		mock_time.time.return_value = 1000.0
+		mock_time.strftime.return_value = "2026-01-05 10:00:00"
+		return CircuitBreaker("sms-xx-1", failure_threshold=3, reset_timeout=60)
+
+	def test_opens_at_threshold(self, mock_frappe, mock_time):
+		"""Le circuit reste fermé sous le seuil puis s'ouvre et refuse les appels"""
+		breaker = self.make_breaker(mock_frappe, mock_time)
+
+		for i in range(2):
+			breaker.record_failure()
+		self.assertEqual(breaker.get_state(), STATE_CLOSED)
+		breaker.before_call()
+
+		breaker.record_failure()
+		self.assertEqual(breaker.get_state(), STATE_OPEN)
+		with self.assertRaises(CircuitOpenError):
+			breaker.before_call()
+
+	def test_success_resets_failure_count(self, mock_frappe, mock_time):
+		"""Seuls les échecs consécutifs comptent"""
+		breaker = self.make_breaker(mock_frappe, mock_time)
+
+		breaker.record_failure()
+		breaker.record_failure()
+		breaker.record_success()
+		breaker.record_failure()
+
+		self.assertEqual(breaker.get_state(), STATE_CLOSED)
+		self.assertEqual(breaker.get_status()["failures"], 1)
+
+	def test_half_open_allows_single_probe(self, mock_frappe, mock_time):
+		"""Après reset_timeout, une seule sonde passe; un succès referme le circuit"""
+		breaker = self.make_breaker(mock_frappe, mock_time)
+		for i in range(3):
+			breaker.record_failure()
+
+		mock_time.time.return_value = 1059.0
+		self.assertEqual(breaker.get_state(), STATE_OPEN)
+
+		mock_time.time.return_value = 1060.0
+		self.assertEqual(breaker.get_state(), STATE_HALF_OPEN)
+		breaker.before_call()
+		with self.assertRaises(CircuitOpenError):
+			breaker.before_call()
+
+		breaker.record_success()
+		self.assertEqual(breaker.get_state(), STATE_CLOSED)
+		breaker.before_call()
+
+	def test_failed_probe_reopens(self, mock_frappe, mock_time):
+		"""Une sonde en échec rouvre le circuit pour un nouveau reset_timeout"""
+		breaker = self.make_breaker(mock_frappe, mock_time)
+		for i in range(3):
+			breaker.record_failure()
+
+		mock_time.time.return_value = 1060.0
+		breaker.before_call()
+		breaker.record_failure("503")
+
+		self.assertEqual(breaker.get_state(), STATE_OPEN)
+		mock_time.time.return_value = 1120.0
+		self.assertEqual(breaker.get_state(), STATE_HALF_OPEN)
+		breaker.before_call()
+
+	def test_transitions_are_recorded(self, mock_frappe, mock_time):
+		"""Chaque changement d'état est historisé, le plus récent en premier"""
+		breaker = self.make_breaker(mock_frappe, mock_time)
+		for i in range(3):
+			breaker.record_failure()
+		mock_time.time.return_value = 1060.0
+		breaker.before_call()
+		breaker.record_success()
+
+		transitions = [(entry["from"], entry["to"]) for entry in breaker.get_transitions()]
+		self.assertEqual(transitions, [
+			(STATE_HALF_OPEN, STATE_CLOSED),
+			(STATE_OPEN, STATE_HALF_OPEN),
+			(STATE_CLOSED, STATE_OPEN)
+		])
+		self.assertEqual(breaker.get_transitions()[-1]["reason"], "3 échecs consécutifs")
+
+	def test_reset(self, mock_frappe, mock_time):
+		"""La réinitialisation manuelle referme le circuit et efface les échecs"""
+		breaker = self.make_breaker(mock_frappe, mock_time)
+		for i in range(3):
+			breaker.record_failure()
+
+		breaker.reset()
+
+		self.assertEqual(breaker.get_status()["state"], STATE_CLOSED)
+		self.assertEqual(breaker.get_status()["failures"], 0)
+
+	def test_default_settings(self, mock_frappe, mock_time):
+		"""Seuil et délai vides: valeurs par défaut"""
+		breaker = circuit_breaker.get_circuit_breaker("sms-xx-1", None, 0)
+
+		self.assertEqual(breaker.failure_threshold, circuit_breaker.DEFAULT_FAILURE_THRESHOLD)
+		self.assertEqual(breaker.reset_timeout, circuit_breaker.DEFAULT_RESET_TIMEOUT)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import unittest
+from unittest.mock import patch
+
+import requests
+
+from ovh_sms_integration.utils.fake_ovh_server import Latency, start_server
+from ovh_sms_integration.utils.ovh_client import OVHClient, OVHCredentials, RetryPolicy
+
+
+@patch('ovh_sms_integration.utils.ovh_client.frappe')
+class TestFakeOVHServer(unittest.TestCase):
+
+	def setUp(self):
+		self.server, self.endpoint = start_server(verify_signature=True)
+		self.client = OVHClient(self.endpoint, pool_size=2)
+		self.credentials = OVHCredentials("fake_app_key", "fake_app_secret", "fake_consumer_key")
+
+	def tearDown(self):
+		self.client.close()
+		self.server.shutdown()
+		self.server.server_close()
+
+	def test_signed_job_creation(self, mock_frappe):
+		"""Un job correctement signé est accepté, les numéros invalides sont signalés"""
+		job = self.client.request("POST", "/sms/sms-fake-1/jobs", self.credentials, data={
+			"message": "Bonjour",
+			"receivers": ["+33612345678", "abc"],
+			"sender": "ERPNext"
+		})
+
+		self.assertEqual(job["validReceivers"], ["+33612345678"])
+		self.assertEqual(job["invalidReceivers"], ["abc"])
+		self.assertEqual(len(job["ids"]), 1)
+		self.assertEqual(self.server.state.stats["sms"], 1)
+
+	def test_bad_signature_rejected(self, mock_frappe):
+		"""Une signature calculée avec un mauvais secret est refusée"""
+		wrong = OVHCredentials("fake_app_key", "wrong_secret", "fake_consumer_key")
+
+		with self.assertRaises(requests.exceptions.HTTPError) as context:
+			self.client.request("GET", "/me", wrong)
+
+		self.assertEqual(context.exception.response.status_code, 400)
+
+	def test_clock_drift_resynchronized(self, mock_frappe):
+		"""Une horloge serveur décalée est rattrapée via /auth/time"""
+		self.server.state.clock_offset = 600
+		self.client.set_time_delta(0)
+
+		self.assertEqual(self.client.request("GET", "/me", self.credentials)["nichandle"], "fk12345-ovh")
+		self.assertGreaterEqual(self.client.get_time_delta(), 599)
+
+	def test_throttling_returns_retry_after(self, mock_frappe):
+		"""Au-delà du débit configuré, le serveur répond 429 avec Retry-After"""
+		self.server.state.rate_limit = 1
+		self.server.state._tokens = 0
+
+		with self.assertRaises(requests.exceptions.HTTPError) as context:
+			self.client.request("GET", "/sms", self.credentials, retry_policy=RetryPolicy(max_retries=0))
+
+		self.assertEqual(context.exception.response.status_code, 429)
+		self.assertEqual(context.exception.response.headers["Retry-After"], "1")
+
+	def test_latency_distributions(self, mock_frappe):
+		"""Les latences tirées sont positives et dans l'ordre de grandeur demandé"""
+		self.assertEqual(Latency("fixed:50").sample(), 0.05)
+		for _ in range(50):
+			self.assertTrue(0.02 <= Latency("uniform:20,80").sample() <= 0.08)
+			self.assertGreaterEqual(Latency("normal:5,50").sample(), 0)
+
+		with self.assertRaises(ValueError):
+			Latency("pareto:1")
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import hashlib
+import threading
+import time
+import unittest
+from unittest.mock import patch, AsyncMock, MagicMock
+
+import requests
+
+from ovh_sms_integration.utils.ovh_async import AsyncOVHSender, run_sync
+from ovh_sms_integration.utils.rate_limiter import RateLimitExceeded
+from ovh_sms_integration.utils.ovh_client import (
+	OVHClient, OVHCredentials, RetryPolicy, classify_error, is_clock_error, parse_retry_after,
+	get_cached_credentials, clear_cached_credentials
+)
+
+
+def make_response(status_code, content=b'{}', headers=None):
+	"""Construit une réponse requests sans appel réseau"""
+	response = requests.Response()
+	response.status_code = status_code
+	response._content = content
+	response.headers.update(headers or {})
+	return response
+
+
+class TestOVHClient(unittest.TestCase):
+
+	def setUp(self):
+		self.credentials = OVHCredentials("app_key", "app_secret", "consumer_key")
+		self.client = OVHClient("https://ovh.test/1.0", pool_size=2)
+		# Pas de synchronisation réseau de l'horloge pendant les tests
+		self.client.set_time_delta(0)
+
+	def tearDown(self):
+		self.client.close()
+
+	def test_signature_format(self):
+		"""La signature suit le format OVH $1$ + SHA1"""
+		url = "https://ovh.test/1.0/sms"
+		expected = "$1$" + hashlib.sha1(
+			"app_secret+consumer_key+GET+https://ovh.test/1.0/sms++1700000000".encode('utf-8')
+		).hexdigest()
+
+		self.assertEqual(self.credentials.sign("GET", url, "", "1700000000"), expected)
+
+	def test_build_url(self):
+		"""Les chemins sont concaténés à l'endpoint sans double slash"""
+		self.assertEqual(self.client.build_url("/sms/svc/jobs"), "https://ovh.test/1.0/sms/svc/jobs")
+		self.assertEqual(self.client.build_url("me"), "https://ovh.test/1.0/me")
+
+	def test_classify_error(self):
+		"""Classification rejouable / non rejouable selon la méthode"""
+		server_error = requests.exceptions.HTTPError(response=make_response(500))
+		self.assertEqual(classify_error(server_error, "GET"), ("server_error", 500, True))
+		self.assertEqual(classify_error(server_error, "POST"), ("server_error", 500, False))
+
+		throttled = requests.exceptions.HTTPError(response=make_response(429))
+		self.assertEqual(classify_error(throttled, "POST"), ("rate_limited", 429, True))
+
+		forbidden = requests.exceptions.HTTPError(response=make_response(403))
+		self.assertEqual(classify_error(forbidden, "GET"), ("client_error", 403, False))
+
+		self.assertTrue(classify_error(requests.exceptions.ConnectTimeout(), "POST")[2])
+		self.assertFalse(classify_error(requests.exceptions.ReadTimeout(), "POST")[2])
+		self.assertTrue(classify_error(requests.exceptions.ReadTimeout(), "GET")[2])
+
+	def test_retry_after_header(self):
+		"""L'en-tête Retry-After prime sur le backoff calculé"""
+		response = make_response(429, headers={"Retry-After": "7"})
+		self.assertEqual(parse_retry_after(response), 7.0)
+		self.assertEqual(RetryPolicy().compute_delay(0, response), 7.0)
+		self.assertIsNone(parse_retry_after(make_response(429)))
+
+	def test_backoff_is_capped(self):
+		"""Le backoff exponentiel reste sous le plafond"""
+		policy = RetryPolicy(base_delay=1, max_delay=5)
+		for attempt in range(10):
+			self.assertLessEqual(policy.compute_delay(attempt), 5)
+
+	@patch('ovh_sms_integration.utils.ovh_client.frappe')
+	@patch('ovh_sms_integration.utils.ovh_client.time.sleep')
+	def test_retry_resigns_each_attempt(self, mock_sleep, mock_frappe):
+		"""Chaque tentative est signée à nouveau avec un horodatage frais"""
+		self.client.session.request = MagicMock(side_effect=[
+			make_response(503, headers={"Retry-After": "0"}),
+			make_response(200, content=b'{"ids": [1]}')
+		])
+
+		with patch('ovh_sms_integration.utils.ovh_client.time.time', side_effect=[1000, 1005]):
+			result = self.client.request(
+				"POST", "/sms/svc/jobs", self.credentials, data={"message": "x"},
+				retry_policy=RetryPolicy(max_retries=2)
+			)
+
+		self.assertEqual(result, {"ids": [1]})
+		self.assertEqual(self.client.session.request.call_count, 2)
+
+		first, second = [c.kwargs["headers"] for c in self.client.session.request.call_args_list]
+		self.assertEqual((first["X-Ovh-Timestamp"], second["X-Ovh-Timestamp"]), ("1000", "1005"))
+		self.assertNotEqual(first["X-Ovh-Signature"], second["X-Ovh-Signature"])
+
+	@patch('ovh_sms_integration.utils.ovh_client.frappe')
+	@patch('ovh_sms_integration.utils.ovh_client.time.sleep')
+	def test_no_retry_on_client_error(self, mock_sleep, mock_frappe):
+		"""Une erreur 4xx n'est jamais rejouée"""
+		self.client.session.request = MagicMock(return_value=make_response(400))
+
+		with self.assertRaises(requests.exceptions.HTTPError):
+			self.client.request("GET", "/me", self.credentials, retry_policy=RetryPolicy(max_retries=3))
+
+		self.assertEqual(self.client.session.request.call_count, 1)
+		mock_sleep.assert_not_called()
+
+	def test_time_delta_applied_to_timestamp(self):
+		"""L'horodatage signé est décalé de l'écart avec l'horloge OVH"""
+		self.client.set_time_delta(-42)
+
+		with patch('ovh_sms_integration.utils.ovh_client.time.time', return_value=1000):
+			self.assertEqual(self.client.get_timestamp(), "958")
+
+	@patch('ovh_sms_integration.utils.ovh_client.frappe')
+	@patch('ovh_sms_integration.utils.ovh_client.time.sleep')
+	def test_clock_error_triggers_resync(self, mock_sleep, mock_frappe):
+		"""Un horodatage rejeté provoque une resynchronisation et une seule nouvelle tentative"""
+		out_of_time = make_response(400, content=b'{"message": "Query out of time"}')
+		self.assertTrue(is_clock_error(requests.exceptions.HTTPError(response=out_of_time)))
+		self.assertFalse(is_clock_error(requests.exceptions.HTTPError(response=make_response(400))))
+
+		self.client.session.request = MagicMock(side_effect=[out_of_time, make_response(200, content=b'{"ok": 1}')])
+		self.client.session.get = MagicMock(return_value=make_response(200, content=b'1300'))
+
+		with patch('ovh_sms_integration.utils.ovh_client.time.time', return_value=1000):
+			result = self.client.request("POST", "/sms/svc/jobs", self.credentials, data={"message": "x"})
+
+		self.assertEqual(result, {"ok": 1})
+		self.client.session.get.assert_called_once()
+		second = self.client.session.request.call_args_list[1].kwargs["headers"]
+		self.assertEqual(second["X-Ovh-Timestamp"], "1300")
+		mock_sleep.assert_not_called()
+
+	def test_credentials_loaded_once_per_version(self):
+		"""Les identifiants ne sont déchiffrés qu'au changement de version des paramètres"""
+		clear_cached_credentials()
+		loader = MagicMock(return_value=self.credentials)
+
+		for _ in range(3):
+			self.assertIs(get_cached_credentials(("site", "v1"), loader), self.credentials)
+		self.assertEqual(loader.call_count, 1)
+
+		get_cached_credentials(("site", "v2"), loader)
+		self.assertEqual(loader.call_count, 2)
+		clear_cached_credentials()
+
+	def test_send_many_keeps_order_and_bounds_concurrency(self):
+		"""send_many respecte l'ordre d'entrée et la limite de requêtes en vol"""
+		lock = threading.Lock()
+		state = {"in_flight": 0, "peak": 0}
+
+		def fake_request(method, url, data=None, headers=None, timeout=None):
+			with lock:
+				state["in_flight"] += 1
+				state["peak"] = max(state["peak"], state["in_flight"])
+			# Réponses volontairement plus lentes pour les premiers appels
+			index = int(url.rsplit("/", 1)[-1])
+			time.sleep(0.01 * (6 - index))
+			with lock:
+				state["in_flight"] -= 1
+			if index == 3:
+				return make_response(400)
+			return make_response(200, content=('{"n": %d}' % index).encode())
+
+		self.client.session.request = MagicMock(side_effect=fake_request)
+		sender = AsyncOVHSender(self.client, self.credentials, concurrency=2)
+
+		results = run_sync(sender.send_many([("GET", f"/item/{i}", None) for i in range(6)]))
+
+		self.assertEqual([r if isinstance(r, dict) else None for r in results],
+			[{"n": 0}, {"n": 1}, {"n": 2}, None, {"n": 4}, {"n": 5}])
+		self.assertIsInstance(results[3], requests.exceptions.HTTPError)
+		self.assertLessEqual(state["peak"], 2)
+
+	def test_async_sender_rate_limit_wait(self):
+		"""Jobs d'arrière-plan: attente du débit sans limite; sinon refus au-delà de rate_limit_timeout"""
+		self.client.session.request = MagicMock(return_value=make_response(200, content=b'{"ids": [1]}'))
+		limiter = MagicMock()
+		limiter.name = "sms-xx-1:marketing"
+		limiter.acquire_async = AsyncMock(return_value=True)
+
+		sender = AsyncOVHSender(self.client, self.credentials, rate_limiter=limiter, rate_limit_timeout=5,
+			rate_limit_wait=True)
+		run_sync(sender.send_many([("POST", "/sms/sms-xx-1/jobs", {})]))
+		limiter.acquire_async.assert_awaited_once_with(blocking=True, timeout=None)
+
+		limiter.acquire_async = AsyncMock(return_value=False)
+		sender = AsyncOVHSender(self.client, self.credentials, rate_limiter=limiter, rate_limit_timeout=5)
+		results = run_sync(sender.send_many([("POST", "/sms/sms-xx-1/jobs", {})]))
+		limiter.acquire_async.assert_awaited_once_with(blocking=True, timeout=5)
+		self.assertIsInstance(results[0], RateLimitExceeded)
+
+
+if __name__ == '__main__':
+	unittest.main()
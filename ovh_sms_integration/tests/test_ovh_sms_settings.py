@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import unittest
+from unittest.mock import patch, MagicMock
+
+from ovh_sms_integration.ovh_sms_integration.doctype.ovh_sms_settings import ovh_sms_settings
+from ovh_sms_integration.ovh_sms_integration.doctype.ovh_sms_settings.ovh_sms_settings import OVHSMSSettings
+from ovh_sms_integration.utils.priority_lanes import LANE_MARKETING, LANE_TRANSACTIONAL
+
+MODULE = "ovh_sms_integration.ovh_sms_integration.doctype.ovh_sms_settings.ovh_sms_settings"
+
+
+def make_settings(**values):
+	"""Paramètres OVH SMS sans base de données"""
+	settings = OVHSMSSettings.__new__(OVHSMSSettings)
+	settings.__dict__.update({
+		"rate_limit_per_minute": 100, "rate_limit_burst": 0, "rate_limit_timeout": 60, "marketing_rate_share": None
+	})
+	settings.__dict__.update(values)
+	return settings
+
+
+class TestRateShares(unittest.TestCase):
+
+	def test_clamp_rate_share(self):
+		"""Part marketing bornée à [5 %, 95 %], valeur vide ramenée au minimum"""
+		self.assertEqual(ovh_sms_settings.clamp_rate_share(30), 30)
+		self.assertEqual(ovh_sms_settings.clamp_rate_share(0), 5)
+		self.assertEqual(ovh_sms_settings.clamp_rate_share(100), 95)
+		self.assertEqual(ovh_sms_settings.clamp_rate_share("120"), 95)
+		self.assertEqual(ovh_sms_settings.clamp_rate_share(None), 5)
+
+	def test_lane_rate_share(self):
+		"""Sans réglage: parts par défaut des voies; avec réglage: les deux parts somment à 1"""
+		self.assertEqual(make_settings().get_lane_rate_share(LANE_MARKETING), 0.3)
+		self.assertEqual(make_settings().get_lane_rate_share(), 0.7)
+
+		settings = make_settings(marketing_rate_share=99)
+		self.assertAlmostEqual(settings.get_lane_rate_share(LANE_MARKETING), 0.95)
+		self.assertAlmostEqual(settings.get_lane_rate_share(LANE_TRANSACTIONAL), 0.05)
+		self.assertAlmostEqual(settings.get_lane_rate_share("Inconnue"), 0.05)
+
+
+@patch(MODULE + ".get_rate_limiter")
+class TestLaneRateLimiter(unittest.TestCase):
+
+	def test_lane_bucket_borrows_from_other_lane(self, mock_limiter):
+		"""Seau de la voie à sa part du débit et de la rafale, prêteur: le seau de l'autre voie"""
+		mock_limiter.side_effect = lambda name, rate, burst, lenders=None: (name, rate, burst, lenders)
+
+		bucket = make_settings(rate_limit_burst=20).get_rate_limiter("sms-xx-1", LANE_MARKETING)
+
+		self.assertEqual(bucket, (
+			"sms-xx-1:marketing", 30, 6, [("sms-xx-1:transactional", 70, 14, None)]
+		))
+
+	def test_unknown_lane_uses_default_lane(self, mock_limiter):
+		"""Voie inconnue: seau transactionnel, la voie marketing prête ses jetons"""
+		mock_limiter.side_effect = lambda name, rate, burst, lenders=None: (name, rate, burst, lenders)
+
+		name, rate, burst, lenders = make_settings().get_rate_limiter("sms-xx-1", "Inconnue")
+
+		self.assertEqual((name, rate, burst), ("sms-xx-1:transactional", 70, 70))
+		self.assertEqual([lender[0] for lender in lenders], ["sms-xx-1:marketing"])
+
+	def test_unlimited_rate(self, mock_limiter):
+		"""Débit nul: aucun limiteur, l'envoi n'attend pas"""
+		settings = make_settings(rate_limit_per_minute=0)
+
+		self.assertIsNone(settings.get_rate_limiter("sms-xx-1", LANE_MARKETING))
+		settings.acquire_send_slot("sms-xx-1", LANE_MARKETING)
+		mock_limiter.assert_not_called()
+
+	def test_acquire_send_slot_timeout(self, mock_limiter):
+		"""Attente bornée par rate_limit_timeout; wait=True: attente sans limite"""
+		bucket = MagicMock()
+		bucket.acquire.return_value = False
+		settings = make_settings()
+
+		with patch.object(settings, "get_rate_limiter", return_value=bucket):
+			with self.assertRaises(ovh_sms_settings.RateLimitExceeded):
+				settings.acquire_send_slot("sms-xx-1", LANE_MARKETING)
+			bucket.acquire.assert_called_with(blocking=True, timeout=60)
+
+			settings.acquire_send_slot("sms-xx-1", LANE_MARKETING, wait=True)
+			bucket.acquire.assert_called_with(blocking=True, timeout=None)
+
+
+class TestJobIds(unittest.TestCase):
+
+	def test_ids_follow_valid_receivers(self):
+		"""Chaque id OVH revient à son destinataire, même si OVH renvoie le numéro en 0033..."""
+		results = ovh_sms_settings.map_job_ids(
+			["+33611111111", "+33622222222"],
+			{"ids": [11, 22], "validReceivers": ["0033622222222", "0033611111111"], "invalidReceivers": []}
+		)
+
+		self.assertEqual(results["+33611111111"]["id"], 22)
+		self.assertEqual(results["+33622222222"]["id"], 11)
+		self.assertTrue(all(result["success"] for result in results.values()))
+
+	def test_invalid_receivers_without_valid_list(self):
+		"""Sans validReceivers: ids dans l'ordre des destinataires acceptés, numéros refusés en échec"""
+		results = ovh_sms_settings.map_job_ids(
+			["+33611111111", "+33622222222", "+33633333333"],
+			{"ids": [11, 33], "invalidReceivers": ["0033622222222"]}
+		)
+
+		self.assertEqual(results["+33611111111"]["id"], 11)
+		self.assertEqual(results["+33633333333"]["id"], 33)
+		self.assertFalse(results["+33622222222"]["success"])
+		self.assertIn("refusé", results["+33622222222"]["message"])
+
+	def test_missing_ids(self):
+		"""Moins d'ids que de destinataires acceptés: envoi réussi sans identifiant"""
+		results = ovh_sms_settings.map_job_ids(["+33611111111", "+33622222222"], {"ids": [11]})
+
+		self.assertEqual([results[r].get("id") for r in ("+33611111111", "+33622222222")], [11, None])
+		self.assertTrue(results["+33622222222"]["success"])
+
+
+@patch(MODULE + ".frappe")
+class TestGroupedSend(unittest.TestCase):
+
+	def setUp(self):
+		self.settings = make_settings()
+		for name, value in (("get_service_name", "sms-xx-1"), ("resolve_sender", "ACME")):
+			patcher = patch.object(self.settings, name, return_value=value)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	def test_send_bulk_maps_ids_per_receiver(self, mock_frappe):
+		"""send_bulk: destinataires dédoublonnés, id OVH et numéros refusés par destinataire"""
+		job = {"ids": [11, 33], "validReceivers": ["+33611111111", "+33633333333"], "invalidReceivers": ["+33622222222"]}
+
+		with patch.object(self.settings, "_post_jobs", return_value=[job]) as post_jobs:
+			result = self.settings.send_bulk("Bonjour", ["+33611111111", "+33622222222", "+33611111111", "+33633333333"])
+
+		self.assertEqual(post_jobs.call_args.args[:3], (
+			"sms-xx-1", [("Bonjour", ["+33611111111", "+33622222222", "+33633333333"])], "ACME"
+		))
+		self.assertEqual((result["sent"], result["failed"], result["sender_used"]), (2, 1, "ACME"))
+		self.assertEqual({r: outcome.get("id") for r, outcome in result["results"].items()},
+			{"+33611111111": 11, "+33622222222": None, "+33633333333": 33})
+		self.assertFalse(result["results"]["+33622222222"]["success"])
+
+	def test_send_grouped_results_in_input_order(self, mock_frappe):
+		"""send_grouped: un job par texte (découpé par MAX_RECEIVERS_PER_JOB), résultats dans l'ordre d'entrée"""
+		jobs = [
+			{"ids": [1], "validReceivers": ["0033611111111"]},
+			{"ids": [2], "validReceivers": ["0033622222222"]},
+			{"ids": [], "validReceivers": [], "invalidReceivers": ["0033633333333"]}
+		]
+		messages = [
+			("+33611111111", "A"), ("+33633333333", "B"), (None, "A"), ("+33622222222", "A"), ("+33611111111", "A")
+		]
+
+		with patch(MODULE + ".MAX_RECEIVERS_PER_JOB", 1), \
+				patch.object(self.settings, "_post_jobs", return_value=jobs) as post_jobs:
+			outcomes = self.settings.send_grouped(messages, lane=LANE_MARKETING, wait=True)
+
+		self.assertEqual(post_jobs.call_args.args, (
+			"sms-xx-1", [("A", ["+33611111111"]), ("A", ["+33622222222"]), ("B", ["+33633333333"])], "ACME",
+			LANE_MARKETING, True
+		))
+		self.assertEqual([outcome.get("id") for outcome in outcomes], [1, None, None, 2, 1])
+		self.assertEqual([outcome["success"] for outcome in outcomes], [True, False, False, True, True])
+		self.assertEqual(outcomes[2]["message"], "Numéro mobile manquant")
+
+	def test_failed_job_fails_its_receivers_only(self, mock_frappe):
+		"""Job en échec (débit dépassé): ses destinataires sont en échec rejouable, les autres jobs réussissent"""
+		jobs = [{"ids": [1], "validReceivers": ["+33611111111"]}, ovh_sms_settings.RateLimitExceeded("Limite")]
+
+		with patch.object(self.settings, "_post_jobs", return_value=jobs):
+			outcomes = self.settings.send_grouped([("+33611111111", "A"), ("+33622222222", "B")])
+
+		self.assertEqual(outcomes[0]["id"], 1)
+		self.assertEqual(
+			(outcomes[1]["success"], outcomes[1]["retryable"], outcomes[1]["error_class"]),
+			(False, True, "rate_limit_exceeded")
+		)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import unittest
+
+from ovh_sms_integration.utils import phone_numbers
+
+
+class TestPhoneNumbers(unittest.TestCase):
+
+	def setUp(self):
+		phone_numbers.clear_cache()
+
+	def test_normalize_national_numbers(self):
+		"""Numéros nationaux convertis avec l'indicatif du plan du pays"""
+		self.assertEqual(phone_numbers.normalize("0123456789"), "+33123456789")
+		self.assertEqual(phone_numbers.normalize("06 12 34 56 78"), "+33612345678")
+		self.assertEqual(phone_numbers.normalize("+33 6.12.34.56.78"), "+33612345678")
+		self.assertEqual(phone_numbers.normalize("0470 12 34 56", country="BE"), "+32470123456")
+		self.assertIsNone(phone_numbers.normalize(""))
+
+		with self.assertRaises(ValueError):
+			phone_numbers.normalize("invalid")
+		self.assertEqual(phone_numbers.normalize("invalid", strict=False), "+33")
+
+	def test_international_prefix(self):
+		"""Le préfixe international 00 vaut "+": le numéro garde son propre indicatif"""
+		self.assertEqual(phone_numbers.normalize("0033612345678"), "+33612345678")
+		self.assertEqual(phone_numbers.normalize("00 32 470 12 34 56"), "+32470123456")
+		self.assertEqual(phone_numbers.normalize("0032470123456", country="CH"), "+32470123456")
+		self.assertEqual(phone_numbers.get_country("0032470123456"), "BE")
+		self.assertTrue(phone_numbers.is_mobile("0032470123456"))
+
+	def test_trunk_prefix_in_parentheses(self):
+		"""Le préfixe national (0) écrit après l'indicatif n'est pas composé"""
+		self.assertEqual(phone_numbers.normalize("+33 (0)6 12 34 56 78"), "+33612345678")
+		self.assertEqual(phone_numbers.normalize("+32 (0) 470 12 34 56"), "+32470123456")
+		self.assertEqual(phone_numbers.normalize("(0)6 12 34 56 78"), "+33612345678")
+
+	def test_normalize_many_and_cache(self):
+		"""Les doublons d'un lot et des lots suivants ne sont convertis qu'une fois"""
+		numbers = phone_numbers.normalize_many(["0612345678", None, "0612345678", "12"], strict=True)
+		self.assertEqual(numbers, ["+33612345678", None, "+33612345678", None])
+
+		phone_numbers.normalize_many(["0612345678"])
+		stats = phone_numbers.get_cache_statistics()
+		self.assertEqual(stats["misses"], 2)
+		self.assertEqual(stats["hits"], 1)
+
+	def test_mobile_prefixes(self):
+		"""Les préfixes mobiles viennent du plan du pays de l'indicatif"""
+		self.assertTrue(phone_numbers.is_mobile("0612345678"))
+		self.assertTrue(phone_numbers.is_mobile("+352621123456"))
+		self.assertTrue(phone_numbers.is_mobile("+262692123456"))
+		self.assertFalse(phone_numbers.is_mobile("0123456789"))
+		self.assertFalse(phone_numbers.is_mobile("+4915112345678"))
+		self.assertEqual(phone_numbers.get_country("+352621123456"), "LU")
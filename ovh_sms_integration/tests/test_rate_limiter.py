@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import asyncio
+import unittest
+from unittest.mock import patch, AsyncMock, MagicMock
+
+from ovh_sms_integration.utils import rate_limiter
+from ovh_sms_integration.utils.fake_cache import FakeCache
+
+
+@patch("ovh_sms_integration.utils.rate_limiter.time")
+@patch("ovh_sms_integration.utils.rate_limiter.frappe")
+class TestTokenBucket(unittest.TestCase):
+
+	def setUp(self):
+		self.script = MagicMock(return_value=[1, "0"])
+		patcher = patch("ovh_sms_integration.utils.rate_limiter._get_script", return_value=self.script)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def make_bucket(self, mock_frappe, rate_per_minute=120, burst=None):
+		mock_frappe.cache.return_value = FakeCache()
+		return rate_limiter.TokenBucket("sms-xx-1", rate_per_minute, burst)
+
+	def test_try_acquire_arguments(self, mock_frappe, mock_time):
+		"""Le script Lua reçoit la clé du seau, la capacité, le débit par seconde et la demande"""
+		bucket = self.make_bucket(mock_frappe, 120, burst=10)
+		self.script.return_value = [0, "0.25"]
+
+		self.assertEqual(bucket.try_acquire(3), (False, 0.25))
+		self.script.assert_called_once_with(keys=["site|ovh_sms:rate_limit:sms-xx-1"], args=[10, 2.0, 3])
+
+	def test_capacity_defaults_to_rate(self, mock_frappe, mock_time):
+		"""Sans burst, la capacité vaut le débit par minute"""
+		self.assertEqual(self.make_bucket(mock_frappe, 30).capacity, 30)
+
+	def test_request_above_capacity(self, mock_frappe, mock_time):
+		"""Demander plus de jetons que la capacité lève ValueError sans appeler Redis"""
+		bucket = self.make_bucket(mock_frappe, 60, burst=5)
+
+		with self.assertRaises(ValueError):
+			bucket.try_acquire(6)
+		self.script.assert_not_called()
+
+	def test_acquire_waits_then_succeeds(self, mock_frappe, mock_time):
+		"""Refus: attente de la durée estimée (au plus MAX_SLEEP) puis nouvelle tentative"""
+		bucket = self.make_bucket(mock_frappe)
+		self.script.side_effect = [[0, "0.4"], [0, "3"], [1, "0"]]
+		mock_time.monotonic.side_effect = [100.0, 100.4, 101.4]
+
+		self.assertTrue(bucket.acquire())
+		self.assertEqual([c.args[0] for c in mock_time.sleep.call_args_list], [0.4, rate_limiter.MAX_SLEEP])
+
+	def test_acquire_timeout(self, mock_frappe, mock_time):
+		"""Attente estimée au-delà du timeout: refus immédiat"""
+		bucket = self.make_bucket(mock_frappe)
+		self.script.return_value = [0, "5"]
+		mock_time.monotonic.return_value = 100.0
+
+		self.assertFalse(bucket.acquire(timeout=2))
+		mock_time.sleep.assert_not_called()
+
+	def test_acquire_non_blocking(self, mock_frappe, mock_time):
+		"""Mode non bloquant: une seule tentative"""
+		bucket = self.make_bucket(mock_frappe)
+		self.script.return_value = [0, "0.1"]
+		mock_time.monotonic.return_value = 100.0
+
+		self.assertFalse(bucket.acquire(blocking=False))
+		self.assertEqual(self.script.call_count, 1)
+
+	def test_acquire_async_waits_without_blocking(self, mock_frappe, mock_time):
+		"""Version asyncio: l'attente passe par asyncio.sleep, jamais par time.sleep"""
+		bucket = self.make_bucket(mock_frappe)
+		self.script.side_effect = [[0, "0.2"], [1, "0"]]
+		mock_time.monotonic.side_effect = [100.0, 100.2]
+
+		with patch("ovh_sms_integration.utils.rate_limiter.asyncio.sleep", new_callable=AsyncMock) as mock_sleep:
+			self.assertTrue(asyncio.run(bucket.acquire_async()))
+
+		mock_sleep.assert_awaited_once_with(0.2)
+		mock_time.sleep.assert_not_called()
+
+	def test_empty_bucket_borrows_unused_tokens(self, mock_frappe, mock_time):
+		"""Seau vide: jeton emprunté au seau prêteur s'il en a; sinon refus avec l'attente du seau propre"""
+		mock_frappe.cache.return_value = FakeCache()
+		lender = rate_limiter.TokenBucket("sms-xx-1:transactional", 70)
+		bucket = rate_limiter.TokenBucket("sms-xx-1:marketing", 30, lenders=[lender, None])
+		self.script.side_effect = [[0, "2"], [1, "0"], [0, "2"], [0, "0.5"]]
+
+		self.assertEqual(bucket.try_acquire(), (True, 0.0))
+		self.assertEqual(bucket.try_acquire(), (False, 2.0))
+		self.assertEqual(
+			[c.kwargs["keys"] for c in self.script.call_args_list],
+			[["site|ovh_sms:rate_limit:sms-xx-1:marketing"], ["site|ovh_sms:rate_limit:sms-xx-1:transactional"]] * 2
+		)
+
+	def test_unlimited_rate(self, mock_frappe, mock_time):
+		"""Débit nul ou négatif: pas de limiteur"""
+		self.assertIsNone(rate_limiter.get_rate_limiter("sms-xx-1", 0))
+		self.assertIsNone(rate_limiter.get_rate_limiter("sms-xx-1", -1))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import unittest
+from unittest.mock import patch, MagicMock
+
+from ovh_sms_integration.utils import ovh_cache
+from ovh_sms_integration.utils.fake_cache import FakeCache
+
+
+@patch("ovh_sms_integration.utils.ovh_cache.frappe")
+class TestOVHCache(unittest.TestCase):
+
+	def setUp(self):
+		self.cache = FakeCache()
+
+	def test_miss_then_hit(self, mock_frappe):
+		"""Le loader n'est appelé qu'au premier accès, les suivants sont servis par le cache"""
+		mock_frappe.cache.return_value = self.cache
+		loader = MagicMock(return_value=["ACME", "SHOP"])
+
+		self.assertEqual(ovh_cache.get_or_load("senders:sms-xx-1", loader), ["ACME", "SHOP"])
+		self.assertEqual(ovh_cache.get_or_load("senders:sms-xx-1", loader), ["ACME", "SHOP"])
+
+		loader.assert_called_once_with()
+		stats = ovh_cache.get_cache_stats(("senders",))["senders"]
+		self.assertEqual(stats, {"hits": 1, "misses": 1, "hit_rate": 50.0})
+
+	def test_none_is_not_cached(self, mock_frappe):
+		"""Une absence de valeur n'est jamais mise en cache"""
+		mock_frappe.cache.return_value = self.cache
+		loader = MagicMock(return_value=None)
+
+		ovh_cache.get_or_load("service_name", loader)
+		ovh_cache.get_or_load("service_name", loader)
+
+		self.assertEqual(loader.call_count, 2)
+		self.assertIsNone(self.cache.get_value(ovh_cache.CACHE_PREFIX + "service_name"))
+
+	def test_invalidate(self, mock_frappe):
+		"""invalidate(nom) retire une entrée, invalidate() vide tout le cache API"""
+		mock_frappe.cache.return_value = self.cache
+		ovh_cache.get_or_load("service_name", lambda: "sms-xx-1")
+		ovh_cache.get_or_load("senders:sms-xx-1", lambda: ["ACME"])
+
+		ovh_cache.invalidate("service_name")
+		self.assertIsNone(self.cache.get_value(ovh_cache.CACHE_PREFIX + "service_name"))
+		self.assertEqual(self.cache.get_value(ovh_cache.CACHE_PREFIX + "senders:sms-xx-1"), ["ACME"])
+
+		ovh_cache.invalidate()
+		self.assertIsNone(self.cache.get_value(ovh_cache.CACHE_PREFIX + "senders:sms-xx-1"))
+
+	def test_stats_failure_does_not_break_lookup(self, mock_frappe):
+		"""Une erreur sur les compteurs n'empêche pas la lecture"""
+		cache = MagicMock()
+		cache.get_value.return_value = "sms-xx-1"
+		cache.incr.side_effect = Exception("Redis indisponible")
+		mock_frappe.cache.return_value = cache
+
+		self.assertEqual(ovh_cache.get_or_load("service_name", MagicMock()), "sms-xx-1")
+
+
+if __name__ == '__main__':
+	unittest.main()
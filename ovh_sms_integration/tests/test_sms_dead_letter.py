@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import json
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch, MagicMock
+
+import frappe
+from ovh_sms_integration.ovh_sms_integration.doctype.sms_dead_letter import sms_dead_letter
+
+MODULE = "ovh_sms_integration.ovh_sms_integration.doctype.sms_dead_letter.sms_dead_letter"
+NOW = datetime(2026, 1, 5, 10, 0, 0)
+
+
+@patch(MODULE + ".now_datetime", return_value=NOW)
+@patch(MODULE + ".frappe")
+class TestSMSDeadLetter(unittest.TestCase):
+
+	def test_replay_filters(self, mock_frappe, mock_now):
+		"""Rejeu planifié: échecs transitoires en attente, plus anciens que retry_failed_after_hours"""
+		mock_frappe.get_hooks.return_value = {"retry_failed_after_hours": [4, 6]}
+		mock_frappe.get_all.return_value = ["DL1", "DL2"]
+
+		with patch(MODULE + ".replay") as replay:
+			sms_dead_letter.replay_due_dead_letters()
+
+		filters = mock_frappe.get_all.call_args.kwargs["filters"]
+		self.assertEqual(filters, {
+			"status": sms_dead_letter.STATUS_PENDING,
+			"retryable": 1,
+			"error_class": ["in", sms_dead_letter.REPLAYABLE_ERROR_CLASSES],
+			"failed_at": ["<=", NOW - timedelta(hours=6)],
+			"replay_count": ["<", sms_dead_letter.MAX_REPLAYS]
+		})
+		replay.assert_called_once_with(["DL1", "DL2"])
+		mock_frappe.db.commit.assert_called_once_with()
+
+	def test_replay_default_delay_and_nothing_due(self, mock_frappe, mock_now):
+		"""Sans réglage dans les hooks: délai par défaut; rien à rejouer: aucun rejeu"""
+		mock_frappe.get_hooks.return_value = {}
+		mock_frappe.get_all.return_value = []
+
+		with patch(MODULE + ".replay") as replay:
+			sms_dead_letter.replay_due_dead_letters()
+
+		cutoff = mock_frappe.get_all.call_args.kwargs["filters"]["failed_at"][1]
+		self.assertEqual(cutoff, NOW - timedelta(hours=sms_dead_letter.DEFAULT_REPLAY_AFTER_HOURS))
+		replay.assert_not_called()
+		mock_frappe.db.commit.assert_not_called()
+
+	def test_replay_goes_through_outbox(self, mock_frappe, mock_now):
+		"""Les lettres sont remises en file en une insertion groupée et pointent vers leur ligne d'outbox"""
+		mock_frappe.get_all.return_value = [
+			frappe._dict(name="DL1", receiver="+33611111111", message="A", lane="Marketing"),
+			frappe._dict(name="DL2", receiver="+33622222222", message="B", lane="Marketing")
+		]
+
+		with patch("ovh_sms_integration.ovh_sms_integration.doctype.sms_outbox.sms_outbox.enqueue_many",
+				return_value=["OB1", "OB2"]) as enqueue_many:
+			self.assertEqual(sms_dead_letter.replay(["DL1", "DL2"]), 2)
+
+		self.assertEqual([entry["receiver"] for entry in enqueue_many.call_args.args[0]], ["+33611111111", "+33622222222"])
+		params = mock_frappe.db.sql.call_args.args[1]
+		self.assertEqual(params, ("DL1", "OB1", "DL2", "OB2", sms_dead_letter.STATUS_REPLAYED, NOW, NOW, ("DL1", "DL2")))
+
+	def test_new_failures_bulk_inserted(self, mock_frappe, mock_now):
+		"""Nouveaux échecs: une insertion groupée avec classe d'erreur, statut HTTP et historique"""
+		mock_frappe.session.user = "Administrator"
+		mock_frappe.generate_hash.return_value = "abc"
+		result = {"success": False, "message": "503", "retryable": True, "error_class": "server_error", "http_status": 503}
+
+		sms_dead_letter.record_dead_letters([{
+			"receiver": "+33612345678", "message": "Bonjour", "lane": "Marketing",
+			"reference_doctype": "SMS Pricing Item", "reference_name": "ITEM1", "result": result
+		}])
+
+		mock_frappe.get_all.assert_not_called()
+		fields, values = mock_frappe.db.bulk_insert.call_args.args[1:]
+		row = dict(zip(fields, values[0]))
+		self.assertEqual(
+			(row["status"], row["error_class"], row["http_status"], row["retryable"], row["reference_name"]),
+			(sms_dead_letter.STATUS_PENDING, "server_error", 503, 1, "ITEM1")
+		)
+		self.assertEqual(json.loads(row["attempt_history"])[0]["error_class"], "server_error")
+
+	def test_failed_replay_extends_existing_letter(self, mock_frappe, mock_now):
+		"""Échec d'un rejeu: la lettre existante est complétée, abandonnée après MAX_REPLAYS rejeux"""
+		history = json.dumps([{"error_class": "connect_timeout"}])
+		mock_frappe.get_all.return_value = [
+			frappe._dict(name="DL1", outbox="OB1", attempts=5, replay_count=1, attempt_history=history),
+			frappe._dict(name="DL2", outbox="OB2", attempts=5, replay_count=sms_dead_letter.MAX_REPLAYS, attempt_history=history)
+		]
+		result = {"success": False, "message": "timeout", "retryable": True, "error_class": "connect_timeout"}
+
+		sms_dead_letter.record_dead_letters([
+			{"receiver": "+33611111111", "message": "A", "outbox": "OB1", "attempts": 5, "result": result},
+			{"receiver": "+33622222222", "message": "B", "outbox": "OB2", "attempts": 5, "result": result}
+		])
+
+		updates = {c.args[1]: c.args[2] for c in mock_frappe.db.set_value.call_args_list}
+		self.assertEqual(updates["DL1"]["status"], sms_dead_letter.STATUS_PENDING)
+		self.assertEqual(updates["DL1"]["attempts"], 10)
+		self.assertEqual(len(json.loads(updates["DL1"]["attempt_history"])), 2)
+		self.assertEqual(updates["DL2"]["status"], sms_dead_letter.STATUS_ABANDONED)
+		mock_frappe.db.bulk_insert.assert_not_called()
+
+	def test_get_dead_lettered(self, mock_frappe, mock_now):
+		"""Seuls les documents dont un SMS est en attente de rejeu ou rejoué sont retournés"""
+		mock_frappe.get_all.return_value = ["ITEM2"]
+
+		self.assertEqual(sms_dead_letter.get_dead_lettered("SMS Pricing Item", ["ITEM1", "ITEM2"]), {"ITEM2"})
+		filters = mock_frappe.get_all.call_args.kwargs["filters"]
+		self.assertEqual(filters["status"], ["in", (sms_dead_letter.STATUS_PENDING, sms_dead_letter.STATUS_REPLAYED)])
+
+		mock_frappe.get_all.reset_mock()
+		self.assertEqual(sms_dead_letter.get_dead_lettered("SMS Pricing Item", []), set())
+		mock_frappe.get_all.assert_not_called()
+
+
+if __name__ == '__main__':
+	unittest.main()
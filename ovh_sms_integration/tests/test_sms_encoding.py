@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import unittest
+
+from ovh_sms_integration.utils.sms_encoding import (
+	ENCODING_GSM7, ENCODING_UCS2, analyze, estimate_totals, fit_gsm7, segment_count, transliterate
+)
+
+
+class TestSMSEncoding(unittest.TestCase):
+
+	def test_gsm7_segments(self):
+		"""GSM-7: 160 caractères en un SMS, 153 par segment au-delà"""
+		self.assertEqual(analyze("a" * 160), (ENCODING_GSM7, 160, 1))
+		self.assertEqual(segment_count("a" * 161), 2)
+		self.assertEqual(segment_count("a" * 306), 2)
+		self.assertEqual(segment_count("a" * 307), 3)
+
+	def test_french_accents_in_gsm7(self):
+		"""é, è, à, ù font partie de l'alphabet GSM-7 de base"""
+		self.assertEqual(analyze("Réservé à Noël? Non: déjà où")[0], ENCODING_UCS2)
+		self.assertEqual(analyze("Réservé à votre attention, déjà où")[0], ENCODING_GSM7)
+
+	def test_extension_counts_double(self):
+		"""Les caractères de la table d'extension (€, [, ]...) coûtent deux septets"""
+		self.assertEqual(analyze("€" * 80), (ENCODING_GSM7, 160, 1))
+		self.assertEqual(segment_count("€" * 81), 2)
+
+	def test_ucs2_segments(self):
+		"""Un caractère hors GSM-7 passe tout le message en UCS-2 (70, puis 67 par segment)"""
+		self.assertEqual(analyze("ê" * 70), (ENCODING_UCS2, 70, 1))
+		self.assertEqual(segment_count("ê" * 71), 2)
+		# Un emoji occupe deux unités UTF-16
+		self.assertEqual(analyze("😀" * 35), (ENCODING_UCS2, 70, 1))
+
+	def test_transliteration(self):
+		"""La translittération ramène le texte en GSM-7 quand elle économise des segments"""
+		text = "Votre fenêtre est prête, à bientôt ! " * 2
+		self.assertEqual(analyze(text)[2], 2)
+		self.assertEqual(transliterate("fenêtre « œuvre »"), 'fenetre " oeuvre "')
+		self.assertEqual(analyze(fit_gsm7(text)), (ENCODING_GSM7, len(text), 1))
+		# Pas de gain: le texte d'origine est conservé
+		self.assertEqual(fit_gsm7("Prêt"), "Prêt")
+
+	def test_estimate_totals(self):
+		"""Totaux de campagne en un passage"""
+		totals = estimate_totals(["Bonjour", "Bonjour", "Prêt", "a" * 200], cost_per_segment=0.1)
+
+		self.assertEqual(totals["messages"], 4)
+		self.assertEqual(totals["segments"], 5)
+		self.assertEqual(totals["gsm7"], 3)
+		self.assertEqual(totals["ucs2"], 1)
+		self.assertEqual(totals["multipart"], 1)
+		self.assertAlmostEqual(totals["cost"], 0.5)
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch, MagicMock
+
+import frappe
+from ovh_sms_integration.ovh_sms_integration.doctype.sms_outbox import sms_outbox
+from ovh_sms_integration.utils.priority_lanes import LANE_MARKETING, LANE_TRANSACTIONAL
+
+MODULE = "ovh_sms_integration.ovh_sms_integration.doctype.sms_outbox.sms_outbox"
+NOW = datetime(2026, 1, 5, 10, 0, 0)
+
+
+def make_row(name, **values):
+	row = frappe._dict(name=name, receiver="+33612345678", message="Bonjour", sender=None, lane=LANE_TRANSACTIONAL,
+		attempts=1, max_attempts=5, reference_doctype=None, reference_name=None, creation=NOW)
+	row.update(values)
+	return row
+
+
+@patch(MODULE + ".now_datetime", return_value=NOW)
+@patch(MODULE + ".frappe")
+class TestSMSOutbox(unittest.TestCase):
+
+	def test_claim_batch_lane_quotas(self, mock_frappe, mock_now):
+		"""Chaque voie a sa part du lot; la place laissée par une voie vide revient aux autres"""
+		available = {LANE_TRANSACTIONAL: ["t1", "t2"], LANE_MARKETING: ["m%d" % i for i in range(10)]}
+		calls = []
+
+		def claim_lane(lane, limit, now, exclude=None):
+			calls.append((lane, limit))
+			taken = [name for name in available[lane] if name not in (exclude or [])][:max(0, limit)]
+			return taken
+
+		with patch(MODULE + "._claim_lane", side_effect=claim_lane), \
+				patch(MODULE + "._mark_claimed", side_effect=lambda names, now: names):
+			names = sms_outbox.claim_batch(8)
+
+		# Quotas 6/2 (poids 3/1), puis les 4 places libres de la voie transactionnelle
+		self.assertEqual(calls[:2], [(LANE_TRANSACTIONAL, 6), (LANE_MARKETING, 2)])
+		self.assertEqual(names, ["t1", "t2", "m0", "m1", "m2", "m3", "m4", "m5"])
+
+	def test_retry_delay_is_exponential_and_capped(self, mock_frappe, mock_now):
+		"""Le report double à chaque tentative sans dépasser MAX_RETRY_DELAY"""
+		self.assertEqual(sms_outbox.retry_delay(1), sms_outbox.RETRY_BASE_DELAY)
+		self.assertEqual(sms_outbox.retry_delay(3), sms_outbox.RETRY_BASE_DELAY * 4)
+		self.assertEqual(sms_outbox.retry_delay(30), sms_outbox.MAX_RETRY_DELAY)
+
+	def test_apply_result_reschedules_retryable_failure(self, mock_frappe, mock_now):
+		"""Un échec rejouable est reprogrammé après le délai de sa tentative, sans notifier le document"""
+		row = make_row("OB1", attempts=2, reference_doctype="SMS Pricing Item", reference_name="ITEM1")
+
+		status = sms_outbox.apply_result(row, {"success": False, "message": "503", "retryable": True})
+
+		self.assertEqual(status, sms_outbox.STATUS_QUEUED)
+		name, values = mock_frappe.db.set_value.call_args.args[1:]
+		self.assertEqual(name, "OB1")
+		self.assertEqual(values, {
+			"status": sms_outbox.STATUS_QUEUED,
+			"next_attempt_at": NOW + timedelta(seconds=sms_outbox.RETRY_BASE_DELAY * 2),
+			"last_error": "503"
+		})
+		mock_frappe.get_hooks.assert_not_called()
+
+	def test_final_failures_are_dead_lettered(self, mock_frappe, mock_now):
+		"""Échec non rejouable ou tentatives épuisées: ligne Échoué et lettre morte, succès: Envoyé"""
+		mock_frappe.get_hooks.return_value = {}
+		settings = MagicMock()
+		settings.get_circuit_breaker.return_value.get_state.return_value = "closed"
+		rows = [make_row("OB1"), make_row("OB2"), make_row("OB3", attempts=5)]
+		failure = {"success": False, "message": "Numéro refusé", "retryable": False, "error_class": "client_error"}
+		timeout = {"success": False, "message": "timeout", "retryable": True, "error_class": "connect_timeout"}
+		settings.send_grouped.return_value = [{"success": True, "id": 42}, failure, timeout]
+
+		with patch(MODULE + ".record_dead_letters") as record:
+			sms_outbox.dispatch_rows(settings, rows)
+
+		statuses = [c.args[2]["status"] for c in mock_frappe.db.set_value.call_args_list]
+		self.assertEqual(statuses, [sms_outbox.STATUS_SENT, sms_outbox.STATUS_FAILED, sms_outbox.STATUS_FAILED])
+
+		entries = record.call_args.args[0]
+		self.assertEqual([entry["outbox"] for entry in entries], ["OB2", "OB3"])
+		self.assertEqual([entry["result"] for entry in entries], [failure, timeout])
+		mock_frappe.db.commit.assert_called()
+
+	def test_rate_limited_rows_are_released(self, mock_frappe, mock_now):
+		"""Débit atteint: la ligne n'a pas été envoyée, elle repart en file sans échec ni lettre morte"""
+		mock_frappe.get_hooks.return_value = {}
+		settings = MagicMock()
+		settings.get_circuit_breaker.return_value.get_state.return_value = "closed"
+		throttled = {"success": False, "message": "Limite", "retryable": True, "error_class": "rate_limit_exceeded"}
+		settings.send_grouped.return_value = [{"success": True, "id": 42}, throttled]
+
+		with patch(MODULE + ".record_dead_letters") as record, patch(MODULE + ".release_rows") as release:
+			sms_outbox.dispatch_rows(settings, [make_row("OB1"), make_row("OB2", attempts=5)])
+
+		release.assert_called_once_with(["OB2"])
+		self.assertEqual(mock_frappe.db.set_value.call_count, 1)
+		record.assert_called_once_with([])
+
+	def test_open_circuit_releases_rows_without_sending(self, mock_frappe, mock_now):
+		"""Disjoncteur ouvert: les lignes repartent en file sans envoi ni tentative décomptée"""
+		settings = MagicMock()
+		breaker = settings.get_circuit_breaker.return_value
+		breaker.get_state.return_value = "open"
+		breaker.reset_timeout = 60
+
+		with patch(MODULE + ".release_rows") as release:
+			sms_outbox.dispatch_rows(settings, [make_row("OB1"), make_row("OB2")])
+
+		release.assert_called_once_with(["OB1", "OB2"], 60)
+		settings.send_grouped.assert_not_called()
+
+	def test_release_stale_claims(self, mock_frappe, mock_now):
+		"""Les lignes réclamées depuis plus de STALE_CLAIM_MINUTES repartent en file"""
+		sms_outbox.release_stale_claims()
+
+		params = mock_frappe.db.sql.call_args.args[1]
+		self.assertEqual(params, (
+			sms_outbox.STATUS_QUEUED, NOW, NOW, sms_outbox.STATUS_SENDING,
+			NOW - timedelta(minutes=sms_outbox.STALE_CLAIM_MINUTES)
+		))
+		mock_frappe.db.commit.assert_called_once()
+
+	@patch(MODULE + ".time.sleep")
+	def test_coalesce_batch_waits_and_claims_siblings(self, mock_sleep, mock_frappe, mock_now):
+		"""Lot récent: attente de la fin de la fenêtre puis réclamation des SMS identiques"""
+		rows = [
+			make_row("OB1", creation=NOW - timedelta(seconds=0.5)),
+			make_row("OB2", sender="ACME", lane=None, creation=NOW - timedelta(seconds=5))
+		]
+		mock_frappe.db.sql.return_value = ["OB3"]
+
+		with patch(MODULE + "._mark_claimed", return_value=[make_row("OB3")]) as mark:
+			batch = sms_outbox.coalesce_batch(rows, window=2)
+
+		mock_sleep.assert_called_once_with(1.5)
+		params = mock_frappe.db.sql.call_args.args[1]
+		self.assertEqual(set(params["keys"]), {
+			(LANE_TRANSACTIONAL, "", "Bonjour"),
+			(sms_outbox.DEFAULT_LANE, "ACME", "Bonjour")
+		})
+		self.assertEqual(params["limit"], sms_outbox.MAX_COALESCED_ROWS)
+		mark.assert_called_once_with(["OB3"], NOW)
+		self.assertEqual([row.name for row in batch], ["OB1", "OB2", "OB3"])
+
+	@patch(MODULE + ".time.sleep")
+	def test_coalesce_batch_old_rows_do_not_wait(self, mock_sleep, mock_frappe, mock_now):
+		"""Lignes plus anciennes que la fenêtre: pas d'attente, mais le regroupement a lieu"""
+		mock_frappe.db.sql.return_value = []
+
+		with patch(MODULE + "._mark_claimed", return_value=[]):
+			batch = sms_outbox.coalesce_batch([make_row("OB1", creation=NOW - timedelta(seconds=10))], window=2)
+
+		mock_sleep.assert_not_called()
+		self.assertEqual([row.name for row in batch], ["OB1"])
+
+	@patch(MODULE + ".time.sleep")
+	def test_coalesce_window_zero_is_noop(self, mock_sleep, mock_frappe, mock_now):
+		"""Fenêtre nulle: le lot est retourné tel quel, sans attente ni requête"""
+		rows = [make_row("OB1")]
+
+		self.assertIs(sms_outbox.coalesce_batch(rows, window=0), rows)
+		mock_sleep.assert_not_called()
+		mock_frappe.db.sql.assert_not_called()
+
+	def test_get_coalesce_window(self, mock_frappe, mock_now):
+		"""Réglage vide: fenêtre par défaut; valeur négative ramenée à 0"""
+		self.assertEqual(sms_outbox.get_coalesce_window(MagicMock(coalesce_window=None)),
+			sms_outbox.DEFAULT_COALESCE_WINDOW)
+		self.assertEqual(sms_outbox.get_coalesce_window(MagicMock(coalesce_window=-3)), 0)
+		self.assertEqual(sms_outbox.get_coalesce_window(MagicMock(coalesce_window=5)), 5)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import unittest
+import json
+from unittest.mock import patch, call, MagicMock
+
+import frappe
+from ovh_sms_integration.ovh_sms_integration.doctype.sms_pricing_campaign.sms_pricing_campaign import (
+	SMSPricingCampaign, SEND_JOB_DONE, SEND_JOB_FAILED, SEND_JOB_PAUSED, SEND_JOB_RUNNING, SEND_JOB_TIMEOUT,
+	get_shard_timeout, run_campaign_send, write_item_statuses
+)
+from ovh_sms_integration.utils.priority_lanes import LANE_MARKETING
+
+MODULE = "ovh_sms_integration.ovh_sms_integration.doctype.sms_pricing_campaign.sms_pricing_campaign"
+
+
+def make_item(idx, **values):
+	item = frappe._dict(name=f"ITEM{idx}", idx=idx, sms_sent=0, sms_status="Non envoyé", customer_mobile="+33612345678")
+	item.update(values)
+	return item
+
+
+@patch(MODULE + ".get_dead_lettered", return_value=set())
+@patch(MODULE + ".frappe")
+class TestCampaignChunkedSend(unittest.TestCase):
+
+	def setUp(self):
+		patcher = patch(MODULE + ".get_send_batch_size", return_value=50)
+		self.batch_size = patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def make_campaign(self, mock_frappe, chunks, plan=None):
+		campaign = MagicMock()
+		campaign.get_shard_plan.return_value = plan or {"ranges": [[1, 5]], "checkpoints": [0], "failed": [0]}
+		campaign.get_next_chunk.side_effect = chunks
+		campaign.send_items_grouped.side_effect = lambda items, wait=False: [{"success": True}] * len(items)
+		campaign.complete_shard.return_value = True
+		mock_frappe.get_doc.return_value = campaign
+		mock_frappe.db.get_value.return_value = SEND_JOB_RUNNING
+		return campaign
+
+	def test_chunks_advance_checkpoint(self, mock_frappe, mock_dead_lettered):
+		"""Chaque lot est validé avec son point de contrôle; le suivant repart de là"""
+		first, second = [make_item(1), make_item(2)], [make_item(3), make_item(5)]
+		campaign = self.make_campaign(mock_frappe, [first, second, []])
+
+		run_campaign_send("CAMP-1", shard=0, chunk_size=2)
+
+		self.assertEqual(campaign.get_next_chunk.call_args_list, [call(0, 5, 2), call(2, 5, 2), call(5, 5, 2)])
+		self.assertEqual(campaign.record_chunk.call_args_list, [
+			call(first, [{"success": True}] * 2, 0, 2, 2),
+			call(second, [{"success": True}] * 2, 0, 5, 2)
+		])
+		# Un commit par vague d'envoi et par lot, puis celui de la fin du shard
+		self.assertEqual(mock_frappe.db.commit.call_count, 5)
+		campaign.finish_background_send.assert_called_once_with()
+
+	def test_statuses_committed_after_each_wave(self, mock_frappe, mock_dead_lettered):
+		"""Les statuts sont validés après chaque vague d'envois OVH, sans attendre la fin du lot"""
+		self.batch_size.return_value = 2
+		rows = [make_item(idx) for idx in range(1, 6)]
+		campaign = self.make_campaign(mock_frappe, [rows, []])
+		commits = []
+		campaign.record_chunk.side_effect = lambda *args: commits.append(mock_frappe.db.commit.call_count)
+
+		run_campaign_send("CAMP-1")
+
+		self.assertEqual([c.args[3:] for c in campaign.record_chunk.call_args_list], [(2, 2), (4, 2), (5, 1)])
+		self.assertEqual(commits, [0, 1, 2])
+		# Envoi en arrière-plan: attente du débit OVH plutôt qu'un échec
+		self.assertTrue(all(c.kwargs["wait"] for c in campaign.send_items_grouped.call_args_list))
+
+	def test_failed_wave_keeps_previous_waves(self, mock_frappe, mock_dead_lettered):
+		"""Erreur sur une vague: les vagues déjà envoyées restent validées, le shard passe en échec"""
+		self.batch_size.return_value = 2
+		campaign = self.make_campaign(mock_frappe, [[make_item(idx) for idx in range(1, 5)]])
+		campaign.send_items_grouped.side_effect = [[{"success": True}] * 2, Exception("OVH indisponible")]
+
+		with self.assertRaises(Exception):
+			run_campaign_send("CAMP-1")
+
+		campaign.record_chunk.assert_called_once()
+		self.assertEqual(campaign.record_chunk.call_args.args[3], 2)
+		campaign.fail_shard.assert_called_once_with(0)
+
+	def test_resumes_from_checkpoint(self, mock_frappe, mock_dead_lettered):
+		"""Après un arrêt, le shard reprend après son dernier point de contrôle"""
+		plan = {"ranges": [[1, 10], [11, 20]], "checkpoints": [10, 14], "failed": [0, 0]}
+		campaign = self.make_campaign(mock_frappe, [[]], plan)
+
+		run_campaign_send("CAMP-1", shard=1, chunk_size=50)
+
+		campaign.get_next_chunk.assert_called_once_with(14, 20, 50)
+
+	def test_sent_and_queued_rows_are_skipped(self, mock_frappe, mock_dead_lettered):
+		"""Les lignes déjà envoyées ou en file ne sont pas renvoyées mais comptent comme traitées"""
+		rows = [make_item(1, sms_sent=1, sms_status="Envoyé"), make_item(2, sms_status="En file"), make_item(3)]
+		campaign = self.make_campaign(mock_frappe, [rows, []])
+
+		run_campaign_send("CAMP-1")
+
+		self.assertEqual(campaign.send_items_grouped.call_args.args[0], [rows[2]])
+		self.assertEqual(campaign.record_chunk.call_args.args[3:], (3, 3))
+
+	def test_dead_lettered_rows_are_skipped(self, mock_frappe, mock_dead_lettered):
+		"""Les lignes confiées au rejeu (SMS Dead Letter) ne sont pas renvoyées par une relance"""
+		rows = [make_item(1, sms_status="Échoué"), make_item(2, sms_status="Échoué"), make_item(3)]
+		campaign = self.make_campaign(mock_frappe, [rows, []])
+		mock_dead_lettered.return_value = {"ITEM2"}
+
+		run_campaign_send("CAMP-1")
+
+		mock_dead_lettered.assert_called_once_with("SMS Pricing Item", ["ITEM1", "ITEM2", "ITEM3"])
+		self.assertEqual(campaign.send_items_grouped.call_args.args[0], [rows[0], rows[2]])
+		self.assertEqual(campaign.record_chunk.call_args.args[3:], (3, 3))
+
+	def test_send_result_details_are_kept(self, mock_frappe, mock_dead_lettered):
+		"""Le résultat d'une ligne conserve error_class, http_status et retryable pour SMS Dead Letter"""
+		item = make_item(1)
+		result = {"success": False, "message": "503", "retryable": True, "error_class": "server_error", "http_status": 503}
+
+		outcome = SMSPricingCampaign.apply_sms_result(MagicMock(), item, result)
+
+		self.assertEqual(outcome, result)
+		self.assertEqual(item.sms_status, "Échoué")
+
+	def test_pause_stops_between_chunks(self, mock_frappe, mock_dead_lettered):
+		"""Une pause est lue entre deux lots: le shard s'arrête sans passer la barrière"""
+		campaign = self.make_campaign(mock_frappe, [[make_item(1)], [make_item(2)]])
+		mock_frappe.db.get_value.side_effect = [SEND_JOB_RUNNING, SEND_JOB_PAUSED]
+
+		run_campaign_send("CAMP-1")
+
+		self.assertEqual(campaign.get_next_chunk.call_count, 1)
+		self.assertEqual(campaign.send_job_status, SEND_JOB_PAUSED)
+		campaign.complete_shard.assert_not_called()
+		campaign.publish_send_progress.assert_called()
+
+	def test_failed_chunk_releases_barrier(self, mock_frappe, mock_dead_lettered):
+		"""Erreur d'envoi: annulation du lot, shard marqué en échec (barrière décomptée) puis erreur propagée"""
+		campaign = self.make_campaign(mock_frappe, [[make_item(1)], [make_item(2)]])
+		campaign.send_items_grouped.side_effect = Exception("OVH indisponible")
+
+		with self.assertRaises(Exception):
+			run_campaign_send("CAMP-1", shard=0)
+
+		mock_frappe.db.rollback.assert_called_once_with()
+		campaign.fail_shard.assert_called_once_with(0)
+		campaign.record_chunk.assert_not_called()
+		campaign.complete_shard.assert_not_called()
+		mock_frappe.db.commit.assert_called_once_with()
+
+	def test_unknown_shard_is_ignored(self, mock_frappe, mock_dead_lettered):
+		"""Shard hors du découpage (campagne redécoupée entre-temps): rien à faire"""
+		campaign = self.make_campaign(mock_frappe, [])
+
+		run_campaign_send("CAMP-1", shard=3)
+
+		campaign.get_next_chunk.assert_not_called()
+
+
+@patch(MODULE + ".frappe")
+class TestCampaignStatusWrites(unittest.TestCase):
+
+	def test_statuses_grouped_by_value(self, mock_frappe):
+		"""Un UPDATE ... WHERE name IN (...) par couple (sms_sent, sms_status), lignes sans nom ignorées"""
+		items = [
+			make_item(1, sms_sent=1, sms_status="Envoyé"),
+			make_item(2, sms_status="Échoué"),
+			make_item(3, sms_sent=1, sms_status="Envoyé"),
+			make_item(4, name=None, sms_status="Échoué")
+		]
+
+		write_item_statuses(items)
+
+		params = [c.args[1] for c in mock_frappe.db.sql.call_args_list]
+		self.assertEqual(params, [(1, "Envoyé", ("ITEM1", "ITEM3")), (0, "Échoué", ("ITEM2",))])
+
+	def test_statuses_written_in_batches(self, mock_frappe):
+		"""Les listes de noms sont découpées en lots de batch_size"""
+		items = [make_item(idx, sms_sent=1, sms_status="Envoyé") for idx in range(1, 6)]
+
+		write_item_statuses(items, batch_size=2)
+
+		names = [c.args[1][2] for c in mock_frappe.db.sql.call_args_list]
+		self.assertEqual(names, [("ITEM1", "ITEM2"), ("ITEM3", "ITEM4"), ("ITEM5",)])
+
+	def test_no_changed_rows(self, mock_frappe):
+		"""Aucune ligne modifiée: aucune requête"""
+		write_item_statuses([])
+
+		mock_frappe.db.sql.assert_not_called()
+
+	def test_record_chunk_without_saving_campaign(self, mock_frappe):
+		"""Un lot écrit ses lignes, incrémente les compteurs en base et avance le seul point de contrôle du shard"""
+		campaign = MagicMock()
+		campaign.name = "CAMP-1"
+		items = [make_item(1, sms_sent=1, sms_status="Envoyé"), make_item(2, sms_status="Échoué")]
+		outcomes = [{"success": True}, {"success": False, "message": "Numéro refusé"}]
+
+		with patch(MODULE + ".write_item_statuses") as write:
+			SMSPricingCampaign.record_chunk(campaign, items, outcomes, 2, 7, 3)
+
+		write.assert_called_once_with(items)
+		campaign.record_failures.assert_called_once_with(items, outcomes)
+		campaign.update_sending_statistics.assert_called_once_with(1, 1, 3)
+		self.assertEqual(mock_frappe.db.sql.call_args.args[1], ("$.checkpoints[2]", 7, "CAMP-1"))
+		campaign.save.assert_not_called()
+
+	def test_sending_statistics_incremented_in_database(self, mock_frappe):
+		"""Les compteurs sont incrémentés par la base: des shards concurrents ne s'écrasent pas"""
+		campaign = MagicMock(sms_sent_count=4, sms_failed_count=None)
+		campaign.name = "CAMP-1"
+
+		SMSPricingCampaign.update_sending_statistics(campaign, 3, 1, 4)
+
+		params = mock_frappe.db.sql.call_args.args[1]
+		self.assertEqual((params["sent"], params["failed"], params["processed"]), (3, 1, 4))
+		self.assertEqual((campaign.sms_sent_count, campaign.sms_failed_count), (7, 1))
+
+
+def make_campaign_doc(**values):
+	"""Campagne factice sur laquelle appeler les méthodes de SMSPricingCampaign"""
+	campaign = MagicMock(send_job_status=None, status="Brouillon", send_progress=40)
+	campaign.name = "CAMP-1"
+	for key, value in values.items():
+		setattr(campaign, key, value)
+	return campaign
+
+
+@patch(MODULE + ".frappe")
+class TestCampaignShards(unittest.TestCase):
+
+	def setUp(self):
+		patcher = patch(MODULE + ".get_shard_timeout", return_value=7200)
+		self.shard_timeout = patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_plan_shards(self, mock_frappe):
+		"""Plages d'idx contiguës de même taille, point de contrôle juste avant chaque plage"""
+		mock_frappe.db.sql.return_value = [1, 2, 3, 5, 6, 8, 9]
+
+		plan = SMSPricingCampaign.plan_shards(make_campaign_doc(), 3)
+
+		self.assertEqual(plan, {"ranges": [[1, 3], [5, 8], [9, 9]], "checkpoints": [0, 4, 8], "failed": [0, 0, 0]})
+
+	def test_plan_shards_default_count(self, mock_frappe):
+		"""Sans réglage, DEFAULT_SEND_SHARDS shards; jamais de shard vide"""
+		mock_frappe.db.get_single_value.return_value = None
+		mock_frappe.db.sql.return_value = [1, 2]
+
+		plan = SMSPricingCampaign.plan_shards(make_campaign_doc())
+
+		self.assertEqual(plan["ranges"], [[1, 1], [2, 2]])
+
+	def test_complete_shard_barrier(self, mock_frappe):
+		"""Seul le shard qui fait passer le compteur de 1 à 0 finalise l'envoi"""
+		campaign = make_campaign_doc()
+		results = []
+		for pending in (2, 1, 0):
+			mock_frappe.db.sql.reset_mock()
+			mock_frappe.db.sql.return_value = [pending]
+			results.append(SMSPricingCampaign.complete_shard(campaign))
+			if pending:
+				self.assertEqual(mock_frappe.db.sql.call_args.args[1], (pending - 1, "CAMP-1"))
+			else:
+				self.assertEqual(mock_frappe.db.sql.call_count, 1)
+
+		self.assertEqual(results, [False, True, False])
+
+	def test_fail_shard_marks_and_finishes(self, mock_frappe):
+		"""Un shard en échec est marqué et décompté; s'il était le dernier, l'envoi est finalisé"""
+		campaign = make_campaign_doc()
+		campaign.complete_shard.return_value = True
+
+		SMSPricingCampaign.fail_shard(campaign, 2)
+
+		self.assertEqual(mock_frappe.db.sql.call_args.args[1], ("$.failed[2]", "CAMP-1"))
+		campaign.finish_background_send.assert_called_once_with()
+
+		campaign = make_campaign_doc()
+		campaign.complete_shard.return_value = False
+		SMSPricingCampaign.fail_shard(campaign, 0)
+		campaign.finish_background_send.assert_not_called()
+
+	def test_refresh_send_status_recounts(self, mock_frappe):
+		"""À la barrière, les compteurs sont remplacés par le décompte réel des lignes"""
+		campaign = make_campaign_doc()
+		mock_frappe.db.sql.return_value = [(10, 7, 2)]
+
+		SMSPricingCampaign.refresh_send_status(campaign, recount=True)
+
+		campaign.db_set.assert_called_once_with(
+			{"status": "Partiellement envoyé", "sms_sent_count": 7, "sms_failed_count": 2}, update_modified=False
+		)
+
+	def test_refresh_send_status_without_change(self, mock_frappe):
+		"""Sans recomptage ni changement de statut: aucune écriture"""
+		campaign = make_campaign_doc(status="Envoyé")
+		mock_frappe.db.sql.return_value = [(3, 3, 0)]
+
+		SMSPricingCampaign.refresh_send_status(campaign)
+
+		campaign.db_set.assert_not_called()
+
+	def test_finish_background_send(self, mock_frappe):
+		"""Fin d'envoi: Terminé si tous les shards ont abouti, Échoué (relançable) sinon"""
+		for failed, status, progress in (([0, 0], SEND_JOB_DONE, 100), ([0, 1], SEND_JOB_FAILED, 40)):
+			campaign = make_campaign_doc()
+			campaign.get_shard_plan.return_value = {"ranges": [[1, 2], [3, 4]], "checkpoints": [2, 3], "failed": failed}
+
+			SMSPricingCampaign.finish_background_send(campaign)
+
+			campaign.refresh_send_status.assert_called_once_with(recount=True)
+			campaign.db_set.assert_called_once_with(
+				{"send_job_status": status, "send_progress": progress}, update_modified=False
+			)
+			self.assertEqual(campaign.send_job_status, status)
+
+	def test_resume_failed_send(self, mock_frappe):
+		"""Relance d'un envoi en échec: seuls les shards inachevés repartent de leur point de contrôle"""
+		plan = {"ranges": [[1, 5], [6, 10], [11, 12]], "checkpoints": [5, 7, 10], "failed": [0, 1, 0]}
+		campaign = make_campaign_doc(send_job_status=SEND_JOB_FAILED)
+		campaign.get_shard_plan.return_value = plan
+
+		SMSPricingCampaign.start_background_send(campaign, chunk_size=100)
+
+		saved = json.loads(campaign.db_set.call_args_list[0].args[1])
+		self.assertEqual(saved, dict(plan, failed=[0, 0, 0]))
+		self.assertEqual(campaign.db_set.call_args_list[1].args[0],
+			{"send_job_status": SEND_JOB_RUNNING, "send_shards_pending": 2})
+		self.assertEqual([c.kwargs["shard"] for c in mock_frappe.enqueue.call_args_list], [1, 2])
+		self.assertEqual(mock_frappe.enqueue.call_args.kwargs["job_id"], "sms_campaign_send_CAMP-1_2")
+		# Timeout dimensionné sur les lignes restantes de chaque shard
+		self.assertEqual(self.shard_timeout.call_args_list, [call(3, 2), call(2, 2)])
+		self.assertEqual(mock_frappe.enqueue.call_args.kwargs["timeout"], 7200)
+		campaign.plan_shards.assert_not_called()
+
+	def test_new_send_plans_shards(self, mock_frappe):
+		"""Nouvel envoi: nouveau découpage et remise à zéro de l'avancement"""
+		campaign = make_campaign_doc(send_job_status=SEND_JOB_DONE)
+		campaign.plan_shards.return_value = {"ranges": [[1, 4]], "checkpoints": [0], "failed": [0]}
+
+		SMSPricingCampaign.start_background_send(campaign, shards=2)
+
+		campaign.plan_shards.assert_called_once_with(2)
+		values = campaign.db_set.call_args_list[0].args[0]
+		self.assertEqual((values["send_processed"], values["send_progress"]), (0, 0))
+		self.assertEqual(mock_frappe.enqueue.call_count, 1)
+
+
+@patch(MODULE + ".frappe")
+class TestShardTimeout(unittest.TestCase):
+
+	def make_settings(self, mock_frappe, rate, share):
+		settings = MagicMock(rate_limit_per_minute=rate)
+		settings.get_lane_rate_share.return_value = share
+		mock_frappe.get_single.return_value = settings
+		return settings
+
+	def test_timeout_covers_rate_budget(self, mock_frappe):
+		"""2 500 lignes par shard, 4 shards sur 30 % de 60 SMS/min: le job dure ~9 h, pas 1 h"""
+		settings = self.make_settings(mock_frappe, 60, 0.3)
+
+		timeout = get_shard_timeout(2500, 4)
+
+		settings.get_lane_rate_share.assert_called_once_with(LANE_MARKETING)
+		self.assertEqual(timeout, SEND_JOB_TIMEOUT + int(2500 * 60 * 4 / 18.0))
+		self.assertGreater(timeout, 9 * 3600)
+
+	def test_unlimited_rate(self, mock_frappe):
+		"""Débit illimité: timeout par défaut"""
+		self.make_settings(mock_frappe, 0, 0.3)
+
+		self.assertEqual(get_shard_timeout(2500, 4), SEND_JOB_TIMEOUT)
+
+
+@patch(MODULE + ".frappe")
+class TestCampaignRendering(unittest.TestCase):
+
+	def make_campaign(self, template, auto_transliterate=0):
+		campaign = SMSPricingCampaign.__new__(SMSPricingCampaign)
+		campaign.sms_template = template
+		campaign.auto_transliterate = auto_transliterate
+		campaign.company = "ACME"
+		campaign.title = "Soldes"
+		return campaign
+
+	def test_render_error_falls_back_per_row(self, mock_frappe):
+		"""Une ligne en erreur prend le texte de repli, les autres gardent leur message personnalisé"""
+		campaign = self.make_campaign("Bonjour {{ customer_name }}: {{ final_price }}€")
+		items = [
+			make_item(1, customer_name="Alice", item_name="Café", final_price=12.5),
+			make_item(2, customer_name="Bob", item_name="Thé", final_price="n/a"),
+			make_item(3, customer_name="Chloé", item_name="Café", final_price=9)
+		]
+
+		messages = campaign.format_sms_messages(items)
+
+		self.assertEqual(messages, ["Bonjour Alice: 12.50€", "Offre Thé à n/a€ pour Bob", "Bonjour Chloé: 9.00€"])
+		mock_frappe.log_error.assert_called_once()
+		self.assertIn("Bob", mock_frappe.log_error.call_args.args[0])
+
+
+if __name__ == '__main__':
+	unittest.main()
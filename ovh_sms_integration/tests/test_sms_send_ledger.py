@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch, MagicMock
+
+from ovh_sms_integration.ovh_sms_integration.doctype.sms_send_ledger import sms_send_ledger
+from ovh_sms_integration.utils import sms_utils
+
+MODULE = "ovh_sms_integration.ovh_sms_integration.doctype.sms_send_ledger.sms_send_ledger"
+NOW = datetime(2026, 1, 5, 10, 0, 0)
+
+
+class TestReminderWindow(unittest.TestCase):
+
+	def test_reminder_key_normalizes_recipient(self):
+		"""Clé: numéro au format E.164 et délai en minutes, quel que soit le format saisi"""
+		self.assertEqual(sms_send_ledger.reminder_key("EV1", "06 12 34 56 78", 24), ("EV1", "+33612345678", 1440))
+		self.assertEqual(sms_send_ledger.reminder_key("EV1", "0033612345678", "0.5"), ("EV1", "+33612345678", 30))
+		self.assertEqual(sms_send_ledger.reminder_key("EV1", "abc", None), ("EV1", "abc", 0))
+
+	def test_match_reminder_offset_window(self):
+		"""Le rappel est retenu à ±30 min de son délai, la fenêtre la plus proche l'emporte"""
+		times = [24, 2, 1.5]
+
+		self.assertEqual(sms_send_ledger.match_reminder_offset(NOW + timedelta(hours=24, minutes=29), times, NOW), 24)
+		self.assertEqual(sms_send_ledger.match_reminder_offset(NOW + timedelta(hours=23, minutes=30), times, NOW), 24)
+		self.assertIsNone(sms_send_ledger.match_reminder_offset(NOW + timedelta(hours=24, minutes=31), times, NOW))
+		self.assertIsNone(sms_send_ledger.match_reminder_offset(NOW + timedelta(hours=12), times, NOW))
+		# 1h50 est dans les fenêtres de 2h et de 1h30: la plus proche (2h) est retenue
+		self.assertEqual(sms_send_ledger.match_reminder_offset(NOW + timedelta(hours=1, minutes=50), times, NOW), 2)
+		self.assertIsNone(sms_send_ledger.match_reminder_offset(None, times, NOW))
+
+
+@patch(MODULE + ".now_datetime", return_value=NOW)
+@patch(MODULE + ".frappe")
+class TestReminderClaims(unittest.TestCase):
+
+	def test_claim_skips_recorded_reminders(self, mock_frappe, mock_now):
+		"""Seuls les rappels absents du registre sont insérés, en INSERT IGNORE sous un même lot"""
+		sent = ("EV1", "+33611111111", 1440)
+		new = ("EV1", "+33622222222", 1440)
+		mock_frappe.generate_hash.return_value = "batch"
+		mock_frappe.db.sql.side_effect = [[sent], [new]]
+
+		self.assertEqual(sms_send_ledger.claim_reminders([sent, new, new]), {new})
+
+		fields, values = mock_frappe.db.bulk_insert.call_args.args[1:]
+		self.assertEqual([row[-4:] for row in values], [("EV1", "+33622222222", 1440, "batch")])
+		self.assertTrue(mock_frappe.db.bulk_insert.call_args.kwargs["ignore_duplicates"])
+		self.assertEqual(mock_frappe.db.sql.call_args.args[1], "batch")
+
+	def test_claim_lost_to_concurrent_run(self, mock_frappe, mock_now):
+		"""Doublon ignoré par l'index unique (passage concurrent): la clé n'est pas réservée par ce lot"""
+		first = ("EV1", "+33611111111", 60)
+		second = ("EV1", "+33622222222", 60)
+		# Le second rappel a été inséré entre la lecture du registre et l'INSERT IGNORE
+		mock_frappe.db.sql.side_effect = [[], [first]]
+
+		self.assertEqual(sms_send_ledger.claim_reminders([first, second]), {first})
+		self.assertEqual(len(mock_frappe.db.bulk_insert.call_args.args[2]), 2)
+
+	def test_claim_nothing_pending(self, mock_frappe, mock_now):
+		"""Rappels tous déjà enregistrés ou liste vide: aucune insertion"""
+		key = ("EV1", "+33611111111", 60)
+		mock_frappe.db.sql.return_value = [key]
+
+		self.assertEqual(sms_send_ledger.claim_reminders([key]), set())
+		self.assertEqual(sms_send_ledger.claim_reminders([]), set())
+		mock_frappe.db.bulk_insert.assert_not_called()
+		self.assertEqual(mock_frappe.db.sql.call_count, 1)
+
+	def test_release_reminders(self, mock_frappe, mock_now):
+		"""La libération supprime les réservations données; rien à libérer: aucune requête"""
+		key = ("EV1", "+33611111111", 60)
+
+		sms_send_ledger.release_reminders([key, key])
+		self.assertEqual(mock_frappe.db.sql.call_args.args[1], ((key,),))
+
+		mock_frappe.db.sql.reset_mock()
+		sms_send_ledger.release_reminders([])
+		mock_frappe.db.sql.assert_not_called()
+
+
+@patch("ovh_sms_integration.utils.sms_utils.frappe")
+class TestReminderRelease(unittest.TestCase):
+
+	def test_failed_send_releases_claim(self, mock_frappe):
+		"""Un rappel réservé mais non mis en file est libéré pour le passage suivant"""
+		settings = MagicMock(enabled=True, send_to_customer_only=True, send_to_employee=False)
+		settings.get_reminder_times.return_value = [24]
+		settings.format_messages.side_effect = lambda template, event, group, kind: [
+			(participant, "Rappel", 1) for participant in group
+		]
+		event = MagicMock(starts_on=datetime.now() + timedelta(hours=24))
+		event.name = "EV1"
+		mock_frappe.get_single.return_value = settings
+		mock_frappe.get_doc.return_value = event
+		participants = [
+			{"name": "C1", "type": "customer", "mobile": "0611111111"},
+			{"name": "C2", "type": "customer", "mobile": "0622222222"}
+		]
+
+		with patch.object(sms_utils, "get_events_requiring_reminders", return_value=[event]), \
+				patch.object(sms_utils, "get_event_participants_with_mobile", return_value=participants), \
+				patch.object(sms_utils, "claim_reminders", side_effect=set) as claim, \
+				patch.object(sms_utils, "enqueue_bulk_sms",
+					return_value=[{"success": True}, {"success": False, "message": "Erreur"}]), \
+				patch.object(sms_utils, "release_reminders") as release, \
+				patch.object(sms_utils, "log_event_reminder_sent"), \
+				patch.object(sms_utils, "update_reminder_statistics"):
+			result = sms_utils.process_pending_event_reminders()
+
+		self.assertEqual(claim.call_args.args[0], [("EV1", "+33611111111", 1440), ("EV1", "+33622222222", 1440)])
+		release.assert_called_once_with([("EV1", "+33622222222", 1440)])
+		self.assertEqual((result["sent"], result["failed"]), (1, 1))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import time
+import unittest
+from unittest.mock import patch
+
+from jinja2.exceptions import SecurityError
+
+from ovh_sms_integration.utils import sms_templates
+
+
+class TestSMSTemplates(unittest.TestCase):
+
+	def setUp(self):
+		sms_templates.invalidate()
+
+	def test_template_compiled_once(self):
+		"""Un même texte n'est compilé qu'une fois puis servi depuis le cache"""
+		text = "Bonjour {{ customer_name }}"
+		before = sms_templates.get_statistics()
+
+		self.assertEqual(sms_templates.render(text, {"customer_name": "Alice"}), "Bonjour Alice")
+		self.assertEqual(sms_templates.render(text, {"customer_name": "Bob"}), "Bonjour Bob")
+
+		stats = sms_templates.get_statistics()
+		self.assertEqual(stats["misses"] - before["misses"], 1)
+		self.assertEqual(stats["hits"] - before["hits"], 1)
+		self.assertIs(sms_templates.get_template(text), sms_templates.get_template(text))
+
+	def test_lru_eviction(self):
+		"""Le cache est borné: le template le moins récemment utilisé est évincé"""
+		first = sms_templates.get_template("modèle 0")
+		for index in range(1, sms_templates.MAX_CACHED_TEMPLATES + 1):
+			sms_templates.get_template(f"modèle {index}")
+
+		self.assertEqual(sms_templates.get_statistics()["size"], sms_templates.MAX_CACHED_TEMPLATES)
+		self.assertIsNot(sms_templates.get_template("modèle 0"), first)
+
+	def test_invalidate(self):
+		"""L'invalidation retire l'ancienne version d'un template"""
+		text = "Rappel {{ subject }}"
+		template = sms_templates.get_template(text)
+		sms_templates.invalidate(text)
+
+		self.assertIsNot(sms_templates.get_template(text), template)
+
+	def test_render_many_per_recipient(self):
+		"""render_many rend chaque destinataire et compte ses segments"""
+		rendered = sms_templates.render_many(
+			"Bonjour {{ customer_name }}, offre {{ campaign_title }}",
+			[("+33600000001", {"customer_name": "Alice"}), ("+33600000002", {"customer_name": "Bob"})],
+			shared={"campaign_title": "Printemps"}
+		)
+
+		self.assertEqual(rendered, [
+			("+33600000001", "Bonjour Alice, offre Printemps", 1),
+			("+33600000002", "Bonjour Bob, offre Printemps", 1)
+		])
+
+	def test_render_many_shared_only(self):
+		"""Un template sans variable propre au destinataire n'est rendu qu'une fois"""
+		text = "Offre {{ campaign_title }}"
+		sms_templates.get_template(text)
+
+		with patch.object(sms_templates, "_render_chunk") as render_chunk:
+			rendered = sms_templates.render_many(
+				text, [(index, {"customer_name": str(index)}) for index in range(3)], shared={"campaign_title": "Été"}
+			)
+
+		render_chunk.assert_not_called()
+		self.assertEqual([text for recipient, text, segments in rendered], ["Offre Été"] * 3)
+
+	def test_context_built_for_used_variables_only(self):
+		"""Seules les variables utilisées par le template sont calculées"""
+		calls = []
+		builders = {
+			"subject": lambda doc: calls.append("subject") or doc["subject"],
+			"duration": lambda doc: calls.append("duration") or 30
+		}
+		text = "Rappel: {{ subject }}"
+
+		self.assertEqual(sms_templates.get_variables(text), {"subject"})
+		context = sms_templates.build_context(
+			sms_templates.select_builders(builders, sms_templates.get_variables(text)), {"subject": "Livraison"}
+		)
+
+		self.assertEqual(context, {"subject": "Livraison"})
+		self.assertEqual(calls, ["subject"])
+
+	def test_sandbox_blocks_internal_attributes(self):
+		"""Les templates n'accèdent pas aux attributs internes Python"""
+		with self.assertRaises(SecurityError):
+			sms_templates.render("{{ customer_name.__class__.__mro__[1].__subclasses__() }}", {"customer_name": "Alice"})
+
+	def test_render_budget(self):
+		"""Un template trop long ou trop lent est interrompu"""
+		with self.assertRaises(sms_templates.TemplateBudgetExceeded):
+			sms_templates.render("{% for i in range(100000) %}{{ customer_name }}{% endfor %}", {"customer_name": "Alice"})
+
+		with self.assertRaises(sms_templates.TemplateBudgetExceeded):
+			sms_templates.render("{{ customer_name * 100000 }}", {"customer_name": "Alice"})
+
+		with self.assertRaises(sms_templates.TemplateBudgetExceeded):
+			sms_templates._render_budgeted(
+				sms_templates.get_template("{% for i in range(100000) %}{% for j in range(100000) %}{% endfor %}{% endfor %}"),
+				{}, time_limit=0.01
+			)
+
+	def test_render_budget_empty_loops(self):
+		"""Des boucles imbriquées au corps vide sont interrompues dans le budget de temps"""
+		text = "{% for a in s %}{% for b in s %}{% for c in s %}{% endfor %}{% endfor %}{% endfor %}"
+
+		started = time.monotonic()
+		with self.assertRaises(sms_templates.TemplateBudgetExceeded):
+			sms_templates.render(text, {"s": "x" * 1500})
+
+		self.assertLess(time.monotonic() - started, sms_templates.RENDER_TIME_LIMIT + 1)
+
+	def test_render_budget_concatenation(self):
+		"""Les chaînes construites par ~ ou + (même sans les afficher) sont bornées"""
+		for operator in ("~", "+"):
+			with self.assertRaises(sms_templates.TemplateBudgetExceeded):
+				sms_templates.render(
+					"{% set ns = namespace(text='ab') %}{% for i in range(40) %}"
+					"{% set ns.text = ns.text " + operator + " ns.text %}{% endfor %}", {}
+				)
+
+		self.assertEqual(
+			sms_templates.render("{{ prenom ~ ' ' ~ nom }} {{ 1 + 2 }}{% for i in [1, 2] %} {{ loop.index }}{% endfor %}",
+				{"prenom": "Alice", "nom": "Martin"}),
+			"Alice Martin 3 1 2"
+		)
+
+	def test_validate_template_rejects_slow_loops(self):
+		"""À l'enregistrement, un template à boucles pathologiques est refusé sans bloquer la requête"""
+		text = "{% for a in s %}{% for b in s %}{% for c in s %}{% endfor %}{% endfor %}{% endfor %}"
+
+		with patch.object(sms_templates, "frappe") as mock_frappe:
+			mock_frappe.throw.side_effect = Exception
+			with self.assertRaises(Exception):
+				sms_templates.validate_template(text, {"s": "x" * 1500})
+
+		self.assertIn("refusé", mock_frappe.throw.call_args.args[0])
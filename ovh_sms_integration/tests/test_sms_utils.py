@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import unittest
+from unittest.mock import patch, MagicMock
+
+from ovh_sms_integration.utils import sms_utils
+from ovh_sms_integration.utils.priority_lanes import LANE_TRANSACTIONAL
+
+OUTBOX = "ovh_sms_integration.ovh_sms_integration.doctype.sms_outbox.sms_outbox"
+
+
+def make_doc(**fields):
+	"""Document soumis (Sales Order) dont seuls `fields` sont renseignés"""
+	doc = MagicMock(doctype="Sales Order")
+	doc.name = "SO-0001"
+	doc.get.side_effect = fields.get
+	return doc
+
+
+@patch(OUTBOX + ".start_dispatchers")
+@patch(OUTBOX + ".frappe")
+@patch("ovh_sms_integration.utils.sms_utils.frappe")
+class TestQueueDocumentSMS(unittest.TestCase):
+
+	def test_outbox_row_for_document(self, mock_frappe, mock_outbox_frappe, mock_start):
+		"""Ligne d'outbox: message rendu, numéro E.164, voie transactionnelle et document d'origine"""
+		mock_frappe.get_single.return_value = MagicMock(enabled=True)
+		mock_outbox_frappe.get_doc.return_value.insert.return_value.name = "OB1"
+
+		result = sms_utils.queue_document_sms(
+			make_doc(contact_mobile="06 12 34 56 78"),
+			"Commande {{ name }} de {{ customer }}: {{ grand_total }} {{ currency }}",
+			{"name": "SO-0001", "customer": "Alice", "grand_total": 120.5, "currency": "EUR"}
+		)
+
+		self.assertEqual((result["success"], result["outbox"]), (True, "OB1"))
+		self.assertEqual(mock_outbox_frappe.get_doc.call_args.args[0], {
+			"doctype": "SMS Outbox",
+			"receiver": "+33612345678",
+			"message": "Commande SO-0001 de Alice: 120.5 EUR",
+			"sender": None,
+			"lane": LANE_TRANSACTIONAL,
+			"reference_doctype": "Sales Order",
+			"reference_name": "SO-0001"
+		})
+		mock_start.assert_called_once_with()
+
+	def test_nothing_queued_without_template_or_mobile(self, mock_frappe, mock_outbox_frappe, mock_start):
+		"""Pas de template ou pas de mobile: aucun SMS, aucune requête"""
+		self.assertIsNone(sms_utils.queue_document_sms(make_doc(contact_mobile="0612345678"), "", {"name": "SO-0001"}))
+		self.assertIsNone(sms_utils.queue_document_sms(make_doc(), "Commande {{ name }}", {"name": "SO-0001"}))
+
+		mock_outbox_frappe.get_doc.assert_not_called()
+
+	def test_invalid_mobile_never_raises(self, mock_frappe, mock_outbox_frappe, mock_start):
+		"""Numéro invalide: erreur journalisée, la soumission du document n'est pas interrompue"""
+		mock_frappe.get_single.return_value = MagicMock(enabled=True)
+
+		self.assertIsNone(sms_utils.queue_document_sms(make_doc(mobile_no="12"), "Commande {{ name }}", {"name": "SO-0001"}))
+
+		mock_outbox_frappe.get_doc.assert_not_called()
+		mock_frappe.log_error.assert_called_once()
+
+
+if __name__ == '__main__':
+	unittest.main()
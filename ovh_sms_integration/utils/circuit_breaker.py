@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Disjoncteur (circuit breaker) partagé autour de l'API OVH
+États: fermé (normal), ouvert (échec immédiat), semi-ouvert (une sonde autorisée)
+L'état est stocké dans Redis (frappe.cache) pour être commun à tous les workers
+"""
+
+from __future__ import unicode_literals
+import json
+import time
+import frappe
+from frappe.utils import cint, flt
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+DEFAULT_FAILURE_THRESHOLD = 5  # Échecs consécutifs avant ouverture
+DEFAULT_RESET_TIMEOUT = 60  # Secondes avant d'autoriser une sonde
+MAX_TRANSITIONS = 20  # Historique conservé pour le health check
+
+BREAKER_PREFIX = "ovh_sms:circuit:"
+
+
+class CircuitOpenError(Exception):
+	"""Le disjoncteur est ouvert: l'appel OVH n'est pas tenté"""
+	pass
+
+
+class CircuitBreaker(object):
+	"""Machine à états fermé / ouvert / semi-ouvert partagée entre workers"""
+
+	def __init__(self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+		self.name = name
+		self.failure_threshold = max(1, failure_threshold)
+		self.reset_timeout = reset_timeout
+
+	def _key(self, suffix):
+		return frappe.cache().make_key(f"{BREAKER_PREFIX}{self.name}:{suffix}")
+
+	def _list_name(self):
+		return f"{BREAKER_PREFIX}{self.name}:transitions"
+
+	def get_state(self):
+		"""Retourne l'état courant (l'ouverture expirée devient semi-ouverte)"""
+		cache = frappe.cache()
+		state = (cache.get(self._key("state")) or b"").decode() or STATE_CLOSED
+
+		if state == STATE_OPEN:
+			opened_at = flt(cache.get(self._key("opened_at")))
+			if time.time() - opened_at >= self.reset_timeout:
+				return STATE_HALF_OPEN
+
+		return state
+
+	def before_call(self):
+		"""Vérifie qu'un appel peut être tenté, lève CircuitOpenError sinon"""
+		state = self.get_state()
+
+		if state == STATE_CLOSED:
+			return
+
+		if state == STATE_HALF_OPEN:
+			# Une seule sonde à la fois, tous workers confondus
+			if frappe.cache().set(self._key("probe"), 1, nx=True, ex=max(1, cint(self.reset_timeout))):
+				self._transition(STATE_HALF_OPEN, "sonde autorisée")
+				return
+
+		raise CircuitOpenError(f"API OVH indisponible (disjoncteur ouvert pour {self.name})")
+
+	def record_success(self):
+		"""Un appel a réussi: referme le circuit"""
+		cache = frappe.cache()
+		cache.delete(self._key("failures"))
+
+		if self.get_state() != STATE_CLOSED:
+			cache.delete(self._key("probe"))
+			cache.delete(self._key("opened_at"))
+			self._transition(STATE_CLOSED, "appel réussi")
+
+	def record_failure(self, reason=""):
+		"""Un appel a échoué côté fournisseur: ouvre le circuit au-delà du seuil"""
+		cache = frappe.cache()
+		state = self.get_state()
+		failures = cache.incr(self._key("failures"))
+
+		if state == STATE_HALF_OPEN or (state == STATE_CLOSED and failures >= self.failure_threshold):
+			cache.set(self._key("opened_at"), time.time())
+			cache.delete(self._key("probe"))
+			self._transition(STATE_OPEN, reason or f"{failures} échecs consécutifs")
+
+	def reset(self):
+		"""Referme manuellement le circuit"""
+		cache = frappe.cache()
+		for suffix in ("failures", "opened_at", "probe"):
+			cache.delete(self._key(suffix))
+		self._transition(STATE_CLOSED, "réinitialisation manuelle")
+
+	def _transition(self, state, reason):
+		"""Enregistre un changement d'état et l'historique associé"""
+		cache = frappe.cache()
+		previous = (cache.get(self._key("state")) or b"").decode() or STATE_CLOSED
+		cache.set(self._key("state"), state)
+
+		if previous == state:
+			return
+
+		entry = json.dumps({
+			"from": previous,
+			"to": state,
+			"reason": reason,
+			"at": time.strftime("%Y-%m-%d %H:%M:%S")
+		})
+		# lpush/ltrim/lrange de frappe.cache préfixent eux-mêmes la clé
+		cache.lpush(self._list_name(), entry)
+		cache.ltrim(self._list_name(), 0, MAX_TRANSITIONS - 1)
+
+		log = frappe.logger().warning if state == STATE_OPEN else frappe.logger().info
+		log(f"Disjoncteur OVH {self.name}: {previous} -> {state} ({reason})")
+
+	def get_transitions(self):
+		"""Retourne l'historique récent des changements d'état (plus récent en premier)"""
+		entries = frappe.cache().lrange(self._list_name(), 0, MAX_TRANSITIONS - 1) or []
+		return [json.loads(entry) for entry in entries]
+
+	def get_status(self):
+		"""Résumé de l'état pour le health check"""
+		return {
+			"name": self.name,
+			"state": self.get_state(),
+			"failures": cint(frappe.cache().get(self._key("failures"))),
+			"transitions": self.get_transitions()
+		}
+
+
+def get_circuit_breaker(name, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+	"""Retourne le disjoncteur partagé d'un endpoint OVH"""
+	return CircuitBreaker(name, failure_threshold or DEFAULT_FAILURE_THRESHOLD, reset_timeout or DEFAULT_RESET_TIMEOUT)
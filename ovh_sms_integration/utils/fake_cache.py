@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+frappe.cache() en mémoire pour les tests unitaires (cache service, limiteur de débit, disjoncteur)
+Aucun Redis requis: seules les commandes utilisées par l'application sont imitées.
+"""
+
+from __future__ import unicode_literals
+
+
+class FakeCache(object):
+	"""frappe.cache() en mémoire: sous-ensemble des commandes Redis utilisées par l'application"""
+
+	def __init__(self):
+		self.data = {}
+
+	def make_key(self, key):
+		return "site|" + key
+
+	# API valeur de frappe (sérialisée, clé préfixée par le cache lui-même)
+	def get_value(self, key):
+		return self.data.get(self.make_key(key))
+
+	def set_value(self, key, value, expires_in_sec=None):
+		self.data[self.make_key(key)] = value
+
+	def delete_value(self, key):
+		self.data.pop(self.make_key(key), None)
+
+	def delete_keys(self, prefix):
+		for key in [key for key in self.data if key.startswith(self.make_key(prefix))]:
+			del self.data[key]
+
+	# Commandes Redis brutes (clé déjà construite par make_key, valeurs en bytes)
+	def get(self, key):
+		value = self.data.get(key)
+		return None if value is None else str(value).encode()
+
+	def set(self, key, value, nx=False, ex=None):
+		if nx and key in self.data:
+			return None
+		self.data[key] = value
+		return True
+
+	def incr(self, key):
+		self.data[key] = int(self.data.get(key) or 0) + 1
+		return self.data[key]
+
+	def delete(self, key):
+		self.data.pop(key, None)
+
+	# Listes: frappe.cache préfixe lui-même la clé
+	def lpush(self, key, value):
+		self.data.setdefault(self.make_key(key), []).insert(0, value)
+
+	def ltrim(self, key, start, end):
+		key = self.make_key(key)
+		self.data[key] = self.data.get(key, [])[start:end + 1]
+
+	def lrange(self, key, start, end):
+		return self.data.get(self.make_key(key), [])[start:end + 1]
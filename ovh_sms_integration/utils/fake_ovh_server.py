@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+Serveur local imitant l'API OVH SMS, pour les tests de charge et benchmarks hors ligne
+(aucun crédit consommé, aucune limite OVH)
+
+Usage:
+	python -m ovh_sms_integration.utils.fake_ovh_server --port 8089 --latency lognormal:40,0.5 \
+		--error-rate 0.01 --rate-limit 50 --verify-signature
+
+Puis pointer l'intégration dessus, soit via le champ "Endpoint API" de OVH SMS Settings,
+soit via la variable d'environnement OVH_SMS_API_ENDPOINT=http://127.0.0.1:8089/1.0
+
+Aucune dépendance à frappe: le module tourne dans un simple interpréteur Python.
+"""
+
+from __future__ import unicode_literals
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+API_PREFIX = "/1.0"
+MAX_TIMESTAMP_DRIFT = 180  # Secondes tolérées entre l'horodatage signé et l'horloge du serveur
+RECEIVER_PATTERN = re.compile(r'^(\+|00)\d{8,15}$')
+
+
+class Latency(object):
+	"""Distribution de latence (millisecondes), décrite par "type:paramètres"
+
+	fixed:50 | uniform:20,80 | normal:50,10 | lognormal:40,0.5 | exponential:50
+	"""
+
+	def __init__(self, spec="fixed:0"):
+		kind, _, params = spec.partition(":")
+		self.kind = kind
+		self.params = [float(p) for p in params.split(",") if p]
+
+		samplers = {
+			"fixed": lambda p: p[0],
+			"uniform": lambda p: random.uniform(p[0], p[1]),
+			"normal": lambda p: random.gauss(p[0], p[1]),
+			# Paramètres: médiane (ms) et sigma, forme typique des latences réseau
+			"lognormal": lambda p: p[0] * random.lognormvariate(0, p[1]),
+			"exponential": lambda p: random.expovariate(1.0 / p[0]),
+		}
+		if kind not in samplers:
+			raise ValueError(f"Distribution de latence inconnue: {kind}")
+		self._sampler = samplers[kind]
+
+	def sample(self):
+		"""Tire une latence en secondes"""
+		return max(0.0, self._sampler(self.params)) / 1000.0
+
+
+class FakeOVHState(object):
+	"""Configuration et état partagés par les requêtes du serveur"""
+
+	def __init__(self, latency="fixed:0", error_rate=0.0, rate_limit=0, verify_signature=False,
+			application_key="fake_app_key", application_secret="fake_app_secret",
+			consumer_key="fake_consumer_key", service_name="sms-fake-1", senders=("ERPNext",),
+			clock_offset=0, credits=100000.0):
+		self.latency = Latency(latency)
+		self.error_rate = error_rate
+		self.rate_limit = rate_limit  # Requêtes/seconde au-delà desquelles OVH répond 429
+		self.verify_signature = verify_signature
+		self.application_key = application_key
+		self.application_secret = application_secret
+		self.consumer_key = consumer_key
+		self.service_name = service_name
+		self.senders = list(senders)
+		self.clock_offset = clock_offset
+		self.credits = credits
+
+		self.lock = threading.Lock()
+		self.next_id = 1
+		self.stats = {"requests": 0, "jobs": 0, "sms": 0, "throttled": 0, "errors": 0, "rejected": 0}
+		self._tokens = float(rate_limit)
+		self._tokens_at = time.monotonic()
+
+	def now(self):
+		"""Horloge du serveur (décalable pour simuler une dérive côté client)"""
+		return int(time.time()) + self.clock_offset
+
+	def count(self, metric, value=1):
+		with self.lock:
+			self.stats[metric] += value
+
+	def take_token(self):
+		"""Seau à jetons du serveur: False si la requête doit être refusée en 429"""
+		if not self.rate_limit:
+			return True
+
+		with self.lock:
+			now = time.monotonic()
+			self._tokens = min(self.rate_limit, self._tokens + (now - self._tokens_at) * self.rate_limit)
+			self._tokens_at = now
+			if self._tokens < 1:
+				return False
+			self._tokens -= 1
+			return True
+
+	def allocate_ids(self, count):
+		with self.lock:
+			ids = list(range(self.next_id, self.next_id + count))
+			self.next_id += count
+			self.credits -= count
+		return ids
+
+
+class FakeOVHHandler(BaseHTTPRequestHandler):
+	"""Implémente le sous-ensemble de l'API OVH utilisé par l'intégration"""
+
+	server_version = "FakeOVH/1.0"
+	protocol_version = "HTTP/1.1"  # Keep-alive, comme l'API réelle
+
+	@property
+	def state(self):
+		return self.server.state
+
+	def log_message(self, format, *args):
+		# Silencieux: un benchmark ne doit pas être ralenti par les journaux
+		pass
+
+	def do_GET(self):
+		self._handle("GET")
+
+	def do_POST(self):
+		self._handle("POST")
+
+	def _handle(self, method):
+		state = self.state
+		state.count("requests")
+
+		length = int(self.headers.get("Content-Length") or 0)
+		body = self.rfile.read(length).decode("utf-8") if length else ""
+
+		time.sleep(state.latency.sample())
+
+		path = self.path.split("?", 1)[0]
+		if path.startswith(API_PREFIX):
+			path = path[len(API_PREFIX):]
+
+		if path == "/_stats":
+			return self._reply(200, dict(state.stats, credits=state.credits))
+
+		if path == "/auth/time":
+			return self._reply(200, state.now())
+
+		if not state.take_token():
+			state.count("throttled")
+			return self._reply(429, {"message": "Too many requests"}, {"Retry-After": "1"})
+
+		if state.error_rate and random.random() < state.error_rate:
+			state.count("errors")
+			return self._reply(random.choice((500, 502, 503)), {"message": "Internal server error"})
+
+		error = self._check_signature(method, body)
+		if error:
+			state.count("rejected")
+			return self._reply(*error)
+
+		route = self._route(method, path)
+		if not route:
+			return self._reply(404, {"message": f"The requested object ({path}) does not exist"})
+
+		handler, args = route
+		return handler(json.loads(body) if body else {}, *args)
+
+	def _route(self, method, path):
+		service = re.escape(self.state.service_name)
+		routes = (
+			("GET", r"^/me$", self._get_me),
+			("GET", r"^/sms$", self._get_services),
+			("GET", rf"^/sms/({service})$", self._get_service),
+			("GET", rf"^/sms/({service})/senders$", self._get_senders),
+			("POST", rf"^/sms/({service})/senders$", self._create_sender),
+			("POST", rf"^/sms/({service})/jobs$", self._create_job),
+		)
+		for route_method, pattern, handler in routes:
+			match = re.match(pattern, path)
+			if route_method == method and match:
+				return handler, match.groups()
+		return None
+
+	def _check_signature(self, method, body):
+		"""Vérifie les en-têtes X-Ovh-* comme l'API réelle; retourne (statut, corps) en cas de refus"""
+		state = self.state
+		if not state.verify_signature:
+			return None
+
+		headers = self.headers
+		if headers.get("X-Ovh-Application") != state.application_key:
+			return 403, {"message": "Invalid application key"}
+		if headers.get("X-Ovh-Consumer") != state.consumer_key:
+			return 403, {"message": "Invalid credential"}
+
+		try:
+			timestamp = int(headers.get("X-Ovh-Timestamp") or "")
+		except ValueError:
+			return 400, {"message": "Invalid timestamp"}
+		if abs(timestamp - state.now()) > MAX_TIMESTAMP_DRIFT:
+			return 400, {"message": "Query out of time"}
+
+		# L'URL signée par le client est l'URL complète, hôte compris
+		url = f"http://{headers.get('Host')}{self.path}"
+		pre_hash = f"{state.application_secret}+{state.consumer_key}+{method}+{url}+{body}+{timestamp}"
+		if headers.get("X-Ovh-Signature") != "$1$" + hashlib.sha1(pre_hash.encode("utf-8")).hexdigest():
+			return 400, {"message": "Invalid signature"}
+
+		return None
+
+	def _get_me(self, data):
+		return self._reply(200, {"nichandle": "fk12345-ovh", "email": "fake@example.com"})
+
+	def _get_services(self, data):
+		return self._reply(200, [self.state.service_name])
+
+	def _get_service(self, data, service):
+		return self._reply(200, {
+			"name": service,
+			"status": "enable",
+			"creditsLeft": self.state.credits,
+			"description": "Service SMS simulé"
+		})
+
+	def _get_senders(self, data, service):
+		return self._reply(200, list(self.state.senders))
+
+	def _create_sender(self, data, service):
+		sender = data.get("sender")
+		if not sender:
+			return self._reply(400, {"message": "Missing parameter sender"})
+		with self.state.lock:
+			if sender not in self.state.senders:
+				self.state.senders.append(sender)
+		return self._reply(200, {})
+
+	def _create_job(self, data, service):
+		receivers = data.get("receivers") or []
+		if not data.get("message") or not receivers:
+			return self._reply(400, {"message": "Missing parameter message or receivers"})
+		if data.get("sender") and data["sender"] not in self.state.senders:
+			return self._reply(400, {"message": f"The sender {data['sender']} does not exist"})
+
+		valid = [r for r in receivers if RECEIVER_PATTERN.match(str(r))]
+		invalid = [r for r in receivers if r not in valid]
+		ids = self.state.allocate_ids(len(valid))
+
+		self.state.count("jobs")
+		self.state.count("sms", len(valid))
+
+		return self._reply(200, {
+			"ids": ids,
+			"validReceivers": valid,
+			"invalidReceivers": invalid,
+			"totalCreditsRemoved": len(valid),
+			"tag": data.get("tag") or ""
+		})
+
+	def _reply(self, status, payload, headers=None):
+		content = json.dumps(payload).encode("utf-8")
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json; charset=utf-8")
+		self.send_header("Content-Length", str(len(content)))
+		for name, value in (headers or {}).items():
+			self.send_header(name, value)
+		self.end_headers()
+		self.wfile.write(content)
+
+
+def start_server(host="127.0.0.1", port=0, **options):
+	"""Démarre le serveur dans un thread; retourne (serveur, endpoint à configurer)
+
+	Arrêt: server.shutdown() puis server.server_close()
+	"""
+	server = ThreadingHTTPServer((host, port), FakeOVHHandler)
+	server.daemon_threads = True
+	server.state = FakeOVHState(**options)
+
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+
+	return server, f"http://{host}:{server.server_address[1]}{API_PREFIX}"
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Serveur local imitant l'API OVH SMS")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8089)
+	parser.add_argument("--latency", default="fixed:0", help="fixed:ms, uniform:min,max, normal:mean,sd, lognormal:median,sigma, exponential:mean")
+	parser.add_argument("--error-rate", type=float, default=0.0, help="Proportion de réponses 5xx (0 à 1)")
+	parser.add_argument("--rate-limit", type=float, default=0, help="Requêtes/seconde avant réponse 429 (0 = illimité)")
+	parser.add_argument("--verify-signature", action="store_true", help="Refuse les requêtes mal signées")
+	parser.add_argument("--application-key", default="fake_app_key")
+	parser.add_argument("--application-secret", default="fake_app_secret")
+	parser.add_argument("--consumer-key", default="fake_consumer_key")
+	parser.add_argument("--service-name", default="sms-fake-1")
+	parser.add_argument("--sender", action="append", dest="senders", help="Expéditeur disponible (répétable)")
+	parser.add_argument("--clock-offset", type=int, default=0, help="Décalage (s) de l'horloge du serveur")
+	args = parser.parse_args()
+
+	server = ThreadingHTTPServer((args.host, args.port), FakeOVHHandler)
+	server.daemon_threads = True
+	server.state = FakeOVHState(
+		latency=args.latency,
+		error_rate=args.error_rate,
+		rate_limit=args.rate_limit,
+		verify_signature=args.verify_signature,
+		application_key=args.application_key,
+		application_secret=args.application_secret,
+		consumer_key=args.consumer_key,
+		service_name=args.service_name,
+		senders=args.senders or ("ERPNext",),
+		clock_offset=args.clock_offset
+	)
+
+	print(f"Faux serveur OVH sur http://{args.host}:{args.port}{API_PREFIX} (statistiques: {API_PREFIX}/_stats)")
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Envoi concurrent de requêtes OVH (asyncio)
+N requêtes en vol sur la session poolée (keep-alive) du client partagé, sous le
+limiteur de débit. Seul l'appel HTTP s'exécute dans un thread: limiteur, disjoncteur
+et journaux restent dans le thread appelant, jamais d'accès base depuis un thread.
+"""
+
+from __future__ import unicode_literals
+import asyncio
+import concurrent.futures
+import contextvars
+import json
+import time
+
+import requests
+
+from ovh_sms_integration.utils.ovh_client import (
+	DEFAULT_TIMEOUT, NO_RETRY, is_clock_error, record_call_outcome, retry_delay
+)
+from ovh_sms_integration.utils.rate_limiter import RateLimitExceeded
+
+DEFAULT_CONCURRENCY = 8
+
+
+class AsyncOVHSender(object):
+	"""Exécute des requêtes OVH signées en parallèle, avec une concurrence bornée"""
+
+	def __init__(self, client, credentials, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT,
+			retry_policy=None, circuit_breaker=None, rate_limiter=None, rate_limit_timeout=None, rate_limit_wait=False):
+		self.client = client
+		self.credentials = credentials
+		self.concurrency = max(1, concurrency or DEFAULT_CONCURRENCY)
+		self.timeout = timeout
+		self.retry_policy = retry_policy or NO_RETRY
+		self.circuit_breaker = circuit_breaker
+		self.rate_limiter = rate_limiter
+		self.rate_limit_timeout = rate_limit_timeout
+		# Jobs d'arrière-plan: attente du débit sans limite (un envoi freiné n'échoue pas)
+		self.rate_limit_wait = rate_limit_wait
+
+	async def send_many(self, calls):
+		"""Exécute une liste de (méthode, chemin, données)
+
+		Retourne, dans l'ordre d'entrée, la réponse JSON ou l'exception levée pour chaque appel.
+		"""
+		semaphore = asyncio.Semaphore(self.concurrency)
+
+		async def run(method, path, data):
+			async with semaphore:
+				try:
+					return await self.request(method, path, data)
+				except Exception as e:
+					return e
+
+		return await asyncio.gather(*(run(*call) for call in calls))
+
+	async def request(self, method, path, data=None):
+		"""Équivalent asynchrone de OVHClient.request"""
+		await self._acquire_slot()
+
+		if self.circuit_breaker:
+			self.circuit_breaker.before_call()
+
+		try:
+			result = await self._request_with_retries(method, path, data)
+		except requests.exceptions.RequestException as e:
+			record_call_outcome(self.circuit_breaker, method, path, e)
+			raise
+
+		record_call_outcome(self.circuit_breaker, method, path)
+
+		return result
+
+	async def _acquire_slot(self):
+		"""Attend un jeton du limiteur partagé sans bloquer les autres envois"""
+		if not self.rate_limiter:
+			return
+
+		if self.rate_limit_wait:
+			await self.rate_limiter.acquire_async(blocking=True, timeout=None)
+			return
+
+		timeout = self.rate_limit_timeout or 0
+		if not await self.rate_limiter.acquire_async(blocking=timeout > 0, timeout=timeout):
+			raise RateLimitExceeded(f"Limite d'envois atteinte pour {self.rate_limiter.name}")
+
+	async def _request_with_retries(self, method, path, data):
+		"""Boucle de tentatives (mêmes règles que le client synchrone, attentes non bloquantes)"""
+		url = self.client.build_url(path)
+		body = json.dumps(data, separators=(',', ':')) if data is not None else ""
+		policy = self.retry_policy
+		started = time.monotonic()
+		attempt = 0
+		resynced = False
+
+		while True:
+			attempt_timeout = self.timeout
+			if policy.deadline:
+				remaining = policy.deadline - (time.monotonic() - started)
+				attempt_timeout = max(1, min(self.timeout, remaining))
+
+			# Horodatage calculé ici: le thread ne fait que l'appel HTTP
+			timestamp = self.client.get_timestamp()
+
+			try:
+				return await asyncio.to_thread(
+					self.client._send, method, url, body, self.credentials, attempt_timeout, timestamp
+				)
+
+			except requests.exceptions.RequestException as e:
+				if not resynced and is_clock_error(e):
+					self.client.invalidate_time_delta()
+					resynced = True
+					continue
+
+				delay = retry_delay(policy, e, method, path, attempt, started)
+				if delay is None:
+					raise
+
+				await asyncio.sleep(delay)
+				attempt += 1
+
+
+def run_sync(coroutine):
+	"""Exécute une coroutine depuis du code synchrone (job d'arrière-plan, méthode de doctype)"""
+	try:
+		asyncio.get_running_loop()
+	except RuntimeError:
+		return asyncio.run(coroutine)
+
+	# Une boucle tourne déjà dans ce thread: exécution dans un thread dédié, même contexte
+	context = contextvars.copy_context()
+	with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+		return executor.submit(context.run, asyncio.run, coroutine).result()
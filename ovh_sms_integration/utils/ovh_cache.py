@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Cache partagé (Redis via frappe.cache) des réponses OVH peu volatiles:
+nom du service SMS et liste des expéditeurs
+"""
+
+from __future__ import unicode_literals
+import frappe
+from frappe.utils import cint
+
+DEFAULT_TTL = 3600  # 1 heure
+CACHE_PREFIX = "ovh_sms:api_cache:"
+STATS_PREFIX = "ovh_sms:cache_stats:"
+STAT_KINDS = ("hits", "misses")
+
+
+def get_or_load(name, loader, ttl=DEFAULT_TTL):
+	"""Retourne la valeur en cache ou l'obtient via loader() puis la met en cache"""
+	cache = frappe.cache()
+	value = cache.get_value(CACHE_PREFIX + name)
+
+	if value is not None:
+		_count(name, "hits")
+		return value
+
+	_count(name, "misses")
+	value = loader()
+
+	# On ne met jamais en cache une absence de valeur
+	if value is not None and ttl and ttl > 0:
+		cache.set_value(CACHE_PREFIX + name, value, expires_in_sec=ttl)
+
+	return value
+
+
+def invalidate(*names):
+	"""Invalide des entrées précises, ou tout le cache API si aucun nom n'est donné"""
+	cache = frappe.cache()
+
+	if not names:
+		cache.delete_keys(CACHE_PREFIX)
+		return
+
+	for name in names:
+		cache.delete_value(CACHE_PREFIX + name)
+
+
+def _count(name, kind):
+	"""Incrémente un compteur de hit/miss (partagé entre workers)"""
+	try:
+		cache = frappe.cache()
+		cache.incr(cache.make_key(f"{STATS_PREFIX}{_stat_group(name)}:{kind}"))
+	except Exception:
+		# Les statistiques ne doivent jamais casser un envoi
+		pass
+
+
+def _stat_group(name):
+	"""Regroupe les entrées paramétrées (ex: senders:sms-xx-1 -> senders)"""
+	return name.split(":", 1)[0]
+
+
+def get_cache_stats(groups=("service_name", "senders")):
+	"""Retourne les compteurs hit/miss par type d'entrée"""
+	cache = frappe.cache()
+	stats = {}
+
+	for group in groups:
+		counters = {}
+		for kind in STAT_KINDS:
+			counters[kind] = cint(cache.get(cache.make_key(f"{STATS_PREFIX}{group}:{kind}")))
+
+		total = counters["hits"] + counters["misses"]
+		counters["hit_rate"] = round(counters["hits"] * 100.0 / total, 1) if total else 0
+		stats[group] = counters
+
+	return stats
+
+
+def reset_cache_stats(groups=("service_name", "senders")):
+	"""Remet à zéro les compteurs hit/miss"""
+	cache = frappe.cache()
+	for group in groups:
+		for kind in STAT_KINDS:
+			cache.delete(cache.make_key(f"{STATS_PREFIX}{group}:{kind}"))
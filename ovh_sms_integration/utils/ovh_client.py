@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""
+Client HTTP partagé pour l'API OVH
+Une session requests poolée (keep-alive) par processus worker, réutilisée par
+toutes les méthodes de OVH SMS Settings
+"""
+
+from __future__ import unicode_literals
+import email.utils
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+import frappe
+import requests
+from requests.adapters import HTTPAdapter
+
+OVH_API_ENDPOINT = "https://eu.api.ovh.com/1.0"
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 30
+DEFAULT_MAX_RETRIES = 3
+
+# Statuts HTTP transitoires: la requête peut être rejouée
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+# Un POST (création de job = SMS facturé) n'est rejoué que si OVH ne l'a pas traité
+POST_RETRYABLE_STATUS = (429, 502, 503, 504)
+
+# Écart d'horloge avec OVH: resynchronisé toutes les heures (1 min après un échec)
+TIME_DELTA_TTL = 3600
+TIME_DELTA_RETRY = 60
+# Messages OVH signalant un horodatage rejeté
+CLOCK_ERROR_MARKERS = ("out of time", "timestamp")
+
+# Clients partagés du processus, indexés par (endpoint, taille du pool, keep-alive)
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Identifiants déchiffrés du processus, indexés par version des paramètres
+_credentials = {}
+_credentials_lock = threading.Lock()
+
+
+class OVHCredentials(object):
+	"""Identifiants OVH déchiffrés, utilisés pour signer les requêtes"""
+
+	def __init__(self, application_key, application_secret, consumer_key):
+		self.application_key = application_key
+		self.application_secret = application_secret
+		self.consumer_key = consumer_key
+
+	def sign(self, method, url, body, timestamp):
+		"""Calcule la signature OVH selon la documentation ($1$ + SHA1)"""
+		pre_hash = f"{self.application_secret}+{self.consumer_key}+{method}+{url}+{body}+{timestamp}"
+		return "$1$" + hashlib.sha1(pre_hash.encode('utf-8')).hexdigest()
+
+
+def get_cached_credentials(version, loader):
+	"""Retourne les identifiants déchiffrés pour cette version des paramètres
+
+	loader() n'est appelé (lecture base + déchiffrement) qu'au changement de version.
+	"""
+	credentials = _credentials.get(version)
+	if credentials:
+		return credentials
+
+	with _credentials_lock:
+		credentials = _credentials.get(version)
+		if not credentials:
+			credentials = loader()
+			# Une seule version conservée: les anciens secrets sont oubliés
+			_credentials.clear()
+			_credentials[version] = credentials
+
+	return credentials
+
+
+def clear_cached_credentials():
+	"""Oublie les identifiants déchiffrés du processus"""
+	_credentials.clear()
+
+
+def classify_error(exc, method="GET"):
+	"""Classe une erreur d'appel OVH
+
+	Retourne (classe d'erreur, statut HTTP ou None, rejouable)
+	"""
+	if isinstance(exc, requests.exceptions.ConnectTimeout):
+		# La connexion n'a pas abouti: la requête n'a jamais été reçue
+		return "connect_timeout", None, True
+
+	if isinstance(exc, requests.exceptions.Timeout):
+		# Réponse trop lente: un POST a pu être traité, ne pas risquer un doublon
+		return "read_timeout", None, method != "POST"
+
+	if isinstance(exc, requests.exceptions.ConnectionError):
+		return "connection_error", None, method != "POST"
+
+	if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+		status = exc.response.status_code
+		retryable_status = POST_RETRYABLE_STATUS if method == "POST" else RETRYABLE_STATUS
+
+		if status == 429:
+			return "rate_limited", status, True
+		if status >= 500:
+			return "server_error", status, status in retryable_status
+		return "client_error", status, False
+
+	return "unexpected_error", None, False
+
+
+def is_clock_error(exc):
+	"""Vrai si OVH a rejeté la requête à cause de l'horodatage de la signature"""
+	response = getattr(exc, "response", None)
+	if response is None or response.status_code not in (400, 401, 403):
+		return False
+
+	text = (response.text or "").lower()
+	return any(marker in text for marker in CLOCK_ERROR_MARKERS)
+
+
+def parse_retry_after(response):
+	"""Retourne le délai demandé par l'en-tête Retry-After (secondes) ou None"""
+	if response is None:
+		return None
+
+	value = response.headers.get("Retry-After")
+	if not value:
+		return None
+
+	try:
+		return max(0.0, float(value))
+	except ValueError:
+		pass
+
+	try:
+		retry_at = email.utils.parsedate_to_datetime(value)
+		return max(0.0, retry_at.timestamp() - time.time())
+	except (TypeError, ValueError):
+		return None
+
+
+class RetryPolicy(object):
+	"""Politique de rejeu: backoff exponentiel avec jitter, plafonné par une échéance globale"""
+
+	def __init__(self, max_retries=DEFAULT_MAX_RETRIES, deadline=None, base_delay=0.5, max_delay=30):
+		self.max_retries = max(0, max_retries or 0)
+		self.deadline = deadline
+		self.base_delay = base_delay
+		self.max_delay = max_delay
+
+	def compute_delay(self, attempt, response=None):
+		"""Délai avant la tentative suivante (attempt commence à 0)"""
+		retry_after = parse_retry_after(response)
+		if retry_after is not None:
+			return retry_after
+
+		# "Full jitter": tirage uniforme sous le plafond exponentiel
+		return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+NO_RETRY = RetryPolicy(max_retries=0)
+
+
+def retry_delay(policy, exc, method, path, attempt, started):
+	"""Délai avant de rejouer une tentative échouée, ou None s'il faut abandonner"""
+	error_class, status, retryable = classify_error(exc, method)
+	if not retryable or attempt >= policy.max_retries:
+		return None
+
+	delay = policy.compute_delay(attempt, getattr(exc, "response", None))
+	elapsed = time.monotonic() - started
+	if policy.deadline and elapsed + delay >= policy.deadline:
+		return None
+
+	frappe.logger().warning(
+		f"OVH {method} {path}: {error_class} ({status or '-'}), "
+		f"tentative {attempt + 2}/{policy.max_retries + 1} dans {delay:.1f}s"
+	)
+	return delay
+
+
+def record_call_outcome(circuit_breaker, method, path, exc=None):
+	"""Reporte le résultat d'un appel (après rejeux) au disjoncteur"""
+	if not circuit_breaker:
+		return
+
+	if exc is None:
+		circuit_breaker.record_success()
+		return
+
+	error_class, status, retryable = classify_error(exc, method)
+	if error_class == "client_error":
+		# L'API répond: nos erreurs 4xx ne traduisent pas une panne OVH
+		circuit_breaker.record_success()
+	elif error_class != "rate_limited":
+		circuit_breaker.record_failure(f"{error_class} ({status or '-'}) sur {method} {path}")
+
+
+class OVHClient(object):
+	"""Client OVH réutilisable: une seule session HTTP poolée par worker"""
+
+	def __init__(self, endpoint=OVH_API_ENDPOINT, pool_size=DEFAULT_POOL_SIZE, keep_alive=True):
+		self.endpoint = endpoint.rstrip('/')
+		self.pool_size = pool_size
+		self.keep_alive = keep_alive
+		self.session = self._build_session()
+		self._time_delta = 0
+		self._time_delta_expires = 0
+		self._time_lock = threading.Lock()
+
+	def _build_session(self):
+		"""Crée la session HTTP avec un pool de connexions dimensionné"""
+		session = requests.Session()
+		adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+		session.mount("https://", adapter)
+		session.mount("http://", adapter)
+
+		if not self.keep_alive:
+			session.headers["Connection"] = "close"
+
+		return session
+
+	def get_time_delta(self):
+		"""Écart (secondes) entre l'horloge OVH et l'horloge locale, mis en cache par processus"""
+		if time.monotonic() < self._time_delta_expires:
+			return self._time_delta
+
+		with self._time_lock:
+			if time.monotonic() < self._time_delta_expires:
+				return self._time_delta
+
+			try:
+				# /auth/time n'est pas authentifié: pas de signature nécessaire
+				response = self.session.get(self.build_url("/auth/time"), timeout=DEFAULT_TIMEOUT)
+				response.raise_for_status()
+				self.set_time_delta(int(response.json()) - int(time.time()))
+			except Exception as e:
+				# On garde le dernier écart connu et on réessaiera plus tard
+				frappe.logger().warning(f"Synchronisation horloge OVH impossible: {e}")
+				self._time_delta_expires = time.monotonic() + TIME_DELTA_RETRY
+
+		return self._time_delta
+
+	def set_time_delta(self, delta, ttl=TIME_DELTA_TTL):
+		"""Fixe l'écart d'horloge pour la durée donnée"""
+		self._time_delta = delta
+		self._time_delta_expires = time.monotonic() + ttl
+
+	def invalidate_time_delta(self):
+		"""Force une resynchronisation au prochain appel"""
+		self._time_delta_expires = 0
+
+	def get_timestamp(self):
+		"""Horodatage à signer, aligné sur l'horloge OVH"""
+		return str(int(time.time()) + self.get_time_delta())
+
+	def build_url(self, path):
+		"""Construit l'URL complète d'un chemin de l'API"""
+		return f"{self.endpoint}/{path.lstrip('/')}"
+
+	def request(self, method, path, credentials, data=None, timeout=DEFAULT_TIMEOUT, retry_policy=None,
+			circuit_breaker=None):
+		"""Exécute une requête signée et retourne la réponse JSON décodée
+
+		Les erreurs transitoires sont rejouées selon retry_policy; chaque tentative
+		est signée à nouveau car l'horodatage fait partie de la signature.
+		Si un circuit_breaker est fourni, l'appel échoue immédiatement tant qu'il est ouvert.
+		"""
+		if circuit_breaker:
+			circuit_breaker.before_call()
+
+		try:
+			result = self._request_with_retries(method, path, credentials, data, timeout, retry_policy or NO_RETRY)
+		except requests.exceptions.RequestException as e:
+			record_call_outcome(circuit_breaker, method, path, e)
+			raise
+
+		record_call_outcome(circuit_breaker, method, path)
+
+		return result
+
+	def _request_with_retries(self, method, path, credentials, data, timeout, policy):
+		"""Boucle de tentatives avec backoff, plafonnée par l'échéance de la politique"""
+		url = self.build_url(path)
+		body = json.dumps(data, separators=(',', ':')) if data is not None else ""
+		started = time.monotonic()
+		attempt = 0
+		resynced = False
+
+		while True:
+			attempt_timeout = timeout
+			if policy.deadline:
+				remaining = policy.deadline - (time.monotonic() - started)
+				attempt_timeout = max(1, min(timeout, remaining))
+
+			try:
+				return self._send(method, url, body, credentials, attempt_timeout)
+
+			except requests.exceptions.RequestException as e:
+				if not resynced and is_clock_error(e):
+					# Horloge locale dérivée: resynchronisation puis nouvelle tentative immédiate
+					frappe.logger().warning(f"OVH {method} {path}: horodatage rejeté, resynchronisation")
+					self.invalidate_time_delta()
+					resynced = True
+					continue
+
+				delay = retry_delay(policy, e, method, path, attempt, started)
+				if delay is None:
+					raise
+
+				time.sleep(delay)
+				attempt += 1
+
+	def _send(self, method, url, body, credentials, timeout, timestamp=None):
+		"""Signe et envoie une tentative unique
+
+		Sans accès base ni cache si timestamp est fourni: utilisable hors du thread principal.
+		"""
+		timestamp = timestamp or self.get_timestamp()
+
+		headers = {
+			"X-Ovh-Application": credentials.application_key,
+			"X-Ovh-Consumer": credentials.consumer_key,
+			"X-Ovh-Signature": credentials.sign(method, url, body, timestamp),
+			"X-Ovh-Timestamp": timestamp
+		}
+		if body:
+			headers["Content-Type"] = "application/json"
+
+		response = self.session.request(method, url, data=body or None, headers=headers, timeout=timeout)
+		response.raise_for_status()
+
+		return response.json()
+
+	def get(self, path, credentials, timeout=DEFAULT_TIMEOUT, retry_policy=None):
+		return self.request("GET", path, credentials, timeout=timeout, retry_policy=retry_policy)
+
+	def post(self, path, credentials, data=None, timeout=DEFAULT_TIMEOUT, retry_policy=None):
+		return self.request("POST", path, credentials, data=data, timeout=timeout, retry_policy=retry_policy)
+
+	def close(self):
+		self.session.close()
+
+
+def get_ovh_client(endpoint=OVH_API_ENDPOINT, pool_size=DEFAULT_POOL_SIZE, keep_alive=True):
+	"""Retourne le client OVH partagé du processus pour cette configuration"""
+	key = (endpoint, pool_size, bool(keep_alive))
+
+	client = _clients.get(key)
+	if client:
+		return client
+
+	with _clients_lock:
+		client = _clients.get(key)
+		if not client:
+			client = OVHClient(endpoint, pool_size, keep_alive)
+			_clients[key] = client
+
+	return client
+
+
+def reset_ovh_clients():
+	"""Ferme et oublie les clients du processus (ex: après un fork)"""
+	for client in list(_clients.values()):
+		try:
+			client.close()
+		except Exception:
+			pass
+	_clients.clear()
+
+
+# Les sockets ne doivent jamais être partagées entre processus parent et enfant
+if hasattr(os, "register_at_fork"):
+	os.register_at_fork(after_in_child=_clients.clear)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Normalisation des numéros de téléphone au format E.164
+Un seul point d'entrée pour l'envoi, les campagnes et les lignes de tarification:
+motifs précompilés, plans de numérotation par pays (indicatif, préfixe national,
+préfixes mobiles) et cache LRU des conversions brut -> E.164. Un même numéro,
+présent dans chaque import de campagne, n'est analysé qu'une fois par process.
+"""
+
+from __future__ import unicode_literals
+import functools
+import re
+
+DEFAULT_COUNTRY = "FR"
+MAX_CACHED_NUMBERS = 65536
+
+# Plans de numérotation: indicatif, préfixe national (trunk) et numéros mobiles
+# (numéro national significatif, sans le préfixe national)
+COUNTRY_PLANS = {
+	"FR": {"code": "33", "trunk": "0", "mobile": r"[67]\d{8}"},
+	"BE": {"code": "32", "trunk": "0", "mobile": r"4[5-9]\d{7}"},
+	"CH": {"code": "41", "trunk": "0", "mobile": r"7[5-9]\d{7}"},
+	"LU": {"code": "352", "trunk": "", "mobile": r"6[269]1\d{6}"},
+	"MC": {"code": "377", "trunk": "", "mobile": r"[46]\d{7,8}"},
+	"RE": {"code": "262", "trunk": "0", "mobile": r"69[2-3]\d{6}"},
+	"GP": {"code": "590", "trunk": "0", "mobile": r"690\d{6}"},
+	"MQ": {"code": "596", "trunk": "0", "mobile": r"696\d{6}"},
+	"GF": {"code": "594", "trunk": "0", "mobile": r"694\d{6}"},
+}
+
+_NON_DIGITS = re.compile(r"[^\d+]")
+# "+33 (0)6 ...": préfixe national indiqué entre parenthèses après l'indicatif, à ne pas composer
+_TRUNK_IN_PARENTHESES = re.compile(r"\(\s*0\s*\)")
+INTERNATIONAL_PREFIX = "00"
+_E164 = re.compile(r"^\+\d{10,15}$")
+_MOBILE = {
+	country: re.compile(r"^\+" + plan["code"] + plan["mobile"] + r"$")
+	for country, plan in COUNTRY_PLANS.items()
+}
+# Indicatifs les plus longs d'abord: +352 (LU) ne doit pas être lu comme +35
+_COUNTRY_CODE = re.compile(r"^\+(" + "|".join(
+	sorted({plan["code"] for plan in COUNTRY_PLANS.values()}, key=len, reverse=True)
+) + ")")
+_COUNTRIES_BY_CODE = {plan["code"]: country for country, plan in COUNTRY_PLANS.items()}
+
+
+@functools.lru_cache(maxsize=MAX_CACHED_NUMBERS)
+def _to_e164(raw, country):
+	"""(numéro E.164 candidat, valide) pour un numéro brut - résultat mis en cache"""
+	plan = COUNTRY_PLANS.get(country) or COUNTRY_PLANS[DEFAULT_COUNTRY]
+	number = _NON_DIGITS.sub("", _TRUNK_IN_PARENTHESES.sub("", raw))
+
+	if number.startswith(INTERNATIONAL_PREFIX):
+		# Préfixe international composé (0033..., 0032...): équivalent de "+"
+		number = "+" + number[len(INTERNATIONAL_PREFIX):]
+
+	if not number.startswith("+"):
+		# Numéro national: le préfixe national est remplacé par l'indicatif du pays
+		if plan["trunk"] and number.startswith(plan["trunk"]):
+			number = number[len(plan["trunk"]):]
+		number = "+" + plan["code"] + number
+
+	return number, bool(_E164.match(number))
+
+
+def normalize(phone, country=None, strict=True):
+	"""Numéro au format E.164 (+33612345678), None si vide
+
+	`country`: plan appliqué aux numéros nationaux (DEFAULT_COUNTRY par défaut).
+	En mode strict, un numéro invalide lève ValueError; sinon le numéro nettoyé est retourné.
+	"""
+	if not phone:
+		return None
+
+	number, valid = _to_e164(str(phone), country or DEFAULT_COUNTRY)
+	if strict and not valid:
+		raise ValueError(f"Numéro de téléphone invalide: {number}")
+
+	return number
+
+
+def normalize_many(phones, country=None, strict=False):
+	"""Normalise une liste de numéros (imports de campagne), dans l'ordre de la liste
+
+	Les doublons ne sont convertis qu'une fois. En mode strict, un numéro invalide
+	donne None au lieu de lever une exception (un numéro erroné n'arrête pas le lot).
+	"""
+	country = country or DEFAULT_COUNTRY
+	converted = {}
+	numbers = []
+
+	for phone in phones:
+		if not phone:
+			numbers.append(None)
+			continue
+
+		if phone not in converted:
+			number, valid = _to_e164(str(phone), country)
+			converted[phone] = number if valid or not strict else None
+		numbers.append(converted[phone])
+
+	return numbers
+
+
+def get_country(phone, country=None):
+	"""Pays (code ISO) d'un numéro d'après son indicatif, None si inconnu ou invalide"""
+	number = normalize(phone, country, strict=False)
+	match = _COUNTRY_CODE.match(number or "")
+	return _COUNTRIES_BY_CODE[match.group(1)] if match else None
+
+
+def is_mobile(phone, country=None):
+	"""Vrai si le numéro est un mobile d'après le plan de son pays (pays inconnus: False)"""
+	number = normalize(phone, country, strict=False)
+	code = get_country(number)
+	return bool(code and _MOBILE[code].match(number))
+
+
+def get_cache_statistics():
+	"""Statistiques du cache de conversion du process courant"""
+	info = _to_e164.cache_info()
+	return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize}
+
+
+def clear_cache():
+	"""Vide le cache de conversion (tests, modification des plans)"""
+	_to_e164.cache_clear()
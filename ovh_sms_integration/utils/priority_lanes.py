@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Voies de priorité des envois SMS
+Les notifications transactionnelles (paiements, livraisons, rappels) et les campagnes
+marketing ont chacune leur part du débit OVH, leur poids d'ordonnancement dans
+l'outbox et leur priorité de job OVH.
+"""
+
+from __future__ import unicode_literals
+
+LANE_TRANSACTIONAL = "Transactionnel"
+LANE_MARKETING = "Marketing"
+DEFAULT_LANE = LANE_TRANSACTIONAL
+
+# weight: part des lignes réclamées par lot de l'outbox
+# rate_share: part par défaut du débit OVH (rate_limit_per_minute)
+# ovh_priority: valeur du champ "priority" des jobs OVH
+LANES = {
+	LANE_TRANSACTIONAL: {"key": "transactional", "weight": 3, "rate_share": 0.7, "ovh_priority": "high"},
+	LANE_MARKETING: {"key": "marketing", "weight": 1, "rate_share": 0.3, "ovh_priority": "low"},
+}
+
+
+def get_lane(lane=None):
+	"""Retourne la configuration d'une voie (transactionnelle par défaut)"""
+	return LANES.get(lane or DEFAULT_LANE) or LANES[DEFAULT_LANE]
+
+
+def lanes_by_weight():
+	"""Noms des voies, la plus prioritaire en premier"""
+	return sorted(LANES, key=lambda lane: LANES[lane]["weight"], reverse=True)
+
+
+def allocate_quotas(total):
+	"""Répartit `total` places entre les voies au prorata de leur poids (au moins 1 chacune)"""
+	weights = sum(config["weight"] for config in LANES.values())
+	quotas = {}
+
+	for lane in lanes_by_weight():
+		quotas[lane] = max(1, int(round(total * LANES[lane]["weight"] / float(weights))))
+
+	return quotas
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Limiteur de débit distribué (token bucket) pour les envois OVH
+L'état du seau est stocké dans Redis (frappe.cache) et mis à jour par un script
+Lua atomique: tous les workers partagent le même budget par service OVH
+"""
+
+from __future__ import unicode_literals
+import asyncio
+import time
+import frappe
+from frappe.utils import cint, flt
+
+BUCKET_PREFIX = "ovh_sms:rate_limit:"
+STATS_PREFIX = "ovh_sms:rate_limit_stats:"
+MAX_SLEEP = 1.0  # Attente max entre deux tentatives (secondes)
+
+# Recharge le seau selon le temps écoulé (horloge Redis) puis consomme si possible
+# Retourne {1 si accordé sinon 0, attente estimée en secondes}
+TOKEN_BUCKET_SCRIPT = """
+if redis.replicate_commands then redis.replicate_commands() end
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= requested then
+	tokens = tokens - requested
+else
+	wait = (requested - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+if wait == 0 then
+	return {1, '0'}
+end
+return {0, tostring(wait)}
+"""
+
+_script = None
+
+
+class RateLimitExceeded(Exception):
+	"""Aucun jeton obtenu dans le délai imparti"""
+	pass
+
+
+def _get_script():
+	"""Enregistre le script Lua une fois par processus (EVALSHA ensuite)"""
+	global _script
+	if _script is None:
+		_script = frappe.cache().register_script(TOKEN_BUCKET_SCRIPT)
+	return _script
+
+
+class TokenBucket(object):
+	"""Seau à jetons partagé: rate_per_minute jetons/minute, capacité burst
+
+	`lenders`: seaux dont les jetons inutilisés peuvent être empruntés quand celui-ci est vide
+	(ex: voie de priorité inactive). Le débit cumulé ne dépasse pas celui de l'ensemble des seaux.
+	"""
+
+	def __init__(self, name, rate_per_minute, burst=None, lenders=None):
+		if rate_per_minute <= 0:
+			raise ValueError("rate_per_minute doit être positif")
+
+		self.name = name
+		self.rate = rate_per_minute / 60.0
+		self.capacity = max(1, cint(burst) or cint(rate_per_minute))
+		self.key = frappe.cache().make_key(BUCKET_PREFIX + name)
+		self.lenders = [lender for lender in (lenders or []) if lender]
+
+	def try_acquire(self, tokens=1):
+		"""Tente de consommer des jetons; retourne (accordé, attente estimée en secondes)"""
+		if tokens > self.capacity:
+			raise ValueError(f"Impossible de demander {tokens} jetons (capacité {self.capacity})")
+
+		allowed, wait = _get_script()(keys=[self.key], args=[self.capacity, self.rate, tokens])
+		if cint(allowed):
+			return True, 0.0
+
+		# Seau vide: emprunt aux seaux inutilisés (jamais d'attente sur un prêteur)
+		for lender in self.lenders:
+			if tokens <= lender.capacity and lender.try_acquire(tokens)[0]:
+				_record(self.name, "borrowed", 0)
+				return True, 0.0
+
+		return False, flt(wait)
+
+	def acquire(self, tokens=1, blocking=True, timeout=None):
+		"""Consomme des jetons
+
+		En mode bloquant, attend au plus `timeout` secondes (None = sans limite).
+		Retourne True si les jetons ont été obtenus.
+		"""
+		started = time.monotonic()
+		waited = 0
+
+		while True:
+			allowed, wait = self.try_acquire(tokens)
+			if waited:
+				waited = time.monotonic() - started
+
+			if allowed:
+				_record(self.name, "acquired", waited)
+				return True
+
+			if not blocking or (timeout is not None and waited + wait > timeout):
+				_record(self.name, "denied", waited)
+				return False
+
+			pause = min(wait, MAX_SLEEP)
+			time.sleep(pause)
+			waited = waited or pause
+
+	async def acquire_async(self, tokens=1, blocking=True, timeout=None):
+		"""Équivalent de acquire() pour une boucle asyncio: attend sans bloquer les autres envois"""
+		started = time.monotonic()
+		waited = 0
+
+		while True:
+			allowed, wait = self.try_acquire(tokens)
+			if waited:
+				waited = time.monotonic() - started
+
+			if allowed:
+				_record(self.name, "acquired", waited)
+				return True
+
+			if not blocking or (timeout is not None and waited + wait > timeout):
+				_record(self.name, "denied", waited)
+				return False
+
+			pause = min(wait, MAX_SLEEP)
+			await asyncio.sleep(pause)
+			waited = waited or pause
+
+	def reset(self):
+		"""Remplit le seau (ex: après changement de configuration)"""
+		frappe.cache().delete(self.key)
+
+
+def get_rate_limiter(service_name, rate_per_minute, burst=None, lenders=None):
+	"""Retourne le seau partagé d'un service OVH, ou None si le débit est illimité"""
+	if not rate_per_minute or rate_per_minute <= 0:
+		return None
+
+	return TokenBucket(service_name, rate_per_minute, burst, lenders)
+
+
+def _record(name, outcome, waited):
+	"""Enregistre les métriques d'attente (partagées entre workers)"""
+	try:
+		cache = frappe.cache()
+		cache.incr(cache.make_key(f"{STATS_PREFIX}{name}:{outcome}"))
+		if waited > 0:
+			cache.incrbyfloat(cache.make_key(f"{STATS_PREFIX}{name}:wait_seconds"), waited)
+			cache.incr(cache.make_key(f"{STATS_PREFIX}{name}:waits"))
+	except Exception:
+		# Les métriques ne doivent jamais bloquer un envoi
+		pass
+
+
+def get_rate_limit_stats(name):
+	"""Retourne les métriques d'un seau: jetons accordés/refusés/empruntés, temps d'attente"""
+	cache = frappe.cache()
+	stats = {}
+
+	for metric in ("acquired", "denied", "borrowed", "waits"):
+		stats[metric] = cint(cache.get(cache.make_key(f"{STATS_PREFIX}{name}:{metric}")))
+
+	stats["wait_seconds"] = round(flt(cache.get(cache.make_key(f"{STATS_PREFIX}{name}:wait_seconds"))), 3)
+	stats["average_wait"] = round(stats["wait_seconds"] / stats["waits"], 3) if stats["waits"] else 0
+
+	return stats
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Encodage et découpage des SMS (GSM 03.38)
+Un texte entièrement couvert par l'alphabet GSM-7 (table de base + table d'extension,
+dont chaque caractère coûte deux septets) tient en 160 caractères, 153 par segment
+une fois concaténé (en-tête UDH). Sinon il part en UCS-2: 70 caractères, 67 par segment.
+Un seul accent hors alphabet GSM (ê, ç, œ...) fait donc passer tout le message en UCS-2.
+"""
+
+from __future__ import unicode_literals
+import re
+
+ENCODING_GSM7 = "GSM-7"
+ENCODING_UCS2 = "UCS-2"
+
+GSM7_SINGLE, GSM7_MULTI = 160, 153
+UCS2_SINGLE, UCS2_MULTI = 70, 67
+
+GSM7_BASIC = (
+	"@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+	"¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+GSM7_EXTENSION = "\f^{}\\[~]|€"
+
+_NOT_GSM7 = re.compile("[^" + re.escape(GSM7_BASIC + GSM7_EXTENSION) + "]")
+_GSM7_EXTENSION = re.compile("[" + re.escape(GSM7_EXTENSION) + "]")
+_ASTRAL = re.compile("[\U00010000-\U0010FFFF]")  # Deux unités UTF-16 (emoji...)
+
+# Équivalents GSM-7 des caractères courants en français (et de la typographie bureautique)
+TRANSLITERATIONS = str.maketrans({
+	"â": "a", "á": "a", "ã": "a", "ê": "e", "ë": "e", "î": "i", "ï": "i", "í": "i", "ô": "o", "ó": "o",
+	"õ": "o", "û": "u", "ú": "u", "ç": "c", "ÿ": "y",
+	"À": "A", "Â": "A", "Á": "A", "È": "E", "Ê": "E", "Ë": "E", "Î": "I", "Ï": "I", "Ô": "O", "Û": "U",
+	"Ù": "U", "Ÿ": "Y",
+	"œ": "oe", "Œ": "OE",
+	"’": "'", "‘": "'", "“": '"', "”": '"', "«": '"', "»": '"',
+	"–": "-", "—": "-", "…": "...", "\u00a0": " ", "\u202f": " ", "\t": " "
+})
+
+
+def is_gsm7(text):
+	"""Vrai si le texte s'encode entièrement en GSM-7"""
+	return not _NOT_GSM7.search(text or "")
+
+
+def analyze(text):
+	"""Retourne (encodage, unités utilisées, nombre de segments) d'un texte
+
+	Les unités sont des septets en GSM-7 (extension = 2) et des unités UTF-16 en UCS-2.
+	"""
+	text = text or ""
+
+	if is_gsm7(text):
+		units = len(text) + len(_GSM7_EXTENSION.findall(text))
+		encoding, single, multi = ENCODING_GSM7, GSM7_SINGLE, GSM7_MULTI
+	else:
+		units = len(text) + len(_ASTRAL.findall(text))
+		encoding, single, multi = ENCODING_UCS2, UCS2_SINGLE, UCS2_MULTI
+
+	segments = 1 if units <= single else -(-units // multi)
+	return encoding, units, segments
+
+
+def segment_count(text):
+	"""Nombre de SMS facturés pour un texte"""
+	return analyze(text)[2]
+
+
+def transliterate(text):
+	"""Remplace les caractères hors GSM-7 par leur équivalent le plus proche quand il existe"""
+	return (text or "").translate(TRANSLITERATIONS)
+
+
+def fit_gsm7(text):
+	"""Texte translittéré s'il coûte moins de segments, texte d'origine sinon"""
+	converted = transliterate(text)
+	if converted != text and segment_count(converted) < segment_count(text):
+		return converted
+	return text
+
+
+def estimate_totals(texts, cost_per_segment=0):
+	"""Totaux d'une liste de messages rendus, en un seul passage
+
+	Les textes identiques ne sont analysés qu'une fois.
+	"""
+	totals = {"messages": 0, "segments": 0, "gsm7": 0, "ucs2": 0, "multipart": 0}
+	analyzed = {}
+
+	for text in texts:
+		result = analyzed.get(text)
+		if result is None:
+			result = analyzed[text] = analyze(text)
+
+		encoding, units, segments = result
+		totals["messages"] += 1
+		totals["segments"] += segments
+		totals["gsm7" if encoding == ENCODING_GSM7 else "ucs2"] += 1
+		if segments > 1:
+			totals["multipart"] += 1
+
+	totals["cost"] = totals["segments"] * (cost_per_segment or 0)
+	return totals
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+Rendu des templates SMS (Jinja2)
+Un Environment unique et un cache LRU borné de templates compilés, indexé par l'empreinte
+du texte: un template n'est analysé et compilé qu'une fois par process, puis chaque
+message ne coûte que l'appel à render(). render_many() rend un lot de destinataires
+d'un coup (une seule fois si le texte ne dépend pas du destinataire).
+Les templates sont saisis par les utilisateurs: ils sont exécutés dans un bac à sable
+Jinja2 (pas d'accès aux attributs internes Python) avec, pour chaque rendu, une limite
+de temps (contrôlée à chaque appel et à chaque tour de boucle) et de taille (sortie et
+chaînes construites par * + ~). validate_template() les vérifie à l'enregistrement.
+"""
+
+from __future__ import unicode_literals
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import frappe
+from frappe import _
+from jinja2 import TemplateSyntaxError, meta, nodes
+from jinja2.exceptions import SecurityError
+from jinja2.sandbox import SandboxedEnvironment, safe_range
+from jinja2.visitor import NodeTransformer
+from ovh_sms_integration.utils.sms_encoding import segment_count
+
+MAX_CACHED_TEMPLATES = 256
+
+# Budget d'un rendu: un template pathologique échoue au lieu de bloquer le worker
+RENDER_TIME_LIMIT = 0.2  # secondes
+MAX_RENDERED_LENGTH = 2000  # caractères, bien au-delà d'un SMS long
+# À l'enregistrement, un rendu d'exemple doit tenir dans une fraction du budget
+VALIDATION_TIME_LIMIT = 0.02
+SAMPLE_VALUE = "Exemple"
+BUDGET_CHECK_INTERVAL = 1000  # Itérations de range() entre deux contrôles du temps
+
+_budget = threading.local()
+
+
+class TemplateBudgetExceeded(SecurityError):
+	"""Rendu interrompu: limite de temps ou de taille dépassée"""
+
+
+def _check_deadline():
+	deadline = getattr(_budget, "deadline", None)
+	if deadline is not None and time.monotonic() > deadline:
+		raise TemplateBudgetExceeded(_("Temps de rendu du template dépassé ({0} s)").format(RENDER_TIME_LIMIT))
+
+
+def _check_length(length):
+	if length > MAX_RENDERED_LENGTH:
+		raise TemplateBudgetExceeded(_("Taille maximale du message dépassée ({0} caractères)").format(MAX_RENDERED_LENGTH))
+
+
+def _budgeted_range(*args):
+	"""range() du bac à sable, interrompu si le temps de rendu est dépassé"""
+	for index, value in enumerate(safe_range(*args)):
+		if not index % BUDGET_CHECK_INTERVAL:
+			_check_deadline()
+		yield value
+
+
+def _budgeted_iter(iterable):
+	"""Itérable d'une boucle {% for %}: le temps est contrôlé à chaque tour, même si le corps est vide"""
+	for value in iterable:
+		_check_deadline()
+		yield value
+
+
+def _budgeted_text(value):
+	"""Résultat d'une concaténation ~ (y compris dans {% set %}): taille bornée"""
+	_check_length(len(value))
+	return value
+
+
+class _BudgetTransformer(NodeTransformer):
+	"""Réécrit l'arbre du template: boucles et concaténations passent par les filtres de budget"""
+
+	def visit_For(self, node):
+		node = self.generic_visit(node)
+		node.iter = nodes.Filter(node.iter, "budgeted_iter", [], [], None, None, lineno=node.lineno)
+		return node
+
+	def visit_Concat(self, node):
+		node = self.generic_visit(node)
+		return nodes.Filter(node, "budgeted_text", [], [], None, None, lineno=node.lineno)
+
+
+class BudgetedEnvironment(SandboxedEnvironment):
+	"""Bac à sable Jinja2 qui contrôle le budget à chaque appel et à chaque tour de boucle,
+	et borne la taille des chaînes et listes construites (* + ~)"""
+
+	intercepted_binops = frozenset(["*", "**", "+"])
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.filters["budgeted_iter"] = _budgeted_iter
+		self.filters["budgeted_text"] = _budgeted_text
+
+	def _generate(self, source, name, filename, defer_init=False):
+		# Point d'extension de Jinja2 entre l'analyse et la génération du code Python
+		source = _BudgetTransformer().visit(source)
+		source.set_environment(self)
+		return super()._generate(source, name, filename, defer_init=defer_init)
+
+	def call(__self, __context, __obj, *args, **kwargs):
+		_check_deadline()
+		return super().call(__context, __obj, *args, **kwargs)
+
+	def call_binop(self, context, operator, left, right):
+		_check_deadline()
+		sized = (str, list, tuple)
+		if operator == "*":
+			for sequence, count in ((left, right), (right, left)):
+				if isinstance(sequence, sized) and isinstance(count, int):
+					_check_length(len(sequence) * count)
+		elif operator == "+" and isinstance(left, sized) and isinstance(right, sized):
+			_check_length(len(left) + len(right))
+		elif operator == "**" and isinstance(right, (int, float)) and abs(right) > 100:
+			raise TemplateBudgetExceeded(_("Exposant trop grand dans le template"))
+
+		return super().call_binop(context, operator, left, right)
+
+
+# Mêmes réglages par défaut que jinja2.Template(texte), dans un bac à sable
+_environment = BudgetedEnvironment()
+_environment.globals["range"] = _budgeted_range
+_templates = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def template_key(text):
+	"""Empreinte du texte d'un template (clé du cache)"""
+	return hashlib.sha1((text or "").encode("utf-8")).hexdigest()
+
+
+def _get_entry(text):
+	"""Entrée du cache: (template compilé, variables utilisées par le template)"""
+	key = template_key(text)
+
+	with _lock:
+		entry = _templates.get(key)
+		if entry is not None:
+			_templates.move_to_end(key)
+			_stats["hits"] += 1
+			return entry
+
+	# Compilation hors verrou: au pire deux threads compilent le même texte une fois
+	source = text or ""
+	entry = (
+		_environment.from_string(source),
+		frozenset(meta.find_undeclared_variables(_environment.parse(source)))
+	)
+
+	with _lock:
+		_stats["misses"] += 1
+		_templates[key] = entry
+		_templates.move_to_end(key)
+		while len(_templates) > MAX_CACHED_TEMPLATES:
+			_templates.popitem(last=False)
+			_stats["evictions"] += 1
+
+	return entry
+
+
+def get_template(text):
+	"""Retourne le template compilé correspondant au texte (compilé au premier appel)"""
+	return _get_entry(text)[0]
+
+
+def get_variables(text):
+	"""Noms des variables de contexte utilisées par le template (analyse mise en cache)"""
+	return _get_entry(text)[1]
+
+
+def _render_budgeted(template, context, time_limit=RENDER_TIME_LIMIT):
+	"""Rend un template par morceaux en contrôlant le temps écoulé et la taille produite"""
+	_budget.deadline = time.monotonic() + time_limit
+	try:
+		parts, length = [], 0
+		for part in template.generate(**context):
+			length += len(part)
+			_check_length(length)
+			_check_deadline()
+			parts.append(part)
+
+		return "".join(parts)
+	finally:
+		_budget.deadline = None
+
+
+def render(text, context):
+	"""Rend un template SMS avec le contexte fourni (les erreurs Jinja2 sont propagées)
+
+	Lève TemplateBudgetExceeded si le rendu dépasse RENDER_TIME_LIMIT ou MAX_RENDERED_LENGTH.
+	"""
+	return _render_budgeted(get_template(text), context)
+
+
+def select_builders(builders, variables=None):
+	"""Constructeurs des seules variables utilisées par le template: [(variable, fonction)]
+
+	builders: {variable: fonction}; variables: résultat de get_variables() (None = toutes).
+	À appeler une fois par lot, puis build_context() par destinataire.
+	"""
+	return [(key, build) for key, build in builders.items() if variables is None or key in variables]
+
+
+def build_context(builders, *args):
+	"""Contexte construit à partir de select_builders(): chaque fonction reçoit `args`"""
+	return {key: build(*args) for key, build in builders}
+
+
+def _render_chunk(text, contexts):
+	"""Rendu d'un lot de contextes avec le template compilé en cache"""
+	template = get_template(text)
+	return [_render_budgeted(template, context) for context in contexts]
+
+
+def render_many(text, entries, shared=None):
+	"""Rend un template pour une liste de (destinataire, contexte propre au destinataire)
+
+	`shared` contient les variables communes (campagne, événement). Si le template n'utilise
+	aucune variable propre aux destinataires, il n'est rendu qu'une fois.
+	Retourne [(destinataire, texte, nombre de segments)] dans l'ordre des entrées.
+	"""
+	shared = shared or {}
+	entries = list(entries)
+	if not entries:
+		return []
+
+	if get_variables(text) <= set(shared):
+		rendered = render(text, shared)
+		segments = segment_count(rendered)
+		return [(recipient, rendered, segments) for recipient, context in entries]
+
+	contexts = [dict(shared, **context) for recipient, context in entries]
+	texts = _render_chunk(text, contexts)
+
+	# Les textes identiques (même prénom, même article...) ne sont comptés qu'une fois
+	segments = {}
+	return [
+		(recipient, rendered, segments.get(rendered) or segments.setdefault(rendered, segment_count(rendered)))
+		for (recipient, context), rendered in zip(entries, texts)
+	]
+
+
+def validate_template(text, context=None, label=None):
+	"""Vérifie un template à l'enregistrement: compilation, puis rendu d'exemple chronométré
+
+	`context` fournit des valeurs réalistes; les autres variables valent SAMPLE_VALUE.
+	Les erreurs de syntaxe, les accès interdits par le bac à sable et les templates trop
+	lents ou trop longs bloquent l'enregistrement; une autre erreur de rendu (valeur
+	d'exemple inadaptée) n'est signalée qu'en avertissement.
+	"""
+	if not text:
+		return
+
+	label = label or _("Template SMS")
+	try:
+		template = get_template(text)
+	except TemplateSyntaxError as e:
+		frappe.throw(_("{0}: syntaxe invalide (ligne {1}): {2}").format(label, e.lineno, e.message))
+
+	sample = dict.fromkeys(get_variables(text), SAMPLE_VALUE)
+	sample.update({key: value for key, value in (context or {}).items() if key in sample})
+
+	started = time.monotonic()
+	try:
+		_render_budgeted(template, sample)
+	except SecurityError as e:
+		frappe.throw(_("{0}: template refusé ({1})").format(label, e))
+	except Exception as e:
+		frappe.msgprint(_("{0}: rendu d'exemple impossible ({1})").format(label, e), indicator="orange")
+		return
+
+	elapsed = time.monotonic() - started
+	if elapsed > VALIDATION_TIME_LIMIT:
+		frappe.throw(_("{0}: template trop lent, {1} ms par message (maximum {2} ms)").format(
+			label, int(elapsed * 1000), int(VALIDATION_TIME_LIMIT * 1000)
+		))
+
+
+def validate_template_fields(doc, fieldnames, context=None):
+	"""À appeler dans validate: vérifie les champs template nouveaux ou modifiés"""
+	for fieldname in fieldnames:
+		if doc.get(fieldname) and (doc.is_new() or doc.has_value_changed(fieldname)):
+			validate_template(doc.get(fieldname), context, doc.meta.get_label(fieldname))
+
+
+def invalidate(*texts):
+	"""Retire des templates du cache (tous si aucun texte n'est fourni)
+
+	Le cache étant indexé par le contenu, un template modifié ne peut pas être servi
+	périmé: l'invalidation libère seulement la place de l'ancienne version.
+	"""
+	with _lock:
+		if not texts:
+			_templates.clear()
+			return
+
+		for text in texts:
+			_templates.pop(template_key(text), None)
+
+
+def invalidate_changed_templates(doc, fieldnames):
+	"""À appeler dans on_update: invalide les anciennes versions des champs template modifiés"""
+	previous = doc.get_doc_before_save()
+	if not previous:
+		return
+
+	changed = [
+		previous.get(fieldname) for fieldname in fieldnames
+		if doc.has_value_changed(fieldname) and previous.get(fieldname)
+	]
+	if changed:
+		invalidate(*changed)
+
+
+def get_statistics():
+	"""Statistiques du cache de templates du process courant"""
+	with _lock:
+		stats = dict(_stats, size=len(_templates), max_size=MAX_CACHED_TEMPLATES)
+
+	lookups = stats["hits"] + stats["misses"]
+	stats["hit_rate"] = round(stats["hits"] * 100.0 / lookups, 2) if lookups else 0
+
+	return stats
+
+
+@frappe.whitelist()
+def get_template_cache_statistics():
+	"""API: statistiques du cache de templates (process du serveur web)"""
+	return {"success": True, "stats": get_statistics()}
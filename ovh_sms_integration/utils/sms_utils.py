@@ -3,8 +3,13 @@ from __future__ import unicode_literals
 import frappe
 from frappe import _
 import json
-import re
 from datetime import datetime, timedelta
+from ovh_sms_integration.utils.phone_numbers import normalize as normalize_phone_number
+from ovh_sms_integration.utils.sms_templates import render as render_template
+from ovh_sms_integration.ovh_sms_integration.doctype.sms_outbox.sms_outbox import enqueue_sms, enqueue_many
+from ovh_sms_integration.ovh_sms_integration.doctype.sms_send_ledger.sms_send_ledger import (
+	claim_reminders, match_reminder_offset, release_reminders, reminder_key
+)
 
 def get_ovh_sms_settings():
 	"""Récupère les paramètres OVH SMS"""
@@ -13,8 +18,13 @@ def get_ovh_sms_settings():
 		return None
 	return settings
 
-def send_sms(message, receiver, sender=None, context=None):
-	"""Fonction principale d'envoi SMS"""
+def send_sms(message, receiver, sender=None, context=None, reference_doctype=None, reference_name=None,
+		lane=None):
+	"""Fonction principale d'envoi SMS
+	
+	Le SMS est mis en file (SMS Outbox) puis envoyé par les workers d'arrière-plan:
+	l'appelant n'attend jamais l'API OVH. Voie transactionnelle par défaut.
+	"""
 	settings = get_ovh_sms_settings()
 	if not settings:
 		frappe.log_error("OVH SMS non configuré")
@@ -28,59 +38,122 @@ def send_sms(message, receiver, sender=None, context=None):
 		# Validation du numéro
 		receiver = validate_phone_number(receiver)
 		
-		# Envoi du SMS
-		result = settings.send_sms(message, receiver, sender)
-		return result
+		# Mise en file du SMS
+		outbox = enqueue_sms(receiver, message, sender, reference_doctype, reference_name, lane)
+		return {
+			"success": True,
+			"queued": True,
+			"message": f"SMS mis en file d'attente vers {receiver}",
+			"outbox": outbox
+		}
 		
 	except Exception as e:
 		frappe.log_error(f"Erreur envoi SMS: {str(e)}")
 		return None
 
+def enqueue_bulk_sms(messages, sender=None):
+	"""Met en file une liste de (destinataire, message, type de document, document)
+	
+	Retourne les résultats dans l'ordre de la liste (None si le numéro est invalide).
+	"""
+	settings = get_ovh_sms_settings()
+	if not settings:
+		frappe.log_error("OVH SMS non configuré")
+		return [None] * len(messages)
+	
+	entries = []
+	results = []
+	for receiver, message, reference_doctype, reference_name in messages:
+		try:
+			receiver = validate_phone_number(receiver)
+			if not receiver:
+				raise ValueError("Numéro mobile manquant")
+		except Exception as e:
+			frappe.log_error(f"Erreur envoi SMS: {str(e)}")
+			results.append(None)
+			continue
+		
+		entries.append({
+			"receiver": receiver,
+			"message": message,
+			"reference_doctype": reference_doctype,
+			"reference_name": reference_name
+		})
+		results.append({
+			"success": True,
+			"queued": True,
+			"message": f"SMS mis en file d'attente vers {receiver}"
+		})
+	
+	try:
+		enqueue_many(entries, sender)
+	except Exception as e:
+		frappe.log_error(f"Erreur mise en file SMS groupée: {str(e)}")
+		return [None] * len(messages)
+	
+	return results
+
+def send_bulk_sms(messages, sender=None):
+	"""Envoie une liste de (destinataire, message) en regroupant les textes identiques
+	
+	Retourne les résultats dans l'ordre de la liste.
+	"""
+	settings = get_ovh_sms_settings()
+	if not settings:
+		frappe.log_error("OVH SMS non configuré")
+		return [None] * len(messages)
+	
+	prepared = []
+	invalid = {}
+	for index, (receiver, message) in enumerate(messages):
+		try:
+			prepared.append((validate_phone_number(receiver), message))
+		except Exception as e:
+			frappe.log_error(f"Erreur envoi SMS: {str(e)}")
+			prepared.append((None, message))
+			invalid[index] = {
+				"success": False, "message": str(e), "retryable": False,
+				"error_class": "invalid_number", "http_status": None
+			}
+	
+	try:
+		results = settings.send_grouped(prepared, sender)
+	except Exception as e:
+		frappe.log_error(f"Erreur envoi SMS groupé: {str(e)}")
+		return [None] * len(messages)
+	
+	# Numéro invalide: l'erreur de validation plutôt que "Numéro mobile manquant"
+	return [invalid.get(index, result) for index, result in enumerate(results)]
+
 def format_message_template(template, context):
 	"""Formate un template de message avec les données du contexte"""
 	if not template or not context:
 		return template
 	
 	try:
-		# Utilise le système de templates Jinja2 de Frappe
-		from jinja2 import Template
-		
-		# Sécurisation des données
-		safe_context = {}
-		for key, value in context.items():
-			if isinstance(value, (str, int, float)):
-				safe_context[key] = value
-			elif hasattr(value, 'strftime'):  # datetime
-				safe_context[key] = value.strftime('%d/%m/%Y %H:%M')
-			else:
-				safe_context[key] = str(value)
-		
-		template_obj = Template(template)
-		return template_obj.render(**safe_context)
+		# Template compilé mis en cache (un seul parse par texte)
+		return render_template(template, make_safe_context(context))
 		
 	except Exception as e:
 		frappe.log_error(f"Erreur formatage template: {str(e)}")
 		return template
 
-def validate_phone_number(phone):
-	"""Valide et formate un numéro de téléphone"""
-	if not phone:
-		return None
-	
-	# Nettoyage du numéro
-	phone = re.sub(r'[^\d+]', '', str(phone))
-	
-	# Format français
-	if phone.startswith('0'):
-		phone = '+33' + phone[1:]
-	elif not phone.startswith('+'):
-		phone = '+33' + phone
-	
-	# Validation basique
-	if not re.match(r'^\+\d{10,15}$', phone):
-		raise ValueError(f"Numéro de téléphone invalide: {phone}")
+def make_safe_context(context):
+	"""Sécurisation des données: chaînes, nombres et dates formatées uniquement"""
+	safe_context = {}
+	for key, value in context.items():
+		if isinstance(value, (str, int, float)):
+			safe_context[key] = value
+		elif hasattr(value, 'strftime'):  # datetime
+			safe_context[key] = value.strftime('%d/%m/%Y %H:%M')
+		else:
+			safe_context[key] = str(value)
 	
-	return phone
+	return safe_context
+
+def validate_phone_number(phone):
+	"""Valide et formate un numéro de téléphone (E.164, ValueError si invalide)"""
+	return normalize_phone_number(phone)
 
 def get_contact_mobile(doc):
 	"""Récupère le numéro de mobile d'un document"""
@@ -112,17 +185,33 @@ def on_document_cancel(doc, method):
 	"""Handler générique pour les annulations de documents"""
 	pass
 
+def queue_document_sms(doc, template, context):
+	"""Met en file le SMS d'un document soumis
+	
+	Appelé depuis on_submit: le message est rendu et le destinataire résolu dans la
+	transaction de soumission, puis l'envoi OVH part en arrière-plan après le commit
+	(aucun SMS si la soumission est annulée). Ne lève jamais d'exception vers la soumission.
+	"""
+	try:
+		if not template:
+			return None
+		
+		mobile = get_contact_mobile(doc)
+		if not mobile:
+			return None
+		
+		return send_sms(template, mobile, context=context, reference_doctype=doc.doctype, reference_name=doc.name)
+		
+	except Exception as e:
+		frappe.log_error(f"Erreur mise en file SMS {doc.doctype} {doc.name}: {e}")
+		return None
+
 def send_sales_order_sms(doc, method):
 	"""Envoie un SMS lors de la soumission d'une commande"""
 	settings = get_ovh_sms_settings()
 	if not settings or not settings.enable_sales_order_sms:
 		return
 	
-	mobile = get_contact_mobile(doc)
-	if not mobile:
-		return
-	
-	template = settings.sales_order_template
 	context = {
 		'name': doc.name,
 		'customer': doc.customer,
@@ -131,7 +220,7 @@ def send_sales_order_sms(doc, method):
 		'transaction_date': doc.transaction_date
 	}
 	
-	send_sms(template, mobile, context=context)
+	queue_document_sms(doc, settings.sales_order_template, context)
 
 def send_payment_confirmation_sms(doc, method):
 	"""Envoie un SMS lors de la confirmation d'un paiement"""
@@ -139,11 +228,6 @@ def send_payment_confirmation_sms(doc, method):
 	if not settings or not settings.enable_payment_sms:
 		return
 	
-	mobile = get_contact_mobile(doc)
-	if not mobile:
-		return
-	
-	template = settings.payment_template
 	context = {
 		'name': doc.name,
 		'paid_amount': doc.paid_amount,
@@ -151,7 +235,7 @@ def send_payment_confirmation_sms(doc, method):
 		'posting_date': doc.posting_date
 	}
 	
-	send_sms(template, mobile, context=context)
+	queue_document_sms(doc, settings.payment_template, context)
 
 def send_delivery_sms(doc, method):
 	"""Envoie un SMS lors de l'expédition"""
@@ -159,18 +243,13 @@ def send_delivery_sms(doc, method):
 	if not settings or not settings.enable_delivery_sms:
 		return
 	
-	mobile = get_contact_mobile(doc)
-	if not mobile:
-		return
-	
-	template = settings.delivery_template
 	context = {
 		'name': doc.name,
 		'customer': doc.customer,
 		'posting_date': doc.posting_date
 	}
 	
-	send_sms(template, mobile, context=context)
+	queue_document_sms(doc, settings.delivery_template, context)
 
 def send_purchase_order_sms(doc, method):
 	"""Envoie un SMS lors de la soumission d'une commande fournisseur"""
@@ -178,11 +257,6 @@ def send_purchase_order_sms(doc, method):
 	if not settings or not settings.enable_purchase_order_sms:
 		return
 	
-	mobile = get_contact_mobile(doc)
-	if not mobile:
-		return
-	
-	template = settings.purchase_order_template
 	context = {
 		'name': doc.name,
 		'supplier': doc.supplier,
@@ -192,7 +266,7 @@ def send_purchase_order_sms(doc, method):
 		'transaction_date': doc.transaction_date
 	}
 	
-	send_sms(template, mobile, context=context)
+	queue_document_sms(doc, settings.purchase_order_template, context)
 
 # === NOUVELLES FONCTIONS POUR LES RAPPELS D'ÉVÉNEMENTS ===
 
@@ -210,8 +284,8 @@ def send_event_reminder_sms(event_doc, recipient_mobile, recipient_name, recipie
 		# Formatage du message
 		message = format_event_reminder_message(template, event_doc, recipient_name, recipient_type)
 		
-		# Envoi du SMS
-		result = send_sms(message, recipient_mobile)
+		# Mise en file du SMS
+		result = send_sms(message, recipient_mobile, reference_doctype="Event", reference_name=event_doc.name)
 		
 		if result and result.get('success'):
 			log_event_reminder_sent(event_doc.name, recipient_name, recipient_type, recipient_mobile)
@@ -223,31 +297,11 @@ def send_event_reminder_sms(event_doc, recipient_mobile, recipient_name, recipie
 		return {"success": False, "message": str(e)}
 
 def format_event_reminder_message(template, event_doc, recipient_name=None, recipient_type="customer"):
-	"""Formate le message de rappel d'événement"""
-	try:
-		context = {
-			'subject': event_doc.subject or '',
-			'description': event_doc.description or '',
-			'event_name': event_doc.name,
-			'start_date': event_doc.starts_on.strftime('%d/%m/%Y') if event_doc.starts_on else '',
-			'start_time': event_doc.starts_on.strftime('%H:%M') if event_doc.starts_on else '',
-			'location': getattr(event_doc, 'location', '') or '',
-			'customer_name': recipient_name if recipient_type == "customer" else '',
-			'employee_name': recipient_name if recipient_type == "employee" else ''
-		}
-		
-		# Calcul de la durée
-		if event_doc.starts_on and event_doc.ends_on:
-			duration = (event_doc.ends_on - event_doc.starts_on).total_seconds() / 60
-			context['duration'] = int(duration)
-		else:
-			context['duration'] = ''
-		
-		return format_message_template(template, context)
-		
-	except Exception as e:
-		frappe.log_error(f"Erreur formatage message rappel: {e}")
-		return template
+	"""Formate le message de rappel d'événement (rendu commun: SMSEventReminder.format_message)"""
+	reminder_settings = frappe.get_single('SMS Event Reminder')
+	names = {'employee_name' if recipient_type == "employee" else 'customer_name': recipient_name}
+	
+	return reminder_settings.format_message(template, event_doc, **names)
 
 def get_events_requiring_reminders():
 	"""Récupère les événements nécessitant un rappel"""
@@ -392,14 +446,24 @@ def process_pending_event_reminders():
 			return {"success": False, "message": "Hors heures d'envoi"}
 		
 		events = get_events_requiring_reminders()
+		reminder_times = reminder_settings.get_reminder_times()
+		now = datetime.now()
 		total_sent = 0
 		total_failed = 0
+		batch = []
 		
 		for event_data in events:
 			try:
 				event_doc = frappe.get_doc("Event", event_data.name)
 				participants = get_event_participants_with_mobile(event_data.name)
 				
+				offset = match_reminder_offset(event_doc.starts_on, reminder_times, now)
+				if offset is None:
+					# Hors de toute fenêtre de rappel: rien à réserver ni à envoyer
+					continue
+				
+				by_type = {}
+				
 				for participant in participants:
 					# Vérifier si on doit envoyer selon la configuration
 					should_send = False
@@ -412,22 +476,45 @@ def process_pending_event_reminders():
 						should_send = True  # Envoyer à tous par défaut
 					
 					if should_send:
-						result = send_event_reminder_sms(
-							event_doc, 
-							participant['mobile'], 
-							participant['name'],
-							participant['type']
+						by_type.setdefault(participant['type'], []).append(participant)
+				
+				# Un rendu groupé par type de participant
+				for recipient_type, group in by_type.items():
+					template = reminder_settings.get_message_template(recipient_type)
+					batch.extend(
+						(event_doc, participant, message, offset)
+						for participant, message, segments in reminder_settings.format_messages(
+							template, event_doc, group, recipient_type
 						)
-						
-						if result and result.get('success'):
-							total_sent += 1
-						else:
-							total_failed += 1
+					)
 			
 			except Exception as e:
 				frappe.log_error(f"Erreur traitement événement {event_data.name}: {e}")
 				total_failed += 1
 		
+		# Idempotence: une seule requête indexée écarte les rappels déjà mis en file
+		keys = [reminder_key(entry[0].name, entry[1]['mobile'], entry[3]) for entry in batch]
+		claimed = claim_reminders(keys)
+		batch = [(entry, key) for entry, key in zip(batch, keys) if key in claimed]
+		
+		# Mise en file: les workers de l'outbox regroupent les textes identiques en jobs OVH
+		results = enqueue_bulk_sms([
+			(participant['mobile'], message, "Event", event_doc.name)
+			for (event_doc, participant, message, offset), key in batch
+		])
+		
+		unqueued = []
+		for ((event_doc, participant, message, offset), key), result in zip(batch, results):
+			if result and result.get('success'):
+				total_sent += 1
+				log_event_reminder_sent(event_doc.name, participant['name'], participant['type'], participant['mobile'])
+			else:
+				total_failed += 1
+				unqueued.append(key)
+		
+		# Les rappels non mis en file restent à envoyer au prochain passage
+		release_reminders(unqueued)
+		
 		# Mise à jour des statistiques
 		if total_sent > 0 or total_failed > 0:
 			update_reminder_statistics(total_sent, total_failed)
@@ -558,12 +645,14 @@ def send_manual_sms(message, receivers, sender=None):
 	if isinstance(receivers, str):
 		receivers = [receivers]
 	
+	# Un seul texte pour tous: envoi en jobs multi-destinataires
+	outcomes = send_bulk_sms([(receiver, message) for receiver in receivers], sender)
+	
 	results = []
-	for receiver in receivers:
-		result = send_sms(message, receiver, sender)
+	for receiver, result in zip(receivers, outcomes):
 		results.append({
 			"receiver": receiver,
-			"success": result is not None,
+			"success": bool(result and result.get("success")),
 			"result": result
 		})
 	